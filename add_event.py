@@ -1,55 +1,31 @@
-from caldav import DAVClient
-from datetime import datetime, timedelta
+from datetime import timedelta, timezone
 from icalendar import Event, Alarm
 from icalendar import Calendar
 from dotenv import load_dotenv
-import os
+import threading
 import hashlib
+import os
 
-load_dotenv(override=True)
-
-def add_event(subject, start_time, end_time, teacher, additional_teachers, room, additional_rooms, class_name):
-    """
-    Add a new event to the SOGo calendar or update an existing one.
-
-    This function creates a new calendar event with the given details or updates an existing event
-    if one with the same start and end time already exists. It also adds an alarm to the event.
-
-    Parameters:
-    subject (str): The subject or title of the event.
-    start_time (datetime): The start time of the event.
-    end_time (datetime): The end time of the event.
-    teacher (str): The primary teacher for the event.
-    additional_teachers (list): A list of additional teachers for the event.
-    room (str): The primary room for the event.
-    additional_rooms (list): A list of additional rooms for the event.
-    class_name (str): The name of the class associated with the event.
-
-    Returns:
-    None
 
-    Note:
-    The function uses environment variables for calendar URL, username, and password.
-    It creates a unique ID for each event based on its details.
-    If an event with the same start and end time exists, it's replaced with the new event.
-    Events in the past (end time before current time) are not added.
-    """
-    url = os.getenv('CALENDAR_URL')
-    username = os.getenv('USERNAME')
-    password = os.getenv('PASSWORD')
+load_dotenv(override=True)
 
-    client = DAVClient(url=url, username=username, password=password)
+_serialized_lock = threading.Lock()
+_serialized = {}
 
-    calendar__ = client.calendar(url=url)
 
+def _serialize(uid, subject, start_time, end_time, teacher, additional_teachers, room, additional_rooms, class_name, until=None, exdates=()):
     caldata = Calendar()
 
-    uid_string = f"{subject}-{start_time}-{end_time}-{teacher}-{additional_teachers}-{room}-{additional_rooms}-{class_name}"
-    uid = hashlib.md5(uid_string.encode('utf-8')).hexdigest()
     event = Event()
-    event.add("dtstamp", datetime.now())
+    # Derived from the lesson instead of the current time, so the same lesson always
+    # serializes to the same bytes.
+    event.add("dtstamp", start_time.astimezone(timezone.utc))
     event.add("dtstart", start_time)
     event.add("dtend", end_time)
+    if until is not None:
+        event.add("rrule", {"freq": "weekly", "until": until.astimezone(timezone.utc)})
+        if exdates:
+            event.add("exdate", list(exdates))
     event.add("uid", uid)
     event.add("class", "PRIVATE")
     event.add("summary", subject)
@@ -69,21 +45,127 @@ def add_event(subject, start_time, end_time, teacher, additional_teachers, room,
     alarm.add("trigger", timedelta(minutes=-5))
     event.add_component(alarm)
 
-    new_event = caldata.to_ical()
-    start = datetime.now()
-    end = datetime.now() + timedelta(days=int(os.getenv('DAYS_TO_UPDATE')))
-    existing_events = calendar__.date_search(start, end)
-    event_exists = False
-    for existing_event in existing_events:
-        if existing_event.vobject_instance.vevent.dtstart.value == start_time and existing_event.vobject_instance.vevent.dtend.value == end_time:
-            if existing_event.vobject_instance.vevent.uid.value != str(uid):
-                event_exists = True
-                existing_event.delete()
-                calendar__.save_event(new_event)
+    return caldata.to_ical()
 
-    if end_time < datetime.now().astimezone():
-        return
 
-    if not event_exists:
-        calendar__.save_event(new_event)
+def build_event(subject, start_time, end_time, teacher, additional_teachers, room, additional_rooms, class_name, until=None, exdates=(), uid=None):
+    """
+    Build the iCalendar data for a single lesson, or for a lesson that repeats every week.
+
+    Parameters:
+    subject (str): The subject or title of the event.
+    start_time (datetime): The start time of the event.
+    end_time (datetime): The end time of the event.
+    teacher (str): The primary teacher for the event.
+    additional_teachers (list): A list of additional teachers for the event.
+    room (str): The primary room for the event.
+    additional_rooms (list): A list of additional rooms for the event.
+    class_name (str): The name of the class associated with the event.
+    until (datetime, optional): The start of the last occurrence of a weekly repeating lesson.
+                                Adds a weekly RRULE. Defaults to a single event.
+    exdates (tuple, optional): The start times of the weeks without the repeating lesson.
+    uid (str, optional): The unique ID of the event. Defaults to the MD5 hash of all lesson details,
+                         so it changes whenever the lesson changes.
+
+    Returns:
+    tuple: A tuple containing the unique ID of the event (str) and the serialized calendar (bytes).
 
+    Note:
+    The serialization only depends on the lesson details; even the 'DTSTAMP' is derived from the
+    start time. Serialized events are therefore kept in memory by their ID and details (up to
+    'ICAL_CACHE_SIZE' events, default 4096) and reused in later sync cycles.
+    """
+    uid_string = f"{subject}-{start_time}-{end_time}-{teacher}-{additional_teachers}-{room}-{additional_rooms}-{class_name}"
+    if until is not None:
+        uid_string += f"-{until}-{list(exdates)}"
+    digest = hashlib.md5(uid_string.encode('utf-8')).hexdigest()
+    uid = uid or digest
+
+    with _serialized_lock:
+        ical = _serialized.get((uid, digest))
+    if ical is None:
+        ical = _serialize(uid, subject, start_time, end_time, teacher, additional_teachers, room, additional_rooms, class_name, until, exdates)
+        with _serialized_lock:
+            if len(_serialized) >= int(os.getenv('ICAL_CACHE_SIZE', 4096)):
+                del _serialized[next(iter(_serialized))]
+            _serialized[(uid, digest)] = ical
+    return uid, ical
+
+
+def build_lesson_event(lesson):
+    """
+    Build the iCalendar data for a compressed lesson.
+
+    Parameters:
+    lesson (Lesson): A lesson as returned by compress_events.
+
+    Returns:
+    tuple: A tuple containing the unique ID (str), the start time (datetime), the end time (datetime)
+           and the serialized calendar (bytes) of the event.
+    """
+    uid, ical = build_event(lesson.subject, lesson.start, lesson.end, lesson.teacher,
+                            list(lesson.additional_teachers), lesson.room,
+                            list(lesson.additional_rooms), lesson.class_name)
+    return uid, lesson.start, lesson.end, ical
+
+
+def series_uid(series):
+    """
+    Return the unique ID of a lesson that repeats every week.
+
+    Unlike the ID of a single lesson, it only depends on the details of the lesson and its weekday,
+    time of day and duration, not on the dates of the occurrences. The series keeps its ID while
+    the sync window moves on, so it is updated in place instead of being replaced.
+
+    Parameters:
+    series (LessonSeries): A series as returned by recurrence.compact_series.
+
+    Returns:
+    str: The MD5 hash of the details of the series.
+    """
+    lesson = series.first
+    uid_string = (f"{lesson.subject}-{lesson.start.weekday()}-{lesson.start.time()}-{lesson.start.utcoffset()}-{lesson.end - lesson.start}-"
+                  f"{lesson.teacher}-{list(lesson.additional_teachers)}-{lesson.room}-{list(lesson.additional_rooms)}-{lesson.class_name}-weekly")
+    if series.scope:
+        uid_string += f"-{series.scope}"
+    return hashlib.md5(uid_string.encode('utf-8')).hexdigest()
+
+
+def build_series_event(series):
+    """
+    Build the iCalendar data for a lesson that repeats every week.
+
+    Parameters:
+    series (LessonSeries): A series as returned by recurrence.compact_series or recurrence.continue_series.
+
+    Returns:
+    tuple: A tuple containing the unique ID (str, see series_uid), the start of the first scheduled lesson
+           (datetime), the end of the last one (datetime) and the serialized calendar (bytes) of the event.
+    """
+    lesson = series.first
+    uid, ical = build_event(lesson.subject, series.dtstart, series.dtstart + (lesson.end - lesson.start), lesson.teacher,
+                            list(lesson.additional_teachers), lesson.room,
+                            list(lesson.additional_rooms), lesson.class_name,
+                            series.until, tuple(series.exdates), series_uid(series))
+    return uid, series.start, series.end, ical
+
+
+def build_truncated_series_event(data, until):
+    """
+    Build the iCalendar data of a recurring event that ends earlier.
+
+    Used for a series that is no longer in the schedule, so the occurrences that already took
+    place stay in the calendar.
+
+    Parameters:
+    data (str or bytes): The iCalendar data of the event in the calendar.
+    until (datetime): The start of the last occurrence to keep.
+
+    Returns:
+    bytes: The serialized calendar.
+    """
+    caldata = Calendar.from_ical(data)
+    for event in caldata.walk("VEVENT"):
+        event["rrule"]["UNTIL"] = [until.astimezone(timezone.utc)]
+        event["rrule"].pop("COUNT", None)
+    return caldata.to_ical()
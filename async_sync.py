@@ -0,0 +1,453 @@
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urljoin, urlsplit, quote
+from xml.etree import ElementTree
+from dotenv import load_dotenv
+import hashlib
+import asyncio
+import aiohttp
+import vobject
+import json
+import time
+import os
+
+from calendar_snapshot import CalendarSnapshot
+from compress_events import compress_events
+from errors import SessionExpiredError, DeadlineExceeded
+from handle_data import handle_data
+from ics_feed import render_feed, write_feed, feed_version
+from main import print_with_timestamp, get_account_state, get_current_date_and_days_later
+from metrics import stage, count_events, inc, observe, log_record, aiohttp_trace_config
+from reconcile import build_plan
+from recurrence import compact_series
+from write_pipeline import OperationResult, WriteReport
+from request_governor import get_governor, read_only
+import deadline
+
+load_dotenv(override=True)
+
+DAV = "{DAV:}"
+CALDAV = "{urn:ietf:params:xml:ns:caldav}"
+CALENDARSERVER = "{http://calendarserver.org/ns/}"
+
+CALENDAR_QUERY = """<?xml version="1.0" encoding="utf-8"?>
+<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+  <D:prop><D:getetag/><C:calendar-data/></D:prop>
+  <C:filter>
+    <C:comp-filter name="VCALENDAR">
+      <C:comp-filter name="VEVENT"><C:time-range start="{start}" end="{end}"/></C:comp-filter>
+    </C:comp-filter>
+  </C:filter>
+</C:calendar-query>"""
+
+VERSION_PROPFIND = """<?xml version="1.0" encoding="utf-8"?>
+<D:propfind xmlns:D="DAV:" xmlns:CS="http://calendarserver.org/ns/">
+  <D:prop><CS:getctag/><D:sync-token/></D:prop>
+</D:propfind>"""
+
+
+NETWORK_ERRORS = (aiohttp.ClientError,)
+CONNECT_ERRORS = (aiohttp.ClientConnectorError,)
+
+
+class HostLimiter:
+    """
+    Limit the number of concurrent requests per remote host.
+
+    Every host gets its own semaphore with 'MAX_REQUESTS_PER_HOST' slots (default 8), so a
+    slow All4Schools instance does not hold up the CalDAV writes and vice versa.
+    Within these slots, requests are paced and retried by the RequestGovernor (see
+    request_governor).
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit or int(os.getenv('MAX_REQUESTS_PER_HOST', 8))
+        self._semaphores = {}
+
+    def __call__(self, url):
+        host = urlsplit(str(url)).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.limit)
+        return self._semaphores[host]
+
+
+class RemoteEvent:
+    """
+    An event read from the CalDAV server by AsyncCalendar.
+
+    It has the 'url' and 'vobject_instance' attributes CalendarSnapshot and build_plan use,
+    so the async sync plans its changes with the same code as the threaded one.
+    """
+
+    def __init__(self, url, etag, data):
+        self.url = url
+        self.etag = etag
+        self.data = data
+        self._vobject_instance = None
+
+    @property
+    def vobject_instance(self):
+        if self._vobject_instance is None:
+            self._vobject_instance = vobject.readOne(self.data)
+        return self._vobject_instance
+
+
+class AsyncCalendar:
+    """
+    A minimal asyncio CalDAV client for one calendar.
+
+    Only supports what the sync needs: a calendar-query REPORT for a time range, PUT,
+    DELETE and reading the calendar version. Authentication is HTTP Basic, which SOGo,
+    Nextcloud and iCloud all accept.
+    """
+
+    def __init__(self, http, url, username, password, limiter):
+        self.http = http
+        self.url = url if url.endswith("/") else f"{url}/"
+        self.auth = aiohttp.BasicAuth(username, password) if username else None
+        self.limiter = limiter
+
+    async def _request(self, method, url, body=None, headers=None):
+        async def send():
+            async with self.limiter(url):
+                async with self.http.request(method, url, data=body, headers=headers, auth=self.auth, timeout=deadline.aiohttp_timeout(url)) as response:
+                    text = await response.text()
+                    if response.status >= 400 and not (method == "DELETE" and response.status == 404):
+                        error = aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                            message=f"{method} {url} failed", headers=response.headers)
+                        return response.status, response.headers, error
+                    return response.status, response.headers, text
+
+        _, result = await get_governor().send_async(method, url, send, NETWORK_ERRORS, CONNECT_ERRORS)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def date_search(self, start, end):
+        """
+        Return a RemoteEvent for every event between start and end.
+        """
+        body = CALENDAR_QUERY.format(start=start.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+                                     end=end.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ"))
+        text = await self._request("REPORT", self.url, body, {"Depth": "1", "Content-Type": "application/xml; charset=utf-8"})
+        events = []
+        for response in ElementTree.fromstring(text).iter(f"{DAV}response"):
+            href = response.findtext(f"{DAV}href")
+            data = response.findtext(f".//{CALDAV}calendar-data")
+            if href and data:
+                events.append(RemoteEvent(urljoin(self.url, href), response.findtext(f".//{DAV}getetag"), data))
+        return events
+
+    async def version(self):
+        """
+        Return the ctag or sync token of the calendar, or None if the server has neither.
+        """
+        text = await self._request("PROPFIND", self.url, VERSION_PROPFIND, {"Depth": "0", "Content-Type": "application/xml; charset=utf-8"})
+        tree = ElementTree.fromstring(text)
+        return tree.findtext(f".//{CALENDARSERVER}getctag") or tree.findtext(f".//{DAV}sync-token")
+
+    async def save_event(self, uid, ical):
+        """
+        Write an event and return its URL.
+        """
+        url = urljoin(self.url, quote(uid.replace("/", "%2F")) + ".ics")
+        await self._request("PUT", url, ical, {"Content-Type": 'text/calendar; charset="utf-8"'})
+        return url
+
+    async def delete(self, url):
+        """
+        Delete an event. Events that are already gone count as deleted.
+        """
+        await self._request("DELETE", url)
+
+
+async def fetch_schedule(http, limiter, config, session, from_date, to_date):
+    """
+    Fetch the schedule of an account from All4Schools.
+
+    Args:
+        http (aiohttp.ClientSession): The shared HTTP session.
+        limiter (HostLimiter): The per-host request limits.
+        config (SyncConfig): The account.
+        session (All4SchoolsSession): The cookies and IDs of the account.
+        from_date (str): The start of the schedule period.
+        to_date (str): The end of the schedule period.
+
+    Returns:
+        tuple: The schedule data (dict or None if the request failed) and the SHA-256
+               fingerprint of the response body (str or None).
+
+    Raises:
+        SessionExpiredError: If the session cookies are no longer accepted.
+    """
+    url = f"{config.all4schools_url}/api/api/Schedule/GetSchedule"
+    data = {
+        "schoolId": session.school_id,
+        "studentId": session.user_id,
+        "from": from_date,
+        "to": to_date,
+        "getAbsences": False,
+        "getShortNames": False
+    }
+    cookies = {
+        "ASP.NET_SessionId": session.session_id,
+        ".ASPXAUTH": session.auth_token
+    }
+    async def send():
+        async with limiter(url):
+            async with http.post(url, json=data, cookies=cookies, timeout=deadline.aiohttp_timeout(url)) as response:
+                if response.status in (401, 403) or "Login.aspx" in str(response.url):
+                    raise SessionExpiredError(f"Session expired ({response.status} from {response.url})")
+                return response.status, response.headers, await response.read()
+
+    with read_only():
+        status, body = await get_governor().send_async("POST", url, send, NETWORK_ERRORS, CONNECT_ERRORS)
+    if status != 200:
+        print(f"Request failed with status code {status}")
+        return None, None
+    try:
+        return json.loads(body), hashlib.sha256(body).hexdigest()
+    except ValueError:
+        print("Response content is not in JSON format")
+        return None, None
+
+
+async def execute_plan_async(plan, snapshot, calendar):
+    """
+    Apply a sync plan with one asyncio task per operation.
+
+    All operations run concurrently, limited only by the per-host limits of the calendar.
+    A failing operation does not stop the others; its exception is stored in its result.
+    Operations that have not finished when the deadline of the cycle passes are cut off.
+
+    Args:
+        plan (SyncPlan): The plan to apply.
+        snapshot (CalendarSnapshot): The snapshot the plan was built from. It is kept up to date.
+        calendar (AsyncCalendar): The calendar to write to.
+
+    Returns:
+        WriteReport: The outcome of every operation.
+    """
+    async def create(uid, start_time, end_time, ical):
+        url = await calendar.save_event(uid, ical)
+        snapshot.add(uid, start_time, end_time, RemoteEvent(url, None, ical.decode("utf-8")))
+        return url
+
+    async def update(uid, start_time, end_time, ical, replaced):
+        others = {replaced_uid: event for replaced_uid, event in replaced.items() if replaced_uid != uid}
+        await asyncio.gather(*(calendar.delete(event.url) for event in others.values()))
+        for replaced_uid in others:
+            snapshot.discard(replaced_uid)
+        url = await create(uid, start_time, end_time, ical)
+        if uid in replaced and replaced[uid].url != url:
+            await calendar.delete(replaced[uid].url)
+        return url
+
+    async def delete(uid, event):
+        await calendar.delete(event.url)
+        snapshot.discard(uid)
+
+    async def run(kind, function, uid, *args):
+        result = OperationResult(kind, uid)
+        operation_started = time.perf_counter()
+        try:
+            deadline.check(f"the {kind} of {uid}")
+            result.url = await function(uid, *args)
+        except Exception as e:
+            result.error = e
+        result.duration = time.perf_counter() - operation_started
+        return result
+
+    started = time.perf_counter()
+    tasks = [run("create", create, *operation) for operation in plan.creates]
+    tasks += [run("update", update, *operation) for operation in plan.updates]
+    tasks += [run("delete", delete, *operation) for operation in plan.deletes]
+    results = await asyncio.gather(*tasks)
+    return WriteReport(list(results), time.perf_counter() - started)
+
+
+async def main_async(config, http, limiter):
+    """
+    Run one sync cycle for an account without blocking the event loop on network I/O.
+
+    Follows the same steps as main.main. Only the rare All4Schools login still runs in a
+    worker thread. The schedule is fetched in one request and the whole calendar window is
+    downloaded every cycle, and only a single calendar target can be written. Accounts that
+    use a setting listed by unsupported_settings are refused.
+
+    Args:
+        config (SyncConfig): The account to sync.
+        http (aiohttp.ClientSession): The shared HTTP session.
+        limiter (HostLimiter): The per-host request limits.
+
+    Returns:
+        WriteReport or None: The outcome of the writes, None if nothing had to be written or
+                             the schedule was written to the feed file.
+
+    Raises:
+        ValueError: If the account has no calendar or uses settings the async sync does not support.
+    """
+    if not config.targets and not config.ics_feed_file:
+        raise ValueError("Set a calendar_url, calendar_targets or an ics_feed_file")
+    unsupported = unsupported_settings(config)
+    if unsupported:
+        raise ValueError(f"Not supported with ASYNC_SYNC: {', '.join(unsupported)}")
+    target = config.targets[0] if not config.ics_feed_file else None
+    session_manager, sync_state = get_account_state(config, target=target)
+
+    cycle_started = time.perf_counter()
+
+    def log(message):
+        print_with_timestamp(config.log_prefix() + message)
+
+    def finish(result):
+        seconds = time.perf_counter() - cycle_started
+        inc("timesync_cycles_total", result=result, account=config.name)
+        observe("timesync_cycle_duration_seconds", seconds, account=config.name)
+        log_record({"type": "cycle", "account": config.name, "tier": "", "result": result, "seconds": round(seconds, 6)})
+
+    current_date, days_later = get_current_date_and_days_later(config.days_to_add)
+
+    session, _ = await asyncio.to_thread(session_manager.get)
+    with stage("get_data", config.name):
+        try:
+            data, fingerprint = await fetch_schedule(http, limiter, config, session, current_date, days_later)
+        except SessionExpiredError:
+            session_manager.invalidate(session)
+            session, _ = await asyncio.to_thread(session_manager.get)
+            data, fingerprint = await fetch_schedule(http, limiter, config, session, current_date, days_later)
+
+    calendar = AsyncCalendar(http, target.url, target.username, target.password, limiter) if target is not None else None
+    version = feed_version(config.ics_feed_file) if config.ics_feed_file else await calendar.version()
+    if sync_state.is_unchanged(fingerprint, version):
+        log("\033[92mSchedule and calendar unchanged since the last sync, nothing to do.\033[0m")
+        finish("unchanged")
+        return None
+
+    with stage("compress_events", config.name):
+        compressed_data = compress_events(handle_data(data, config.lesson_filter))
+    if config.recurring_lessons:
+        with stage("compact_series", config.name):
+            compressed_data = compact_series(compressed_data, config.recurring_min_occurrences)
+
+    if config.ics_feed_file:
+        with stage("write_feed", config.name):
+            written = write_feed(config.ics_feed_file, render_feed(compressed_data, config.name, config.interval_minutes))
+        if written is None:
+            sync_state.clear()
+            finish("failed")
+            return None
+        log(f"\033[92m{'Wrote' if written else 'Unchanged'} {config.ics_feed_file} with {len(compressed_data)} events\033[0m")
+        sync_state.record(fingerprint, feed_version(config.ics_feed_file), len(compressed_data))
+        finish("applied" if written else "up_to_date")
+        return None
+
+    start = datetime.now()
+    end = start + timedelta(days=max(config.days_to_add, config.days_to_update))
+    with stage("load_calendar", config.name):
+        snapshot = CalendarSnapshot(calendar, await calendar.date_search(start.astimezone(), end.astimezone()))
+    delete_until = datetime.now().astimezone() + timedelta(days=config.days_to_update)
+    with stage("build_plan", config.name):
+        plan = build_plan(compressed_data, snapshot, delete_until)
+    log(f"\033[96mPlan: {plan.summary()}\033[0m")
+
+    report = None
+    if plan:
+        with stage("write_events", config.name):
+            report = await execute_plan_async(plan, snapshot, calendar)
+        for result in report.failed:
+            if not isinstance(result.error, DeadlineExceeded):
+                log(f"\033[91mFailed to {result.kind} event {result.uid}: {result.error}\033[0m")
+        log(f"\033[96mWrites: {report.summary()}\033[0m")
+        if report.cut_off:
+            log(f"\033[93mDeadline reached, {len(report.cut_off)} changes are left for the next cycle\033[0m")
+    count_events(plan, report, config.name)
+    if report is not None and report.failed:
+        sync_state.clear()
+        finish("failed" if len(report.failed) > len(report.cut_off) else "deadline")
+        return report
+
+    sync_state.record(fingerprint, await calendar.version(), len(snapshot))
+    finish("applied" if plan else "up_to_date")
+    return report
+
+
+def unsupported_settings(config):
+    """
+    Return the settings of an account that the async sync does not support.
+
+    Args:
+        config (SyncConfig): The account.
+
+    Returns:
+        list: The names of the unsupported settings, empty if the account is fully supported.
+    """
+    ignored = []
+    if config.event_store_file:
+        ignored.append("event_store_file")
+    if config.tier_entries:
+        ignored.append("tiers")
+    if config.stream_schedule:
+        ignored.append("stream_schedule")
+    if config.fetch_chunk_days:
+        ignored.append("fetch_chunk_days")
+    if len(config.targets) > 1 and not config.ics_feed_file:
+        ignored.append(f"calendar_targets after the first ({len(config.targets) - 1})")
+    return ignored
+
+
+async def run_async_daemon(accounts, max_concurrent=None, stop_event=None):
+    """
+    Sync many accounts from one event loop.
+
+    Every account runs in its own task and is synced every 'interval_minutes' minutes. At most
+    'MAX_CONCURRENT_SYNCS' cycles run at the same time, and all accounts share one aiohttp
+    session whose connection pool is limited by 'MAX_REQUESTS_PER_HOST' per host. Errors of a
+    cycle are logged and do not affect the other accounts. The daemon does not start if any
+    account uses a setting the async sync does not support (see unsupported_settings), so no
+    calendar target or setting is skipped without notice.
+
+    Args:
+        accounts (list): The SyncConfig of every account.
+        max_concurrent (int, optional): Maximum number of concurrent sync cycles. Defaults to
+                                        the 'MAX_CONCURRENT_SYNCS' environment variable, or 4.
+        stop_event (asyncio.Event, optional): Stops the daemon once set.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If an account uses settings the async sync does not support.
+    """
+    unsupported = [f"{config.name}: {', '.join(unsupported_settings(config))}" for config in accounts if unsupported_settings(config)]
+    if unsupported:
+        raise ValueError(f"Not supported with ASYNC_SYNC, unset it to sync these accounts: {'; '.join(unsupported)}")
+
+    max_concurrent = max_concurrent or int(os.getenv('MAX_CONCURRENT_SYNCS', 4))
+    stop_event = stop_event or asyncio.Event()
+    slots = asyncio.Semaphore(max_concurrent)
+    limiter = HostLimiter()
+    connector = aiohttp.TCPConnector(limit_per_host=limiter.limit)
+
+    # Cookies are passed explicitly per request, a shared cookie jar would mix up the accounts.
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(), trace_configs=[aiohttp_trace_config()]) as http:
+        async def run_account(config):
+            while not stop_event.is_set():
+                start_time = time.time()
+                async with slots:
+                    try:
+                        with deadline.cycle_deadline(config.cycle_deadline()):
+                            await main_async(config, http, limiter)
+                        print_with_timestamp(f"{config.log_prefix()}\033[94mIteration took {time.time() - start_time:.2f} seconds.\033[0m")
+                    except DeadlineExceeded as e:
+                        print_with_timestamp(f"{config.log_prefix()}\033[93m{e}, continuing in the next cycle.\033[0m")
+                        inc("timesync_cycles_total", result="deadline", account=config.name)
+                    except Exception as e:
+                        print_with_timestamp(f"{config.log_prefix()}\033[91mSync failed: {e!r}\033[0m")
+                        inc("timesync_cycles_total", result="error", account=config.name)
+                try:
+                    await asyncio.wait_for(stop_event.wait(), config.interval_minutes * 60)
+                except asyncio.TimeoutError:
+                    pass
+
+        print_with_timestamp(f"\033[94mSyncing {len(accounts)} accounts asynchronously with up to {max_concurrent} at a time\033[0m")
+        await asyncio.gather(*(run_account(config) for config in accounts))
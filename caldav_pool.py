@@ -0,0 +1,97 @@
+from caldav import DAVClient
+from dotenv import load_dotenv
+import threading
+import os
+
+from request_governor import GovernedAdapter
+
+load_dotenv(override=True)
+
+_lock = threading.Lock()
+_clients = {}
+_calendars = {}
+
+
+def pool_size():
+    """
+    Return the maximum number of keep-alive connections per CalDAV host.
+
+    The value is read from the 'CALDAV_POOL_SIZE' environment variable and defaults to 10.
+    The sync uses the same number of worker threads, so every worker can hold a connection.
+
+    Returns:
+        int: The pool size.
+    """
+    return int(os.getenv('CALDAV_POOL_SIZE', 10))
+
+
+def get_client(url=None, username=None, password=None):
+    """
+    Return the shared DAVClient for a CalDAV account, creating it on first use.
+
+    The client is created once per process and (url, username) pair, and has a connection
+    pool of its own that keeps at most 'CALDAV_POOL_SIZE' connections per host open and
+    blocks when all of them are in use. Connections are reused by every request of every
+    sync cycle of the client. As every calendar target and account has its own pool, a slow
+    calendar cannot take the connections of the others; the load on a shared server is
+    limited by the RequestGovernor instead. Cookies and authentication stay separate for
+    every client.
+
+    Args:
+        url (str, optional): The CalDAV URL. Defaults to the 'CALENDAR_URL' environment variable.
+        username (str, optional): Defaults to the 'USERNAME' environment variable.
+        password (str, optional): Defaults to the 'PASSWORD' environment variable.
+
+    Returns:
+        caldav.DAVClient: The shared client.
+    """
+    url = url or os.getenv('CALENDAR_URL')
+    username = username or os.getenv('USERNAME')
+    password = password or os.getenv('PASSWORD')
+
+    key = (url, username)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = DAVClient(url=url, username=username, password=password)
+            adapter = GovernedAdapter(pool_connections=int(os.getenv('CALDAV_POOL_HOSTS', 10)), pool_maxsize=pool_size(), pool_block=True)
+            client.session.mount("https://", adapter)
+            client.session.mount("http://", adapter)
+            _clients[key] = client
+        return client
+
+
+def get_calendar(url=None, username=None, password=None):
+    """
+    Return the shared calendar object for a CalDAV URL.
+
+    Args:
+        url (str, optional): The calendar URL. Defaults to the 'CALENDAR_URL' environment variable.
+        username (str, optional): Defaults to the 'USERNAME' environment variable.
+        password (str, optional): Defaults to the 'PASSWORD' environment variable.
+
+    Returns:
+        caldav.Calendar: The calendar, bound to the shared client.
+    """
+    url = url or os.getenv('CALENDAR_URL')
+    username = username or os.getenv('USERNAME')
+    client = get_client(url, username, password)
+
+    key = (url, username)
+    with _lock:
+        calendar__ = _calendars.get(key)
+        if calendar__ is None:
+            calendar__ = client.calendar(url=url)
+            _calendars[key] = calendar__
+        return calendar__
+
+
+def close_all():
+    """
+    Close all shared clients and their connections.
+    """
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _calendars.clear()
@@ -0,0 +1,241 @@
+from datetime import datetime
+from caldav import Event
+from caldav.elements import dav
+from caldav.elements.base import ValuedBaseElement
+from caldav.lib import error
+from caldav.lib.url import URL
+from urllib.parse import unquote, urlsplit
+import threading
+
+from event_store import StoredEvent
+
+
+def _path(url):
+    return unquote(urlsplit(str(url)).path).rstrip("/")
+
+
+class GetCTag(ValuedBaseElement):
+    tag = "{http://calendarserver.org/ns/}getctag"
+
+
+def event_span(event, window_start=None):
+    """
+    Return the UID and the time span of a downloaded event.
+
+    A recurring event spans from its first to the end of its last occurrence, so a LessonSeries
+    is found by the time window it was written with. With a window start, the span starts at
+    the first occurrence that ends after it instead, like the expanded event would. Recurring
+    events without an end are indexed by that single occurrence.
+
+    Args:
+        event (caldav.Event): The event.
+        window_start (datetime, optional): The start of the downloaded window.
+
+    Returns:
+        tuple: The UID, start and end of the event.
+    """
+    vevents = event.vobject_instance.vevent_list
+    vevent = vevents[0]
+    start_time, end_time = vevent.dtstart.value, vevent.dtend.value
+    if "rrule" not in vevent.contents:
+        if len(vevents) > 1:
+            # Expanded by the server, one VEVENT per occurrence.
+            start_time = min(occurrence.dtstart.value for occurrence in vevents)
+            end_time = max(occurrence.dtend.value for occurrence in vevents)
+        return vevent.uid.value, start_time, end_time
+    if not isinstance(start_time, datetime) or start_time.tzinfo is None:
+        return vevent.uid.value, start_time, end_time
+
+    duration = end_time - start_time
+    occurrences = vevent.getrruleset(addRDate=True)
+    if window_start is not None:
+        first = occurrences.after(window_start.astimezone() - duration)
+        if first is not None:
+            start_time, end_time = first, first + duration
+    if any(part in vevent.rrule.value.upper() for part in ("UNTIL=", "COUNT=")):
+        last = list(occurrences)[-1:]
+        if last and last[0] >= start_time:
+            end_time = last[0] + duration
+    return vevent.uid.value, start_time, end_time
+
+
+class CalendarSnapshot:
+    """
+    In-memory index of the calendar events inside the sync window.
+
+    The window is downloaded once per sync cycle and every event is parsed once.
+    Afterwards all create/replace/skip decisions are plain dictionary lookups,
+    either by UID or by the (dtstart, dtend) pair of the event.
+
+    The snapshot is shared between the worker threads of a cycle, so every
+    read and write of the indexes is guarded by a lock.
+    """
+
+    def __init__(self, calendar, events, start=None):
+        self.calendar = calendar
+        self._lock = threading.Lock()
+        self._by_uid = {}
+        self._by_time = {}
+        for event in events:
+            self._add(*event_span(event, start), event)
+
+    @classmethod
+    def fetch(cls, calendar, start, end):
+        """
+        Download all events between start and end and index them.
+
+        The ETag of every event is requested together with its data, so the events can be
+        recorded in an EventStore. Recurring events are not expanded, see event_span.
+
+        Args:
+            calendar (caldav.Calendar): The calendar to read from.
+            start (datetime): Start of the window.
+            end (datetime): End of the window.
+
+        Returns:
+            CalendarSnapshot: The indexed snapshot.
+        """
+        return cls(calendar, calendar.search(start=start, end=end, comp_class=Event, props=[dav.GetEtag()]), start)
+
+    @classmethod
+    def from_entries(cls, calendar, entries):
+        """
+        Build a snapshot from events that are already indexed, for example from an EventStore.
+
+        Args:
+            calendar (caldav.Calendar): The calendar the events belong to.
+            entries (iterable): (uid, dtstart, dtend, event) tuples.
+
+        Returns:
+            CalendarSnapshot: The snapshot.
+        """
+        snapshot = cls(calendar, [])
+        for uid, start_time, end_time, event in entries:
+            snapshot._add(uid, start_time, end_time, event)
+        return snapshot
+
+    def load(self, uids):
+        """
+        Download the iCalendar data of events that were indexed without it, for example from
+        an EventStore, with a single calendar-multiget REPORT.
+
+        Args:
+            uids (iterable): The UIDs of the events. Events that are not in the snapshot or
+                             already have their data are skipped.
+
+        Raises:
+            caldav.lib.error.DAVError: If the server refuses the request.
+        """
+        with self._lock:
+            events = [self._by_uid[uid][2] for uid in uids if uid in self._by_uid]
+        # Reading 'data' of a caldav event serializes its parsed instance again, which is slow.
+        missing = {_path(event.url): event for event in events if isinstance(event, StoredEvent) and event.data is None}
+        if not missing:
+            return
+        for event in self.calendar.calendar_multiget([URL.objectify(str(event.url)) for event in missing.values()]):
+            stored = missing.get(_path(event.url))
+            if stored is not None:
+                stored.data = event.data
+
+    def _add(self, uid, start_time, end_time, event):
+        self._by_uid[uid] = (start_time, end_time, event)
+        self._by_time.setdefault((start_time, end_time), {})[uid] = event
+
+    def _discard(self, uid):
+        entry = self._by_uid.pop(uid, None)
+        if entry is None:
+            return
+        start_time, end_time, _ = entry
+        slot = self._by_time.get((start_time, end_time))
+        if slot is not None:
+            slot.pop(uid, None)
+            if not slot:
+                del self._by_time[(start_time, end_time)]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_uid)
+
+    def __contains__(self, uid):
+        with self._lock:
+            return uid in self._by_uid
+
+    def events(self):
+        """
+        Return a list of all events currently in the snapshot.
+        """
+        with self._lock:
+            return [event for _, _, event in self._by_uid.values()]
+
+    def items(self):
+        """
+        Return a list of (uid, dtstart, dtend, event) tuples for all events in the snapshot.
+        """
+        with self._lock:
+            return [(uid, start_time, end_time, event) for uid, (start_time, end_time, event) in self._by_uid.items()]
+
+    def get(self, uid):
+        """
+        Return the event stored under the given UID, or None.
+        """
+        with self._lock:
+            entry = self._by_uid.get(uid)
+        return entry[2] if entry else None
+
+    def at(self, start_time, end_time):
+        """
+        Return a dict of UID -> event for all events with exactly this start and end time.
+        """
+        with self._lock:
+            return dict(self._by_time.get((start_time, end_time), {}))
+
+    def add(self, uid, start_time, end_time, event):
+        """
+        Record an event that has been written to the calendar.
+        """
+        with self._lock:
+            self._discard(uid)
+            self._add(uid, start_time, end_time, event)
+
+    def discard(self, uid):
+        """
+        Forget an event that has been deleted from the calendar.
+        """
+        with self._lock:
+            self._discard(uid)
+
+
+def calendar_tokens(calendar):
+    """
+    Return the CalendarServer 'getctag' and the RFC 6578 'sync-token' of a calendar.
+
+    Both are read with a single PROPFIND, without downloading events.
+
+    Args:
+        calendar (caldav.Calendar): The calendar to check.
+
+    Returns:
+        tuple: The ctag and the sync token, each None if the server does not support it.
+    """
+    try:
+        properties = calendar.get_properties([GetCTag(), dav.SyncToken()])
+    except error.DAVError:
+        return None, None
+    return properties.get(GetCTag.tag), properties.get(dav.SyncToken.tag)
+
+
+def calendar_version(calendar):
+    """
+    Return a value that changes whenever anything in the calendar changes.
+
+    The CalendarServer 'getctag' property is used if the server has it, otherwise the
+    RFC 6578 'sync-token'. Both are read with a single PROPFIND, without downloading events.
+
+    Args:
+        calendar (caldav.Calendar): The calendar to check.
+
+    Returns:
+        str or None: The ctag or sync token, or None if the server supports neither.
+    """
+    ctag, sync_token = calendar_tokens(calendar)
+    return ctag or sync_token
@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import threading
+import requests
+import hashlib
+import os
+
+from errors import SessionExpiredError, ScheduleFetchError, raise_for_expired_session
+from get_data import schedule_request
+from http_session import get_session
+from request_governor import read_only
+import deadline
+
+load_dotenv(override=True)
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+class CachedChunk:
+    """
+    The last response for one chunk of the schedule.
+
+    Attributes:
+        lessons (list): The raw lesson dictionaries of the chunk.
+        fingerprint (str): The SHA-256 hex digest of the response body.
+        etag (str): The 'ETag' header of the response, if any.
+        last_modified (str): The 'Last-Modified' header of the response, if any.
+    """
+
+    __slots__ = ("lessons", "fingerprint", "etag", "last_modified")
+
+    def __init__(self, lessons, fingerprint, etag=None, last_modified=None):
+        self.lessons = lessons
+        self.fingerprint = fingerprint
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+def split_range(from_date, to_date, chunk_days):
+    """
+    Split a schedule period into chunks of 'chunk_days' days.
+
+    Chunk boundaries lie on a fixed grid of UTC midnights, so the chunks after the first
+    one are the same in every cycle and can be cached. The first chunk starts at
+    'from_date' and ends at the next boundary.
+
+    Args:
+        from_date (str): The start of the period, in the format used by get_data.
+        to_date (str): The end of the period.
+        chunk_days (int): The length of a chunk.
+
+    Returns:
+        list: (from_date, to_date) string tuples, in order.
+    """
+    start = datetime.strptime(from_date, DATE_FORMAT).replace(tzinfo=timezone.utc)
+    end = datetime.strptime(to_date, DATE_FORMAT).replace(tzinfo=timezone.utc)
+    # A Monday, so chunks of 7 days are calendar weeks.
+    epoch = datetime(1970, 1, 5, tzinfo=timezone.utc)
+    step = timedelta(days=chunk_days)
+
+    chunks = []
+    boundary = epoch + ((start - epoch) // step + 1) * step
+    while start < end:
+        chunk_end = min(boundary, end)
+        chunks.append((start.strftime(DATE_FORMAT), chunk_end.strftime(DATE_FORMAT)))
+        start = chunk_end
+        boundary += step
+    return chunks
+
+
+def _prune_cache(account, chunks):
+    current = {account + chunk for chunk in chunks}
+    with _cache_lock:
+        for key in [key for key in _cache if key[:3] == account and key not in current]:
+            del _cache[key]
+
+
+def _fetch_chunk(from_date, to_date, session_id, auth_token, user_id, school_id, base_url):
+    full_url, request = schedule_request(from_date, to_date, session_id, auth_token, user_id, school_id, base_url)
+    key = (full_url, school_id, user_id, from_date, to_date)
+    with _cache_lock:
+        cached = _cache.get(key)
+
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    try:
+        with read_only():
+            response = get_session().post(full_url, headers=headers, **request)
+        raise_for_expired_session(response)
+        if response.status_code == 304 and cached is not None:
+            return cached
+        response.raise_for_status()
+        data = response.json()
+        chunk = CachedChunk(data["lessons"], hashlib.sha256(response.content).hexdigest(),
+                            response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    except SessionExpiredError:
+        raise
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        raise ScheduleFetchError(f"Failed to fetch the schedule from {from_date} to {to_date}: {e!r}") from e
+    with _cache_lock:
+        _cache[key] = chunk
+    return chunk
+
+
+def get_data_chunked(from_date, to_date, session_id, auth_token, user_id, school_id, base_url=None, chunk_days=None, max_workers=None):
+    """
+    Retrieves schedule data from the ALL4SCHOOLS API in chunks of a few days.
+
+    The period is split with split_range and the chunks are fetched concurrently over the
+    shared session. A chunk that is throttled, fails with 502 or 504 or times out is retried
+    on its own by the RequestGovernor, which treats the GetSchedule POST as read-only (see
+    request_governor.read_only). The last response of every chunk is kept in memory and
+    sent as 'If-None-Match' / 'If-Modified-Since' with the next request, so a server that
+    supports conditional requests does not send unchanged chunks again.
+
+    Takes the same parameters as get_data, plus:
+    chunk_days (int, optional): Days per chunk. Defaults to the 'FETCH_CHUNK_DAYS'
+                                environment variable, or 7.
+    max_workers (int, optional): Maximum number of concurrent requests. Defaults to the
+                                 'FETCH_CONCURRENCY' environment variable, or 4.
+
+    Returns:
+    tuple: The schedule data (dict with the lessons of all chunks in order) and the
+           fingerprint (str, the SHA-256 hex digest of the fingerprints of all chunks).
+
+    Raises:
+    SessionExpiredError: If the session cookies are no longer accepted.
+    ScheduleFetchError: If a chunk cannot be fetched.
+    """
+    chunk_days = chunk_days or int(os.getenv('FETCH_CHUNK_DAYS', 7))
+    max_workers = max_workers or int(os.getenv('FETCH_CONCURRENCY', 4))
+
+    chunks = split_range(from_date, to_date, chunk_days)
+    full_url, _ = schedule_request(from_date, to_date, session_id, auth_token, user_id, school_id, base_url)
+    _prune_cache((full_url, school_id, user_id), chunks)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(deadline.bind(lambda chunk: _fetch_chunk(chunk[0], chunk[1], session_id, auth_token, user_id, school_id, base_url)), chunks))
+
+    lessons = []
+    seen = set()
+    fingerprint = hashlib.sha256()
+    for result in results:
+        fingerprint.update(result.fingerprint.encode())
+        for lesson in result.lessons:
+            # A lesson on a chunk boundary can be returned by both chunks. The class is part of the
+            # key, so the same lesson of two classes is kept for both.
+            key = (lesson.get("start"), lesson.get("end"), lesson.get("SubjectName"), lesson.get("StudentClassName"),
+                   lesson.get("TeacherName"), lesson.get("RoomName"))
+            if key not in seen:
+                seen.add(key)
+                lessons.append(lesson)
+
+    return {"lessons": lessons}, fingerprint.hexdigest()
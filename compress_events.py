@@ -1,41 +1,87 @@
-def compress_events(data):
+import numpy as np
+
+from interval_algebra import factorize, merge, to_epoch
+
+
+def lesson_key(lesson):
+    """
+    Return the attributes two lessons must share to be merged into one event.
+
+    Args:
+        lesson (Lesson): The lesson.
+
+    Returns:
+        tuple: The subject, class, teacher and room of the lesson.
+    """
+    return lesson.subject, lesson.class_name, lesson.teacher, lesson.room
+
+
+def compress_events(data, gap=0):
     """
-    Compresses a series of lesson events by combining consecutive lessons with the same attributes.
+    Compresses a series of lesson events by combining lessons with the same attributes.
 
     This function takes a dictionary of lesson data and compresses it by merging
-    consecutive lessons that have the same subject, class, teacher, and room,
-    and where the end time of one lesson is the start time of the next.
+    lessons that have the same subject, class, teacher, and room, and that overlap
+    or directly follow each other. Lessons of other classes in between do not
+    prevent the merge, so timetables of several classes can be compressed at once.
+
+    All lessons are merged in one pass of interval_algebra.merge over epoch arrays.
+    This needs all lessons in memory at once, including those of a streamed schedule
+    (see get_data.stream_schedule), which compress_lessons has already merged as far as
+    it could while the schedule was read.
 
     Args:
         data (dict): A dictionary containing a 'lessons' key, which holds a list
-                     of lesson dictionaries. Each lesson dictionary should have
-                     'SubjectName', 'StudentClassName', 'TeacherName', 'RoomName',
-                     'start', and 'end' keys.
+                     (or any iterable) of Lesson objects as returned by handle_data.
+        gap (int, optional): Seconds between two lessons that still get merged,
+                             for example to join lessons across a short break. Defaults to 0.
 
     Returns:
-        list: A list of compressed lesson dictionaries. Each dictionary in the list
-              represents either a single lesson or a merged series of consecutive
+        list: A list of compressed Lesson objects, ordered by start time. Each lesson in
+              the list represents either a single lesson or a merged series of
               lessons with the same attributes.
     """
-    compressed_lessons = []
+    lessons = list(data["lessons"])
+    if not lessons:
+        return []
+    starts = to_epoch([lesson.start for lesson in lessons])
+    first, last = merge(starts, to_epoch([lesson.end for lesson in lessons]),
+                        factorize([lesson_key(lesson) for lesson in lessons]), gap)
+    order = np.argsort(starts[first], kind="stable")
+
+    compressed = []
+    for start_index, end_index in zip(first[order].tolist(), last[order].tolist()):
+        lesson = lessons[start_index]
+        lesson.end = lessons[end_index].end
+        compressed.append(lesson)
+    return compressed
+
+
+def compress_lessons(lessons):
+    """
+    Merge directly consecutive lessons, one lesson at a time.
+
+    This is a generator: it holds only the lesson that is being merged, so it can be chained
+    after a streamed schedule without building a list of all lessons first. It only merges
+    lessons that follow each other in the schedule; pass its output to compress_events to
+    merge the rest.
+
+    Args:
+        lessons (iterable): Lesson objects in schedule order.
+
+    Yields:
+        Lesson: The compressed lessons.
+    """
     current_lesson = None
 
-    for lesson in data["lessons"]:
+    for lesson in lessons:
         if current_lesson is None:
             current_lesson = lesson
+        elif lesson.continues(current_lesson):
+            current_lesson.end = lesson.end
         else:
-            if (current_lesson['SubjectName'] == lesson['SubjectName'] and
-                current_lesson['StudentClassName'] == lesson['StudentClassName'] and
-                current_lesson['TeacherName'] == lesson['TeacherName'] and
-                current_lesson['RoomName'] == lesson['RoomName'] and
-                current_lesson['end'] == lesson['start']):
-                current_lesson['end'] = lesson['end']
-            else:
-                compressed_lessons.append(current_lesson)
-                current_lesson = lesson
+            yield current_lesson
+            current_lesson = lesson
 
     if current_lesson is not None:
-        compressed_lessons.append(current_lesson)
-
-    return compressed_lessons
-
+        yield current_lesson
@@ -0,0 +1,352 @@
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+import json
+import os
+
+from lesson_filter import LessonFilter
+
+load_dotenv(override=True)
+
+
+class SyncTier:
+    """
+    A band of the sync period with its own refresh interval.
+
+    Attributes:
+        name (str): A name for the band, used in log messages and state files. Empty for a
+                    band that covers the whole sync period.
+        start_days (int): Start of the band, in days from now.
+        end_days (int): End of the band, in days from now.
+        interval_minutes (int): Minutes between two sync cycles of the band.
+    """
+
+    def __init__(self, name, start_days, end_days, interval_minutes):
+        self.name = name
+        self.start_days = int(start_days)
+        self.end_days = int(end_days)
+        self.interval_minutes = int(interval_minutes)
+
+    def __repr__(self):
+        return f"SyncTier({self.name!r}, {self.start_days}, {self.end_days}, {self.interval_minutes})"
+
+
+def build_tiers(entries, days_to_add, interval_minutes):
+    """
+    Split the sync period into consecutive bands.
+
+    Every entry covers the days from the end of the previous entry up to its 'days', for example
+
+        [{"days": 2, "interval_minutes": 5}, {"days": 14, "interval_minutes": 60}]
+
+    syncs the next 2 days every 5 minutes and the days 2 to 14 every hour. Entries beyond
+    'days_to_add' are cut off, and days not covered by an entry are synced every
+    'interval_minutes' minutes.
+
+    Args:
+        entries (list): The bands, or an empty list for a single band.
+        days_to_add (int): Number of days of the schedule to sync.
+        interval_minutes (int): Refresh interval of the days not covered by an entry.
+
+    Returns:
+        list: The SyncTier of every band, in order.
+
+    Raises:
+        ValueError: If an entry is invalid or the entries are not in ascending order.
+    """
+    tiers = []
+    start_days = 0
+    for entry in entries:
+        if not isinstance(entry, dict) or "days" not in entry or "interval_minutes" not in entry:
+            raise ValueError(f"Sync tier {entry!r} needs 'days' and 'interval_minutes'")
+        end_days = min(int(entry["days"]), days_to_add)
+        if end_days <= start_days:
+            if start_days >= days_to_add:
+                break
+            raise ValueError("Sync tiers must be in ascending order of 'days'")
+        tiers.append(SyncTier(f"{start_days}-{end_days}d", start_days, end_days, entry["interval_minutes"]))
+        start_days = end_days
+    if not tiers:
+        return [SyncTier("", 0, days_to_add, interval_minutes)]
+    if start_days < days_to_add:
+        tiers.append(SyncTier(f"{start_days}-{days_to_add}d", start_days, days_to_add, interval_minutes))
+    return tiers
+
+
+class CalendarTarget:
+    """
+    A CalDAV calendar the schedule of an account is written to.
+
+    Attributes:
+        name (str): A name for the target, used in log messages and state files. Empty for
+                    the calendar set in 'calendar_url'.
+        url (str): The CalDAV URL of the calendar.
+        username (str): The CalDAV username.
+        password (str): The CalDAV password.
+    """
+
+    def __init__(self, name, url, username=None, password=None):
+        self.name = name
+        self.url = url
+        self.username = username
+        self.password = password
+
+    @property
+    def label(self):
+        """
+        The name of the target, or the host of its URL for the calendar set in 'calendar_url'.
+        """
+        return self.name or urlsplit(self.url).netloc
+
+    def __repr__(self):
+        return f"CalendarTarget({self.name!r}, {self.url!r})"
+
+
+def build_targets(calendar_url, calendar_username, calendar_password, entries):
+    """
+    Collect the CalDAV calendars the schedule of an account is written to.
+
+    The calendar set in 'calendar_url' comes first, followed by one target per entry, for example
+
+        [{"name": "parents", "calendar_url": "https://example.com/dav/parents/school/",
+          "calendar_username": "parents", "calendar_password": "secret"}]
+
+    Entries without a name are named after their position.
+
+    Args:
+        calendar_url (str): The main calendar, None if the account only has entries.
+        calendar_username (str): The CalDAV username of the main calendar.
+        calendar_password (str): The CalDAV password of the main calendar.
+        entries (list): The additional calendars.
+
+    Returns:
+        list: The CalendarTarget of every calendar.
+
+    Raises:
+        ValueError: If an entry has no 'calendar_url' or two targets have the same name.
+    """
+    targets = [CalendarTarget("", calendar_url, calendar_username, calendar_password)] if calendar_url else []
+    for index, entry in enumerate(entries, start=1):
+        if not isinstance(entry, dict) or not entry.get("calendar_url"):
+            raise ValueError(f"Calendar target {entry!r} needs a 'calendar_url'")
+        targets.append(CalendarTarget(str(entry.get("name") or f"target{index}"), entry["calendar_url"],
+                                      entry.get("calendar_username"), entry.get("calendar_password")))
+    names = [target.name for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError("Calendar targets must have different names")
+    return targets
+
+
+class SyncConfig:
+    """
+    The settings for syncing one All4Schools account into one or more CalDAV calendars.
+
+    Attributes:
+        name (str): A name for the account, used in log messages and state keys.
+        all4schools_url (str): The base URL of the All4Schools instance.
+        all4schools_username (str): The All4Schools username.
+        all4schools_password (str): The All4Schools password.
+        calendar_url (str): The CalDAV URL of the calendar. Not needed with an ics_feed_file.
+        calendar_username (str): The CalDAV username.
+        calendar_password (str): The CalDAV password.
+        days_to_add (int): Number of days of the schedule to sync.
+        days_to_update (int): Number of days in which outdated events are deleted.
+        lessons_to_remove (list): Rules for the lessons to leave out of the calendar.
+        lesson_filter (LessonFilter): The compiled lessons_to_remove rules.
+        interval_minutes (int): Minutes between two sync cycles.
+        session_cache_file (str): The file the All4Schools session is cached in.
+        sync_state_file (str): The file the state of the last applied cycle is stored in.
+        stream_schedule (bool): Parse the schedule while it is downloaded instead of loading
+                                the whole response.
+        fetch_chunk_days (int): Fetch the schedule in chunks of this many days, 0 to fetch it
+                                with a single request.
+        event_store_file (str): The SQLite file of the local event store, None to always
+                                download the calendar.
+        full_sync_hours (float): Hours after which the calendar is downloaded again even if the
+                                 event store is up to date.
+        recurring_lessons (bool): Write lessons that repeat every week as one recurring event
+                                  (see recurrence.compact_series).
+        recurring_min_occurrences (int): The smallest number of weekly lessons written as a
+                                         recurring event.
+        ics_feed_file (str): Write the schedule to this iCalendar file instead of the CalDAV
+                             calendar, None to sync the calendar. The file is written as a
+                             whole, so the sync period is not split into tiers.
+        calendar_targets (list): The settings of the calendars written besides calendar_url.
+        cycle_deadline_seconds (float): The time budget of a sync cycle, 0 to use the
+                                        interval of its band (see SyncConfig.cycle_deadline).
+        targets (list): Every calendar the schedule is written to, see build_targets.
+        tier_entries (list): The band settings the tiers were built from.
+        tiers (list): The bands of the sync period, see build_tiers.
+    """
+
+    def __init__(self, name, all4schools_url, all4schools_username, all4schools_password,
+                 calendar_url=None, calendar_username=None, calendar_password=None, days_to_add=14,
+                 days_to_update=7, lessons_to_remove=None, interval_minutes=10,
+                 session_cache_file=None, sync_state_file=None, stream_schedule=False,
+                 fetch_chunk_days=0, tiers=None, event_store_file=None, full_sync_hours=24,
+                 recurring_lessons=False, recurring_min_occurrences=3, ics_feed_file=None,
+                 calendar_targets=None, cycle_deadline_seconds=0):
+        self.name = name
+        self.all4schools_url = all4schools_url
+        self.all4schools_username = all4schools_username
+        self.all4schools_password = all4schools_password
+        self.calendar_url = calendar_url
+        self.calendar_username = calendar_username
+        self.calendar_password = calendar_password
+        self.days_to_add = int(days_to_add)
+        self.days_to_update = int(days_to_update)
+        self.lessons_to_remove = list(lessons_to_remove or [])
+        self.lesson_filter = LessonFilter(self.lessons_to_remove)
+        self.interval_minutes = int(interval_minutes)
+        self.session_cache_file = session_cache_file or f"session_cache_{name}.json"
+        self.sync_state_file = sync_state_file or f"sync_state_{name}.json"
+        self.stream_schedule = bool(stream_schedule)
+        self.fetch_chunk_days = int(fetch_chunk_days)
+        self.event_store_file = event_store_file or None
+        self.full_sync_hours = float(full_sync_hours)
+        self.recurring_lessons = bool(recurring_lessons)
+        self.recurring_min_occurrences = int(recurring_min_occurrences)
+        self.ics_feed_file = ics_feed_file or None
+        self.calendar_targets = list(calendar_targets or [])
+        self.cycle_deadline_seconds = float(cycle_deadline_seconds or 0)
+        self.targets = build_targets(calendar_url, calendar_username, calendar_password, self.calendar_targets)
+        self.tier_entries = list(tiers or [])
+        self.tiers = build_tiers([] if self.ics_feed_file else self.tier_entries, self.days_to_add, self.interval_minutes)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the configuration of the single account set in the environment variables.
+
+        Returns:
+            SyncConfig: The configuration.
+        """
+        lessons_to_remove = os.getenv('ALL4SCHOOLS_LESSONS_TO_REMOVE')
+        tiers = os.getenv('SYNC_TIERS')
+        calendar_targets = os.getenv('CALENDAR_TARGETS')
+        return cls(
+            name="",
+            all4schools_url=os.getenv('ALL4SCHOOLS_URL'),
+            all4schools_username=os.getenv('ALL4SCHOOLS_USERNAME'),
+            all4schools_password=os.getenv('ALL4SCHOOLS_PASSWORD'),
+            calendar_url=os.getenv('CALENDAR_URL'),
+            calendar_username=os.getenv('USERNAME'),
+            calendar_password=os.getenv('PASSWORD'),
+            days_to_add=os.getenv('DAYS_TO_ADD', 14),
+            days_to_update=os.getenv('DAYS_TO_UPDATE', 7),
+            lessons_to_remove=json.loads(lessons_to_remove) if lessons_to_remove else [],
+            interval_minutes=os.getenv('INTERVAL_MINUTES', 10),
+            session_cache_file=os.getenv('SESSION_CACHE_FILE', 'session_cache.json'),
+            sync_state_file=os.getenv('SYNC_STATE_FILE', 'sync_state.json'),
+            stream_schedule=os.getenv('STREAM_SCHEDULE', '').lower() in ('1', 'true', 'yes'),
+            fetch_chunk_days=os.getenv('FETCH_CHUNK_DAYS', 0),
+            tiers=json.loads(tiers) if tiers else [],
+            event_store_file=os.getenv('EVENT_STORE_FILE'),
+            full_sync_hours=os.getenv('FULL_SYNC_HOURS', 24),
+            recurring_lessons=os.getenv('RECURRING_LESSONS', '').lower() in ('1', 'true', 'yes'),
+            recurring_min_occurrences=os.getenv('RECURRING_MIN_OCCURRENCES', 3),
+            ics_feed_file=os.getenv('ICS_FEED_FILE'),
+            calendar_targets=json.loads(calendar_targets) if calendar_targets else [],
+            cycle_deadline_seconds=os.getenv('CYCLE_DEADLINE_SECONDS', 0)
+        )
+
+    @classmethod
+    def from_dict(cls, data, defaults):
+        """
+        Build the configuration of an account from an entry of the accounts file.
+
+        Settings missing in the entry are taken from the defaults.
+
+        Args:
+            data (dict): The entry of the account.
+            defaults (SyncConfig): The configuration to take missing settings from.
+
+        Returns:
+            SyncConfig: The configuration.
+        """
+        settings = {
+            "all4schools_url": defaults.all4schools_url,
+            "days_to_add": defaults.days_to_add,
+            "days_to_update": defaults.days_to_update,
+            "lessons_to_remove": defaults.lessons_to_remove,
+            "interval_minutes": defaults.interval_minutes,
+            "stream_schedule": defaults.stream_schedule,
+            "fetch_chunk_days": defaults.fetch_chunk_days,
+            "tiers": defaults.tier_entries,
+            "event_store_file": defaults.event_store_file,
+            "full_sync_hours": defaults.full_sync_hours,
+            "recurring_lessons": defaults.recurring_lessons,
+            "recurring_min_occurrences": defaults.recurring_min_occurrences,
+            "cycle_deadline_seconds": defaults.cycle_deadline_seconds
+        }
+        settings.update(data)
+        return cls(**settings)
+
+    def cycle_deadline(self, tier=None):
+        """
+        Return the seconds a sync cycle may take before its remaining work is cancelled.
+
+        Without 'cycle_deadline_seconds' a cycle may take as long as the interval of its band,
+        so a slow cycle never runs into the next one.
+
+        Args:
+            tier (SyncTier, optional): The band of the cycle. Defaults to the whole period.
+
+        Returns:
+            float: The time budget in seconds.
+        """
+        return self.cycle_deadline_seconds or (tier.interval_minutes if tier is not None else self.interval_minutes) * 60
+
+    def log_prefix(self):
+        """
+        Return the prefix for log messages of this account.
+        """
+        return f"\033[95m[{self.name}]\033[0m " if self.name else ""
+
+
+def load_accounts(path):
+    """
+    Load the accounts to sync from a JSON file.
+
+    The file contains a list of objects with the keys of SyncConfig, for example:
+
+        [
+            {
+                "name": "alice",
+                "all4schools_username": "alice",
+                "all4schools_password": "secret",
+                "calendar_url": "https://example.com/SOGo/dav/alice/Calendar/school/",
+                "calendar_username": "alice@example.com",
+                "calendar_password": "secret"
+            }
+        ]
+
+    'all4schools_url', 'days_to_add', 'days_to_update', 'lessons_to_remove',
+    'interval_minutes', 'stream_schedule', 'fetch_chunk_days', 'tiers', 'event_store_file',
+    'full_sync_hours', 'recurring_lessons', 'recurring_min_occurrences' and
+    'cycle_deadline_seconds' default to the environment variables. 'ics_feed_file' and
+    'calendar_targets' do not, as they belong to a single account. All accounts can share
+    one event store file.
+
+    Args:
+        path (str): The path of the accounts file.
+
+    Returns:
+        list: A SyncConfig for every account.
+
+    Raises:
+        ValueError: If the file is not a list of accounts, an account has no name or two
+                    accounts have the same name.
+    """
+    with open(path, encoding='utf-8') as file:
+        entries = json.load(file)
+    if not isinstance(entries, list):
+        raise ValueError(f"{path} must contain a list of accounts")
+
+    defaults = SyncConfig.from_env()
+    if not all(isinstance(entry, dict) and entry.get("name") for entry in entries):
+        raise ValueError(f"Every account in {path} needs a name")
+    accounts = [SyncConfig.from_dict(entry, defaults) for entry in entries]
+    names = [account.name for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path} contains duplicate account names")
+    return accounts
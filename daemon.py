@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import threading
+import heapq
+import time
+import os
+
+from errors import DeadlineExceeded
+from main import main, print_with_timestamp
+from metrics import inc
+
+load_dotenv(override=True)
+
+
+def sync_account(config, tier=None):
+    """
+    Run one sync cycle for an account and report how it went.
+
+    Errors are printed instead of raised, so one failing account does not stop the others.
+    A cycle that runs out of time is reported as such and continued by the next cycle.
+
+    Args:
+        config (SyncConfig): The account to sync.
+        tier (SyncTier, optional): The band of the sync period. Defaults to the whole period.
+
+    Returns:
+        bool: True if the cycle finished without an error.
+    """
+    prefix = config.log_prefix() + (f"\033[95m[{tier.name}]\033[0m " if tier is not None and tier.name else "")
+    start_time = time.time()
+    try:
+        main(config, tier)
+    except DeadlineExceeded as e:
+        print_with_timestamp(f"{prefix}\033[93m{e}, continuing in the next cycle.\033[0m")
+        inc("timesync_cycles_total", result="deadline", account=config.name)
+        return False
+    except Exception as e:
+        print_with_timestamp(f"{prefix}\033[91mSync failed: {e!r}\033[0m")
+        inc("timesync_cycles_total", result="error", account=config.name)
+        return False
+    iteration_duration = time.time() - start_time
+    print_with_timestamp(f"{prefix}\033[94mIteration took {iteration_duration:.2f} seconds.\033[0m")
+    return True
+
+
+def run_daemon(accounts, max_concurrent=None, stop_event=None):
+    """
+    Sync many accounts from one process.
+
+    Every band of every account (see SyncConfig.tiers) is synced every 'interval_minutes'
+    minutes of the band, counted from the end of its previous cycle. Without 'SYNC_TIERS'
+    an account has a single band that covers the whole sync period. At most
+    'MAX_CONCURRENT_SYNCS' cycles run at the same time; accounts that are due while all
+    slots are busy wait for the next free slot, so the number of threads depends on the
+    concurrency limit and not on the number of accounts. Every calendar account keeps a
+    CalDAV client with a connection pool of its own (see caldav_pool.get_client), and the
+    RequestGovernor limits the requests to every host across all accounts.
+
+    Args:
+        accounts (list): The SyncConfig of every account.
+        max_concurrent (int, optional): Maximum number of concurrent sync cycles. Defaults to
+                                        the 'MAX_CONCURRENT_SYNCS' environment variable, or 4.
+        stop_event (threading.Event, optional): Stops the daemon once set. Running cycles are
+                                                finished first.
+
+    Returns:
+        None
+    """
+    max_concurrent = max_concurrent or int(os.getenv('MAX_CONCURRENT_SYNCS', 4))
+    stop_event = stop_event or threading.Event()
+    wake_up = threading.Event()
+    lock = threading.Lock()
+
+    jobs = [(config, tier) for config in accounts for tier in config.tiers]
+    now = time.time()
+    due = [(now, index) for index in range(len(jobs))]
+    heapq.heapify(due)
+
+    print_with_timestamp(f"\033[94mSyncing {len(accounts)} accounts in {len(jobs)} bands with up to {max_concurrent} at a time\033[0m")
+
+    def run(index):
+        config, tier = jobs[index]
+        try:
+            sync_account(config, tier)
+        finally:
+            with lock:
+                heapq.heappush(due, (time.time() + tier.interval_minutes * 60, index))
+            wake_up.set()
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        while not stop_event.is_set():
+            with lock:
+                now = time.time()
+                while due and due[0][0] <= now:
+                    _, index = heapq.heappop(due)
+                    executor.submit(run, index)
+                timeout = due[0][0] - now if due else None
+            wake_up.wait(60 if timeout is None else min(timeout, 60))
+            wake_up.clear()
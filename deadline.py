@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+import contextvars
+import functools
+import json
+import time
+import os
+
+from errors import DeadlineExceeded
+
+load_dotenv(override=True)
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class Deadline:
+    """
+    The point in time by which a sync cycle has to be finished.
+
+    Attributes:
+        seconds (float): The time budget the deadline was created with.
+        expires_at (float): The deadline on the time.monotonic clock.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """
+        Seconds left until the deadline, negative once it has passed.
+        """
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, action="continuing"):
+        """
+        Raise DeadlineExceeded if the deadline has passed.
+
+        Args:
+            action (str, optional): What was about to happen, for the error message.
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline of {self.seconds:g}s reached before {action}")
+
+    def __repr__(self):
+        return f"Deadline({self.seconds:g}s, {self.remaining():.1f}s left)"
+
+
+@contextmanager
+def cycle_deadline(seconds):
+    """
+    Set the deadline of the sync cycle running in the current thread.
+
+    Every HTTP request sent while the deadline is set gets at most the remaining time as its
+    timeout, and no request is sent after it has passed (see request_timeout). Worker threads
+    only see the deadline if their function is wrapped with bind.
+
+    Args:
+        seconds (float): The time budget, 0 or None for no deadline.
+
+    Yields:
+        Deadline or None: The deadline.
+    """
+    token = _current.set(Deadline(seconds) if seconds else None)
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """
+    Return the deadline of the current sync cycle, None if it has none.
+    """
+    return _current.get()
+
+
+def check(action="continuing"):
+    """
+    Raise DeadlineExceeded if the deadline of the current sync cycle has passed.
+
+    Args:
+        action (str, optional): What was about to happen, for the error message.
+    """
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(action)
+
+
+def bind(function):
+    """
+    Wrap a function so it runs with the deadline of the calling thread.
+
+    Use it for functions passed to a ThreadPoolExecutor, whose threads do not inherit the
+    deadline.
+
+    Args:
+        function (callable): The function to wrap.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    deadline = _current.get()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _current.set(deadline)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
+
+
+def host_timeouts(url):
+    """
+    Return the connect and read timeout for the host of a URL.
+
+    The timeouts are read from 'HTTP_TIMEOUTS', a JSON object of host -> [connect, read]
+    (or a single number for both), for example '{"caldav.icloud.com": [5, 120]}'. Hosts
+    that are not listed use 'HTTP_CONNECT_TIMEOUT' (default 10) and 'HTTP_READ_TIMEOUT'
+    (default 60) seconds.
+
+    Args:
+        url (str): The requested URL.
+
+    Returns:
+        tuple: The connect and the read timeout in seconds.
+    """
+    parts = urlsplit(str(url))
+    overrides = json.loads(os.getenv('HTTP_TIMEOUTS') or '{}')
+    timeouts = overrides.get(parts.netloc, overrides.get(parts.hostname))
+    if timeouts is None:
+        return float(os.getenv('HTTP_CONNECT_TIMEOUT', 10)), float(os.getenv('HTTP_READ_TIMEOUT', 60))
+    if isinstance(timeouts, (int, float)):
+        return float(timeouts), float(timeouts)
+    return float(timeouts[0]), float(timeouts[1])
+
+
+def request_timeout(url, timeout=None):
+    """
+    Return the timeout of a request, limited by the deadline of the current sync cycle.
+
+    The read timeout applies to every read from the socket, so a request that keeps
+    receiving data can still take longer than the remaining time.
+
+    Args:
+        url (str): The requested URL.
+        timeout (float or tuple, optional): A timeout set by the caller. Defaults to the
+                                            timeouts of the host (see host_timeouts).
+
+    Returns:
+        tuple: The connect and the read timeout in seconds.
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed.
+    """
+    if timeout is None:
+        connect, read = host_timeouts(url)
+    elif isinstance(timeout, tuple):
+        connect, read = timeout
+    else:
+        connect = read = timeout
+    deadline = _current.get()
+    if deadline is not None:
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {deadline.seconds:g}s reached before requesting {urlsplit(str(url)).netloc}")
+        connect = remaining if connect is None else min(connect, remaining)
+        read = remaining if read is None else min(read, remaining)
+    return connect, read
+
+
+def aiohttp_timeout(url):
+    """
+    Return the aiohttp timeout of a request, limited by the deadline of the current task.
+
+    Args:
+        url (str): The requested URL.
+
+    Returns:
+        aiohttp.ClientTimeout: Pass it to aiohttp.ClientSession.request(timeout=...).
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed.
+    """
+    import aiohttp
+
+    connect, read = request_timeout(url)
+    deadline = _current.get()
+    return aiohttp.ClientTimeout(total=deadline.remaining() if deadline is not None else None, sock_connect=connect, sock_read=read)
@@ -0,0 +1,174 @@
+from caldav.elements import dav
+from caldav.lib import error
+from urllib.parse import unquote, urlsplit
+from lxml import etree
+import time
+
+from calendar_snapshot import CalendarSnapshot, event_span
+
+
+def _path(url):
+    return unquote(urlsplit(str(url)).path)
+
+
+def fetch_changes(calendar, sync_token):
+    """
+    Ask the server which events changed since a sync token, with a sync-collection REPORT.
+
+    Args:
+        calendar (caldav.Calendar): The calendar.
+        sync_token (str): The sync token of the last download.
+
+    Returns:
+        tuple: The changed events (dict of URL path -> ETag), the deleted events (set of URL
+               paths) and the new sync token. None if the server does not support
+               sync-collection or no longer accepts the token.
+    """
+    try:
+        collection = calendar.objects_by_sync_token(sync_token, load_objects=False)
+    except (error.DAVError, IndexError):
+        return None
+    changed = {}
+    deleted = set()
+    for event in collection.objects:
+        etag = (getattr(event, "props", None) or {}).get(dav.GetEtag.tag)
+        if etag:
+            changed[_path(event.url)] = etag
+        else:
+            # Deleted events are reported with a 404 status and without properties.
+            deleted.add(_path(event.url))
+    return changed, deleted, collection.sync_token
+
+
+def fetch_etags(calendar):
+    """
+    Read the URL and ETag of every event in the calendar with a single PROPFIND.
+
+    Args:
+        calendar (caldav.Calendar): The calendar.
+
+    Returns:
+        dict or None: URL path -> ETag, None if the request failed.
+    """
+    query = dav.Propfind() + (dav.Prop() + dav.GetEtag())
+    try:
+        response = calendar.client.propfind(str(calendar.url), etree.tostring(query.xmlelement(), encoding="utf-8", xml_declaration=True), 1)
+        if response.status >= 400:
+            return None
+        properties = response.expand_simple_props([dav.GetEtag()])
+    except error.DAVError:
+        return None
+    calendar_path = _path(calendar.url).rstrip("/")
+    return {_path(href): props.get(dav.GetEtag.tag) for href, props in properties.items()
+            if _path(href).rstrip("/") != calendar_path and props.get(dav.GetEtag.tag)}
+
+
+def _load(calendar, etags):
+    """
+    Download the events with the given URL paths and return them as snapshot items.
+    """
+    if not etags:
+        return []
+    items = []
+    for event in calendar.calendar_multiget([calendar.url.join(path) for path in etags]):
+        if getattr(event.vobject_instance, "vevent", None) is None:
+            continue
+        event.props = {dav.GetEtag.tag: etags.get(_path(event.url))}
+        items.append((*event_span(event), event))
+    return items
+
+
+def update_store(calendar, store, calendar_version, sync_token):
+    """
+    Bring an event store up to date with the changes on the server.
+
+    The changes since the stored sync token are fetched with a sync-collection REPORT. If
+    the server does not support it, the ETags of all events are read instead and compared
+    with the stored ones. Only events that are new or whose ETag differs from the stored one
+    are downloaded, so the events written by this client since the stored sync token are
+    not downloaded again.
+
+    Args:
+        calendar (caldav.Calendar): The calendar.
+        store (EventStore): The store to update.
+        calendar_version (str): The current version of the calendar.
+        sync_token (str): The current sync token of the calendar, None if not supported.
+
+    Returns:
+        int or None: Number of changed and deleted events, None if the changes could not be
+                     determined and the calendar has to be downloaded.
+    """
+    state = store.state()
+    stored_etags = store.etags()
+    stored = {_path(href): etag for href, etag in stored_etags.items()}
+    changes = fetch_changes(calendar, state["sync_token"]) if state["sync_token"] else None
+    if changes is not None:
+        changed, deleted, sync_token = changes
+    else:
+        remote = fetch_etags(calendar)
+        if remote is None:
+            return None
+        changed = remote
+        deleted = set(stored) - set(remote)
+
+    # The writes of the last cycles are reported as changes as well, but the store already has
+    # them with the ETag the server returned for them, so they are not downloaded again.
+    changed = {path: etag for path, etag in changed.items() if stored.get(path) != etag}
+    stored_hrefs = {_path(href): href for href in stored_etags}
+    deleted = [stored_hrefs[path] for path in deleted if path in stored_hrefs]
+
+    try:
+        items = _load(calendar, changed)
+    except (error.DAVError, NotImplementedError):
+        return None
+    store.apply_changes(items, deleted, calendar_version, sync_token)
+    return len(changed) + len(deleted)
+
+
+def load_snapshot(calendar, store, start, end, ctag, sync_token, max_age):
+    """
+    Build the snapshot of a sync window, downloading as little as possible.
+
+    Without a store, or if the last full download is older than 'max_age' seconds, the
+    whole window is downloaded. Otherwise the store is brought up to date with the changes
+    on the server if the calendar version changed (see update_store), the part of the
+    window after the covered window is downloaded, and the snapshot is built from the store.
+
+    Args:
+        calendar (caldav.Calendar): The calendar.
+        store (EventStore or None): The event store.
+        start (datetime): Start of the window.
+        end (datetime): End of the window.
+        ctag (str): The current ctag of the calendar, None if not supported.
+        sync_token (str): The current sync token of the calendar, None if not supported.
+        max_age (float): Seconds after which the whole window is downloaded again.
+
+    Returns:
+        tuple: The CalendarSnapshot and a short description of how it was loaded.
+    """
+    version = ctag or sync_token
+    if store is None:
+        return CalendarSnapshot.fetch(calendar, start, end), "downloaded"
+
+    state = store.state()
+    usable = (version is not None and state is not None and time.time() - state["verified_at"] < max_age and
+              state["covered_from"] <= start and state["covered_until"] >= start)
+    if usable and state["version"] != version:
+        changes = update_store(calendar, store, version, sync_token)
+        usable = changes is not None
+        source = f"{changes} changed on the server" if usable else None
+    else:
+        source = "unchanged on the server"
+
+    if not usable:
+        snapshot = CalendarSnapshot.fetch(calendar, start, end)
+        store.replace(start, end, snapshot.items(), version, sync_token)
+        return snapshot, "downloaded"
+
+    if state["covered_until"] < end:
+        gap = CalendarSnapshot.fetch(calendar, state["covered_until"], end)
+        store.extend(state["covered_until"], end, gap.items())
+        if len(gap):
+            source += f", {len(gap)} downloaded for the new days"
+
+    return CalendarSnapshot.from_entries(calendar, store.entries(calendar.client, start, end)), f"from the event store, {source}"
@@ -0,0 +1,40 @@
+class SessionExpiredError(Exception):
+    """
+    Raised when All4Schools rejects the session cookies because the login has expired.
+    """
+
+
+class LoginError(Exception):
+    """
+    Raised when logging in to All4Schools does not return a session.
+    """
+
+
+class ScheduleFetchError(Exception):
+    """
+    Raised when a part of the schedule could not be fetched from All4Schools.
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the time budget of a sync cycle is used up before a request is sent.
+    """
+
+
+def raise_for_expired_session(response):
+    """
+    Raise SessionExpiredError if an All4Schools response shows that the session has expired.
+
+    All4Schools answers requests with an expired '.ASPXAUTH' cookie either with 401/403
+    or by redirecting to the login page.
+
+    Args:
+        response (requests.Response): The response to check.
+
+    Raises:
+        SessionExpiredError: If the session has expired.
+    """
+    redirected_to_login = "Login.aspx" in response.url or "Login.aspx" in response.headers.get("Location", "")
+    if response.status_code in (401, 403) or redirected_to_login:
+        raise SessionExpiredError(f"Session expired ({response.status_code} from {response.url})")
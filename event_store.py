@@ -0,0 +1,349 @@
+from datetime import datetime, timezone
+from caldav.elements import dav
+from caldav.lib import error
+import threading
+import sqlite3
+import vobject
+import hashlib
+import time
+import os
+
+from lesson import to_datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    href TEXT NOT NULL,
+    etag TEXT,
+    content_hash TEXT,
+    dtstart REAL NOT NULL,
+    dtend REAL NOT NULL,
+    PRIMARY KEY (calendar, uid)
+);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (calendar, dtstart, dtend);
+CREATE TABLE IF NOT EXISTS calendars (
+    calendar TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    version TEXT,
+    sync_token TEXT,
+    verified_at REAL,
+    covered_from REAL,
+    covered_until REAL,
+    PRIMARY KEY (calendar, scope)
+);
+"""
+
+_connections_lock = threading.Lock()
+_connections = {}
+
+
+def content_hash(data):
+    """
+    Return the SHA-256 hex digest of the iCalendar data of an event.
+
+    Args:
+        data (str or bytes): The iCalendar data.
+
+    Returns:
+        str: The digest.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _connect(path):
+    """
+    Return the connection and the lock of a database file, opening it on first use.
+
+    Every EventStore of a file shares them, so the bands and targets of an account write
+    through one connection, one transaction at a time. The database is opened in WAL mode
+    and waits up to 'EVENT_STORE_TIMEOUT' seconds (default 30) for a lock held by another
+    process.
+    """
+    key = path if path == ":memory:" else os.path.realpath(path)
+    with _connections_lock:
+        if key not in _connections:
+            connection = sqlite3.connect(path, timeout=float(os.getenv('EVENT_STORE_TIMEOUT', 30)), check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.executescript(SCHEMA)
+            _connections[key] = (connection, threading.Lock())
+        return _connections[key]
+
+
+def _timestamp(value):
+    return to_datetime(value).timestamp()
+
+
+def _datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+class StoredEvent:
+    """
+    A calendar event known from the event store, without its iCalendar data.
+
+    It stands in for a caldav event in a CalendarSnapshot built from the store. Deleting
+    it sends 'If-Match' with the stored ETag, so an event that was changed on the server
+    since it was stored is not deleted. The data is only downloaded where it is needed,
+    see CalendarSnapshot.load.
+
+    Attributes:
+        client (caldav.DAVClient): The client to send requests with.
+        url (str): The URL of the event.
+        etag (str): The ETag of the event, None if unknown.
+        content_hash (str): The SHA-256 hex digest of the iCalendar data, None if unknown.
+        data (str): The iCalendar data, None until it is loaded.
+    """
+
+    __slots__ = ("client", "url", "etag", "content_hash", "data")
+
+    def __init__(self, client, url, etag=None, content_hash=None):
+        self.client = client
+        self.url = url
+        self.etag = etag
+        self.content_hash = content_hash
+        self.data = None
+
+    @property
+    def vobject_instance(self):
+        """
+        The parsed iCalendar data, None until it is loaded.
+        """
+        return vobject.readOne(self.data) if self.data is not None else None
+
+    def delete(self):
+        """
+        Delete the event.
+
+        Raises:
+            caldav.lib.error.DeleteError: If the server refuses the deletion, for example
+                                          because the event has changed.
+        """
+        headers = {"If-Match": self.etag} if self.etag else {}
+        response = self.client.request(str(self.url), "DELETE", "", headers)
+        if response.status not in (200, 204, 404):
+            raise error.DeleteError(f"Deleting {self.url} failed with status {response.status}")
+
+
+class EventStore:
+    """
+    A local SQLite record of the events in the CalDAV calendar.
+
+    For every UID the store keeps the URL, ETag, content hash and the start and end time
+    of the event, indexed by time. It is written after every full download of the sync
+    window and after every successful write, so a sync cycle can work from the store
+    instead of downloading the calendar again.
+
+    The store is used as it is while the calendar version (ctag or sync token) is the one
+    recorded after the last cycle, and for at most 'max_age' seconds after the last full
+    download. After a change by another client or a failed write it is brought up to date
+    with the changes on the server (see delta_sync). Every band of a tiered sync downloads
+    its own time window, so the version, sync token and covered window are kept per band
+    ('scope'). The events themselves belong to the calendar and are shared by all bands:
+    a band only replaces the events of its own window, and invalidate makes every band
+    check the calendar again, because the version of the calendar is the same for all.
+
+    Args:
+        path (str): The SQLite database file.
+        calendar (str): A key for the calendar, for example its URL.
+        scope (str, optional): The name of the band. Defaults to the whole sync period.
+    """
+
+    def __init__(self, path, calendar, scope=""):
+        self.path = path
+        self.calendar = calendar
+        self.scope = scope
+        self._connection, self._lock = _connect(path)
+
+    def close(self):
+        """
+        Close the database, for every store of the file.
+        """
+        key = self.path if self.path == ":memory:" else os.path.realpath(self.path)
+        with _connections_lock:
+            if _connections.get(key, (None,))[0] is self._connection:
+                del _connections[key]
+        with self._lock:
+            self._connection.close()
+
+    def state(self):
+        """
+        Return what the store knows about the calendar.
+
+        Returns:
+            dict or None: The 'version' and 'sync_token' of the calendar the store matches, the
+                          time of the last full download ('verified_at', epoch seconds) and the
+                          window the store holds all events of ('covered_from', 'covered_until',
+                          datetimes). None if the calendar was never downloaded.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT version, sync_token, verified_at, covered_from, covered_until FROM calendars WHERE calendar = ? AND scope = ?",
+                (self.calendar, self.scope)
+            ).fetchone()
+        if row is None or row[2] is None:
+            return None
+        return {
+            "version": row[0],
+            "sync_token": row[1],
+            "verified_at": row[2],
+            "covered_from": _datetime(row[3]),
+            "covered_until": _datetime(row[4])
+        }
+
+    def events(self, start, end):
+        """
+        Return the stored events that overlap a time window.
+
+        Args:
+            start (datetime): Start of the window.
+            end (datetime): End of the window.
+
+        Returns:
+            list: (uid, start, end, href, etag, content_hash) tuples, ordered by start.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT uid, dtstart, dtend, href, etag, content_hash FROM events "
+                "WHERE calendar = ? AND dtstart < ? AND dtend > ? ORDER BY dtstart",
+                (self.calendar, _timestamp(end), _timestamp(start))
+            ).fetchall()
+        return [(uid, _datetime(dtstart), _datetime(dtend), href, etag, digest) for uid, dtstart, dtend, href, etag, digest in rows]
+
+    def entries(self, client, start, end):
+        """
+        Return the stored events of a time window in the form CalendarSnapshot.from_entries takes.
+
+        Args:
+            client (caldav.DAVClient): The client the events are deleted with.
+            start (datetime): Start of the window.
+            end (datetime): End of the window.
+
+        Returns:
+            list: (uid, start, end, StoredEvent) tuples.
+        """
+        return [(uid, event_start, event_end, StoredEvent(client, href, etag, digest))
+                for uid, event_start, event_end, href, etag, digest in self.events(start, end)]
+
+    def _rows(self, items):
+        # Servers may reformat the iCalendar data, so the hash of a download says nothing about
+        # what was written. The hash of the written data is kept as long as the ETag is the same.
+        written = {(uid, etag): digest for uid, etag, digest in self._connection.execute(
+            "SELECT uid, etag, content_hash FROM events WHERE calendar = ? AND etag IS NOT NULL", (self.calendar,))}
+        rows = []
+        for uid, event_start, event_end, event in items:
+            etag = (getattr(event, "props", None) or {}).get(dav.GetEtag.tag)
+            rows.append((self.calendar, uid, str(event.url), etag, written.get((uid, etag)),
+                         _timestamp(event_start), _timestamp(event_end)))
+        return rows
+
+    def _replace_window(self, start, end, items):
+        self._connection.execute("DELETE FROM events WHERE calendar = ? AND dtstart < ? AND dtend > ?",
+                                 (self.calendar, _timestamp(end), _timestamp(start)))
+        self._connection.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", self._rows(items))
+
+    def replace(self, start, end, items, calendar_version=None, sync_token=None):
+        """
+        Replace the stored events of a time window with a full download of the window.
+
+        Args:
+            start (datetime): Start of the window.
+            end (datetime): End of the window.
+            items (iterable): (uid, start, end, event) tuples of the downloaded caldav events,
+                              as returned by CalendarSnapshot.items.
+            calendar_version (str, optional): The calendar version the download belongs to.
+            sync_token (str, optional): The sync token the download belongs to.
+        """
+        with self._lock, self._connection:
+            self._replace_window(start, end, items)
+            self._connection.execute("INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (self.calendar, self.scope, calendar_version, sync_token, time.time(), _timestamp(start), _timestamp(end)))
+
+    def extend(self, start, end, items):
+        """
+        Add a download of the window right after the covered window, for example when the sync
+        window has moved on since the last full download.
+
+        Args:
+            start (datetime): Start of the window, the end of the covered window.
+            end (datetime): End of the window.
+            items (iterable): (uid, start, end, event) tuples of the downloaded caldav events.
+        """
+        with self._lock, self._connection:
+            self._replace_window(start, end, items)
+            self._connection.execute("UPDATE calendars SET covered_until = ? WHERE calendar = ? AND scope = ?",
+                                     (_timestamp(end), self.calendar, self.scope))
+
+    def apply_changes(self, changed, deleted, calendar_version, sync_token=None):
+        """
+        Apply the events changed on the server since the last cycle.
+
+        Args:
+            changed (iterable): (uid, start, end, event) tuples of the changed caldav events.
+            deleted (iterable): The URLs of the deleted events.
+            calendar_version (str): The calendar version the changes lead to.
+            sync_token (str, optional): The sync token the changes lead to.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM events WHERE calendar = ? AND href = ?",
+                                         [(self.calendar, str(href)) for href in deleted])
+            self._connection.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", self._rows(changed))
+            self._connection.execute("UPDATE calendars SET version = ?, sync_token = ? WHERE calendar = ? AND scope = ?",
+                                     (calendar_version, sync_token, self.calendar, self.scope))
+
+    def etags(self):
+        """
+        Return the URL and ETag of every stored event of the calendar.
+
+        Returns:
+            dict: URL -> ETag (None if unknown).
+        """
+        with self._lock:
+            return dict(self._connection.execute("SELECT href, etag FROM events WHERE calendar = ?", (self.calendar,)).fetchall())
+
+    def put(self, uid, href, etag, digest, start, end):
+        """
+        Record an event that was written.
+
+        Args:
+            uid (str): The UID of the event.
+            href (str): The URL of the event.
+            etag (str): The ETag of the event, None if unknown.
+            digest (str): The content hash of the written iCalendar data.
+            start (datetime): Start of the event.
+            end (datetime): End of the event.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (self.calendar, uid, str(href), etag, digest, _timestamp(start), _timestamp(end)))
+
+    def remove(self, uid):
+        """
+        Forget an event that was deleted.
+
+        Args:
+            uid (str): The UID of the event.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM events WHERE calendar = ? AND uid = ?", (self.calendar, uid))
+
+    def set_version(self, calendar_version):
+        """
+        Record the calendar version after the writes of a cycle, keeping the time of the last
+        full download.
+
+        Args:
+            calendar_version (str): The version of the calendar.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE calendars SET version = ? WHERE calendar = ? AND scope = ?", (calendar_version, self.calendar, self.scope))
+
+    def invalidate(self):
+        """
+        Stop trusting the store, so that the next cycle of every band checks the calendar for changes.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE calendars SET version = NULL WHERE calendar = ?", (self.calendar,))
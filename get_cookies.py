@@ -1,30 +1,33 @@
-import requests
 from dotenv import load_dotenv
 import os
 from bs4 import BeautifulSoup
 
+from http_session import get_session
+
 load_dotenv(override=True)
 
 
-def get_cookies():
+def get_cookies(base_url=None, username=None, password=None):
     """
     This function sends a POST request to the login page of a website,
     retrieves the session ID and authentication token from the response headers,
     and returns them as a tuple.
 
     Parameters:
-    None
+    base_url (str, optional): The All4Schools URL. Defaults to the 'ALL4SCHOOLS_URL' environment variable.
+    username (str, optional): Defaults to the 'ALL4SCHOOLS_USERNAME' environment variable.
+    password (str, optional): Defaults to the 'ALL4SCHOOLS_PASSWORD' environment variable.
 
     Returns:
     tuple: A tuple containing the session ID and authentication token.
            If either the session ID or authentication token is not found,
            the corresponding value in the tuple will be None.
     """
-    base_url = os.getenv('ALL4SCHOOLS_URL')
+    base_url = base_url or os.getenv('ALL4SCHOOLS_URL')
     api_endpoint = 'modules/Login.aspx'
     full_url = f"{base_url}/{api_endpoint}"
 
-    response = requests.get(full_url)
+    response = get_session().get(full_url)
     response_text = response.text
 
     soup = BeautifulSoup(response_text, 'html.parser')
@@ -35,11 +38,11 @@ def get_cookies():
         "__VIEWSTATE": viewstate,
         "__EVENTVALIDATION": eventvalidation,
         "loginbutton": "",
-        "username": os.getenv('ALL4SCHOOLS_USERNAME'),
-        "password": os.getenv('ALL4SCHOOLS_PASSWORD'),
+        "username": username or os.getenv('ALL4SCHOOLS_USERNAME'),
+        "password": password or os.getenv('ALL4SCHOOLS_PASSWORD'),
     }
 
-    response = requests.post(full_url, data=data, allow_redirects=False)
+    response = get_session().post(full_url, data=data, allow_redirects=False)
 
     cookies = response.headers.get("Set-Cookie")
     session_id = None
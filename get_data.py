@@ -1,30 +1,25 @@
 import requests
 from dotenv import load_dotenv
 import os
+import hashlib
+
+from errors import raise_for_expired_session
+from schedule_stream import ScheduleStream
+from http_session import get_session
+from request_governor import read_only
 
 load_dotenv(override=True)
 
-def get_data(from_date, to_date, session_id, auth_token, user_id, school_id):
+def schedule_request(from_date, to_date, session_id, auth_token, user_id, school_id, base_url=None):
     """
-    Retrieves schedule data from the ALL4SCHOOLS API.
+    Build the URL and the keyword arguments of a GetSchedule request.
 
-    This function sends a POST request to the ALL4SCHOOLS API to fetch schedule data
-    for a specific student within a given date range.
-
-    Parameters:
-    from_date (str): The start date of the schedule period (format: 'YYYY-MM-DD').
-    to_date (str): The end date of the schedule period (format: 'YYYY-MM-DD').
-    session_id (str): The ASP.NET session ID for authentication.
-    auth_token (str): The ASPXAUTH token for authentication.
-    user_id (str): The ID of the student whose schedule is being requested.
-    school_id (str): The ID of the school.
+    Takes the same parameters as get_data.
 
     Returns:
-    dict or None: A dictionary containing the schedule data if the request is successful
-                  and the response is in JSON format. Returns None if the request fails
-                  or the response is not in JSON format.
+    tuple: The URL (str) and the 'json' and 'cookies' arguments for requests (dict).
     """
-    base_url = os.getenv('ALL4SCHOOLS_URL')
+    base_url = base_url or os.getenv('ALL4SCHOOLS_URL')
     api_endpoint = 'api/api/Schedule/GetSchedule'
     full_url = f"{base_url}/{api_endpoint}"
 
@@ -41,16 +36,93 @@ def get_data(from_date, to_date, session_id, auth_token, user_id, school_id):
         "ASP.NET_SessionId": session_id,
         ".ASPXAUTH": auth_token
     }
+    return full_url, {"json": data, "cookies": cookies}
+
+
+def get_data(from_date, to_date, session_id, auth_token, user_id, school_id, base_url=None):
+    """
+    Retrieves schedule data from the ALL4SCHOOLS API.
+
+    This function sends a POST request to the ALL4SCHOOLS API to fetch schedule data
+    for a specific student within a given date range.
+
+    Parameters:
+    from_date (str): The start date of the schedule period (format: 'YYYY-MM-DD').
+    to_date (str): The end date of the schedule period (format: 'YYYY-MM-DD').
+    session_id (str): The ASP.NET session ID for authentication.
+    auth_token (str): The ASPXAUTH token for authentication.
+    user_id (str): The ID of the student whose schedule is being requested.
+    school_id (str): The ID of the school.
+    base_url (str, optional): The All4Schools URL. Defaults to the 'ALL4SCHOOLS_URL' environment variable.
+
+    Returns:
+    dict or None: A dictionary containing the schedule data if the request is successful
+                  and the response is in JSON format. Returns None if the request fails
+                  or the response is not in JSON format.
+
+    Raises:
+    SessionExpiredError: If the session cookies are no longer accepted.
+    """
+    data, _ = get_data_with_fingerprint(from_date, to_date, session_id, auth_token, user_id, school_id, base_url)
+    return data
+
+
+def get_data_with_fingerprint(from_date, to_date, session_id, auth_token, user_id, school_id, base_url=None):
+    """
+    Retrieves schedule data from the ALL4SCHOOLS API together with a fingerprint of the raw response.
+
+    Takes the same parameters as get_data. The fingerprint is the SHA-256 hex digest of the
+    response body, so two cycles with an identical schedule produce the same fingerprint.
 
-    response = requests.post(full_url, json=data, cookies=cookies)
+    Returns:
+    tuple: The schedule data (dict or None, as returned by get_data) and the fingerprint
+           (str, or None if the request failed).
+
+    Raises:
+    SessionExpiredError: If the session cookies are no longer accepted.
+    """
+    full_url, request = schedule_request(from_date, to_date, session_id, auth_token, user_id, school_id, base_url)
+    with read_only():
+        response = get_session().post(full_url, **request)
+    raise_for_expired_session(response)
 
     if response.status_code == 200:
         try:
             data = response.json()
-            return data
+            return data, hashlib.sha256(response.content).hexdigest()
         except requests.exceptions.JSONDecodeError:
             print("Response content is not in JSON format")
-            return None
+            return None, None
     else:
         print(f"Request failed with status code {response.status_code}")
-        return None
+        return None, None
+
+
+def stream_schedule(from_date, to_date, session_id, auth_token, user_id, school_id, base_url=None):
+    """
+    Retrieves schedule data from the ALL4SCHOOLS API as a stream of lessons.
+
+    Takes the same parameters as get_data. Instead of loading the whole response, the lessons
+    are parsed from the body while it is downloaded, so neither the body nor a list of all
+    raw lessons is held in memory. This only bounds the memory use of parsing: the compressed
+    lessons are collected afterwards (see compress_events), so they still grow with the
+    length of the schedule period. The fingerprint is the same as the one of
+    get_data_with_fingerprint and is available once all lessons were read.
+
+    Returns:
+    ScheduleStream: An iterable of the raw lesson dictionaries.
+
+    Raises:
+    SessionExpiredError: If the session cookies are no longer accepted.
+    requests.HTTPError: If the request fails.
+    """
+    full_url, request = schedule_request(from_date, to_date, session_id, auth_token, user_id, school_id, base_url)
+    with read_only():
+        response = get_session().post(full_url, stream=True, **request)
+    try:
+        raise_for_expired_session(response)
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return ScheduleStream(response)
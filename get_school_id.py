@@ -1,10 +1,12 @@
 import os
 from dotenv import load_dotenv
-import requests
+
+from errors import raise_for_expired_session
+from http_session import get_session
 
 load_dotenv(override=True)
 
-def get_school_id(session_id, auth_token):
+def get_school_id(session_id, auth_token, base_url=None):
     """
     Retrieves the school ID for the current user from the ALL4SCHOOLS API.
 
@@ -14,14 +16,16 @@ def get_school_id(session_id, auth_token):
     Args:
         session_id (str): The ASP.NET session ID for authentication.
         auth_token (str): The ASPXAUTH token for authentication.
+        base_url (str, optional): The All4Schools URL. Defaults to the 'ALL4SCHOOLS_URL' environment variable.
 
     Returns:
         str: The ID of the first school associated with the current user.
 
     Raises:
+        SessionExpiredError: If the session cookies are no longer accepted.
         requests.exceptions.HTTPError: If the API request fails or returns a non-200 status code.
     """
-    base_url = os.getenv('ALL4SCHOOLS_URL')
+    base_url = base_url or os.getenv('ALL4SCHOOLS_URL')
     api_endpoint = 'api/Api/AppUser/GetSchoolsAndSettingsForCurrentUser'
     full_url = f"{base_url}/{api_endpoint}"
 
@@ -31,7 +35,8 @@ def get_school_id(session_id, auth_token):
     }
 
     # Assuming you will use requests to make the API call
-    response = requests.get(full_url, cookies=cookies)
+    response = get_session().get(full_url, cookies=cookies)
+    raise_for_expired_session(response)
 
     if response.status_code == 200:
         return response.json()[0]["id"]
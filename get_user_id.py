@@ -1,10 +1,12 @@
 import os
 from dotenv import load_dotenv
-import requests
+
+from errors import raise_for_expired_session
+from http_session import get_session
 
 load_dotenv(override=True)
 
-def get_user_id(session_id, auth_token):
+def get_user_id(session_id, auth_token, base_url=None):
     """
     Retrieves the user ID from the ALL4SCHOOLS API using the provided session ID and authentication token.
 
@@ -14,14 +16,16 @@ def get_user_id(session_id, auth_token):
     Args:
         session_id (str): The session ID for the current user session.
         auth_token (str): The authentication token for the current user.
+        base_url (str, optional): The All4Schools URL. Defaults to the 'ALL4SCHOOLS_URL' environment variable.
 
     Returns:
         str: The user's CRM entity ID if the request is successful.
 
     Raises:
+        SessionExpiredError: If the session cookies are no longer accepted.
         requests.exceptions.HTTPError: If the API request fails or returns a non-200 status code.
     """
-    base_url = os.getenv('ALL4SCHOOLS_URL')
+    base_url = base_url or os.getenv('ALL4SCHOOLS_URL')
     api_endpoint = 'api/Api/AppUser/GetUserInfo'
     full_url = f"{base_url}/{api_endpoint}"
 
@@ -31,7 +35,8 @@ def get_user_id(session_id, auth_token):
     }
 
     # Assuming you will use requests to make the API call
-    response = requests.get(full_url, cookies=cookies)
+    response = get_session().get(full_url, cookies=cookies)
+    raise_for_expired_session(response)
     
     if response.status_code == 200:
         return response.json()["crmEntityId"]
@@ -1,55 +1,63 @@
 import os
 import json
 
-def handle_data(data):
+from lesson import Lesson
+from lesson_filter import LessonFilter
+
+_env_filter = (None, None)
+
+
+def _filter_from_env():
+    global _env_filter
+    rules = os.getenv('ALL4SCHOOLS_LESSONS_TO_REMOVE')
+    if _env_filter[0] != rules:
+        _env_filter = (rules, LessonFilter(json.loads(rules) if rules else []))
+    return _env_filter[1]
+
+
+def normalize_lessons(lessons, lesson_filter):
+    """
+    Filter and parse raw lessons in a single pass.
+
+    This is a generator, so lessons are processed one at a time as they are consumed and
+    no intermediate list is built.
+
+    Args:
+        lessons (iterable): The raw lesson dictionaries from the All4Schools API.
+        lesson_filter (LessonFilter): The lessons to leave out.
+
+    Yields:
+        Lesson: The lessons that are not filtered out.
+    """
+    for lesson in lessons:
+        if not lesson_filter.excludes(str(lesson["SubjectName"])):
+            yield Lesson.from_api(lesson)
+
+
+def handle_data(data, lesson_filter=None):
     """
-    Process and filter lesson data, excluding lessons with 'StudioTimes' in the subject name.
+    Process and filter lesson data, excluding lessons matched by the lesson filter.
 
-    This function takes a dictionary of lesson data, filters out lessons with 'StudioTimes'
-    in the subject name, and restructures the remaining lesson information into a new format.
+    This function takes a dictionary of lesson data, filters out lessons whose subject name
+    matches one of the rules in 'ALL4SCHOOLS_LESSONS_TO_REMOVE' (see LessonFilter), and
+    parses the remaining lessons into Lesson objects.
 
     Args:
         data (dict): A dictionary containing a 'lessons' key with a list of lesson dictionaries.
                      Each lesson dictionary should have keys for 'SubjectName', 'start', 'end',
                      'StudentClassName', 'TeacherName', 'AdditionalTeacherNamesString',
                      'RoomName', and 'AdditionalRooms'.
+        lesson_filter (LessonFilter or list, optional): The lessons to filter out, compiled or as a
+                     list of rules. Defaults to the rules in the 'ALL4SCHOOLS_LESSONS_TO_REMOVE'
+                     environment variable.
 
     Returns:
-        dict: A dictionary with a 'lessons' key containing a list of filtered and reformatted
-              lesson dictionaries. Each lesson dictionary in the output contains:
-              - 'start': Lesson start time (string)
-              - 'end': Lesson end time (string)
-              - 'SubjectName': Name of the subject (string)
-              - 'StudentClassName': Name of the student class (string)
-              - 'TeacherName': Name of the primary teacher (string)
-              - 'AdditionalTeacherNamesString': List of additional teachers (list of strings)
-              - 'RoomName': Name of the primary room (string)
-              - 'AdditionalRooms': List of additional rooms (list of strings)
+        dict: A dictionary with a 'lessons' key containing a list of Lesson objects, with
+              their start and end times parsed into timezone aware datetimes.
     """
-    filtered_lessons = []
-
-    for lesson in data["lessons"]:
-        lessons_to_remove = os.getenv('ALL4SCHOOLS_LESSONS_TO_REMOVE')
-        if lessons_to_remove:
-            lessons_to_remove = json.loads(lessons_to_remove)
-        for subject in lessons_to_remove:
-            if subject not in lesson["SubjectName"]:
-                filtered_lessons.append(lesson)
-                break
-
-    filtered_lessons_json = {"lessons": []}
-
-    for lesson in filtered_lessons:
-        filtered_lessons_json["lessons"].append({
-            "start": str(lesson["start"]),
-            "end": str(lesson["end"]),
-            "SubjectName": str(lesson["SubjectName"]),
-            "StudentClassName": str(lesson["StudentClassName"]),
-            "TeacherName": str(lesson["TeacherName"]),
-            "AdditionalTeacherNamesString": list(lesson["AdditionalTeacherNamesString"].split(",")[1:]) if lesson["AdditionalTeacherNamesString"] else [],
-            "RoomName": str(lesson["RoomName"]),
-            "AdditionalRooms": list(lesson["AdditionalRooms"].split(",")[1:]) if lesson["AdditionalRooms"] else []
-        })
-
-    return filtered_lessons_json
+    if lesson_filter is None:
+        lesson_filter = _filter_from_env()
+    elif not isinstance(lesson_filter, LessonFilter):
+        lesson_filter = LessonFilter(lesson_filter)
 
+    return {"lessons": list(normalize_lessons(data["lessons"], lesson_filter))}
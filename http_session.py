@@ -0,0 +1,41 @@
+from http.cookiejar import DefaultCookiePolicy
+from dotenv import load_dotenv
+import threading
+import requests
+import os
+
+from request_governor import GovernedAdapter
+
+load_dotenv(override=True)
+
+_lock = threading.Lock()
+_session = None
+
+
+class _NoCookies(DefaultCookiePolicy):
+    def set_ok(self, cookie, request):
+        return False
+
+
+def get_session():
+    """
+    Return the requests session shared by all All4Schools API calls.
+
+    The session keeps up to 'ALL4SCHOOLS_POOL_SIZE' (default 10) connections per host alive,
+    so consecutive and concurrent requests reuse them. It never stores cookies: every
+    request passes the cookies of its account, so accounts cannot see each other's
+    sessions. Every request is counted and timed per host (see metrics).
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            session.cookies.set_policy(_NoCookies())
+            adapter = GovernedAdapter(pool_maxsize=int(os.getenv('ALL4SCHOOLS_POOL_SIZE', 10)))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
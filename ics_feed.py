@@ -0,0 +1,203 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote, urlsplit
+from datetime import timedelta
+from icalendar import Calendar, vDuration
+from dotenv import load_dotenv
+import threading
+import hashlib
+import os
+
+from add_event import build_lesson_event, build_series_event
+from recurrence import LessonSeries
+from storage import save_bytes
+
+load_dotenv(override=True)
+
+_lock = threading.Lock()
+_cache = {}
+_server = None
+
+
+def render_feed(lessons, name="", refresh_minutes=None):
+    """
+    Render the scheduled lessons into a single iCalendar document.
+
+    Every lesson gets the same VEVENT that the sync writes to a CalDAV calendar, including
+    its UID, so the feed and a synced calendar contain the same events.
+
+    Args:
+        lessons (list): The compressed Lesson objects as returned by compress_events, and
+                        LessonSeries objects as returned by recurrence.compact_series.
+        name (str, optional): The name of the calendar shown by subscribed clients.
+        refresh_minutes (int, optional): How often clients should poll the feed.
+
+    Returns:
+        bytes: The iCalendar document.
+    """
+    header = Calendar()
+    header.add("prodid", "-//TimeSync//All4Schools//EN")
+    header.add("version", "2.0")
+    header.add("x-wr-calname", name or "TimeSync")
+    if refresh_minutes:
+        header.add("refresh-interval", vDuration(timedelta(minutes=refresh_minutes)), parameters={"VALUE": "DURATION"})
+        header.add("x-published-ttl", vDuration(timedelta(minutes=refresh_minutes)))
+    header = header.to_ical()
+
+    parts = [header[:header.rindex(b"END:VCALENDAR")]]
+    uids = set()
+    for lesson in lessons:
+        uid, _, _, ical = build_series_event(lesson) if isinstance(lesson, LessonSeries) else build_lesson_event(lesson)
+        if uid in uids:
+            continue
+        uids.add(uid)
+        parts.append(ical[ical.index(b"BEGIN:VEVENT"):ical.rindex(b"END:VCALENDAR")])
+    parts.append(b"END:VCALENDAR\r\n")
+    return b"".join(parts)
+
+
+def feed_version(path):
+    """
+    Return a value that changes whenever the feed file is replaced.
+
+    Args:
+        path (str): The feed file.
+
+    Returns:
+        str or None: The modification time and size of the file, None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def write_feed(path, data):
+    """
+    Atomically replace the feed file, unless it already has this content.
+
+    Leaving an unchanged file alone keeps its ETag and Last-Modified, so polling clients
+    get a '304 Not Modified'.
+
+    Args:
+        path (str): The feed file.
+        data (bytes): The iCalendar document as returned by render_feed.
+
+    Returns:
+        bool or None: True if the file was written, False if it was unchanged, None if
+                      writing failed.
+    """
+    try:
+        with open(path, "rb") as file:
+            if file.read() == data:
+                return False
+    except OSError:
+        pass
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return True if save_bytes(path, data, 0o644) else None
+
+
+def _load(path):
+    """
+    Return the content, ETag and modification time of a feed file, cached until it changes.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _cache.get(path)
+    if cached is None or cached[0] != key:
+        with open(path, "rb") as file:
+            data = file.read()
+        cached = (key, data, f'"{hashlib.sha256(data).hexdigest()[:32]}"', int(stat.st_mtime))
+        with _lock:
+            _cache[path] = cached
+    return cached[1:]
+
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    def _send(self, with_body):
+        path = self.server.feeds.get(unquote(urlsplit(self.path).path))
+        try:
+            data, etag, modified = _load(path) if path else (None, None, None)
+        except OSError:
+            data = None
+        if data is None:
+            self.send_error(404)
+            return
+
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_none_match:
+            not_modified = if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+        elif if_modified_since:
+            try:
+                not_modified = modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                not_modified = False
+        else:
+            not_modified = False
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(modified, usegmt=True))
+        self.send_header("Cache-Control", "no-cache")
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._send(True)
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_feeds(accounts, port=None, host=None):
+    """
+    Serve the feed files of the accounts from a background thread.
+
+    Every feed is served under its file name, for example 'feeds/alice.ics' as
+    http://host:port/alice.ics, with ETag and Last-Modified headers for conditional requests.
+
+    Args:
+        accounts (list): The SyncConfig of every account. Accounts without 'ics_feed_file' are skipped.
+        port (int, optional): Defaults to the 'ICS_FEED_PORT' environment variable. If neither is
+                              set, no server is started.
+        host (str, optional): Defaults to the 'ICS_FEED_HOST' environment variable, or 127.0.0.1.
+
+    Returns:
+        ThreadingHTTPServer or None: The running server, None if no port is set or no account
+                                     has a feed.
+
+    Raises:
+        ValueError: If two accounts have feed files with the same name.
+    """
+    global _server
+    port = port or os.getenv('ICS_FEED_PORT')
+    feeds = {}
+    for config in accounts:
+        if not config.ics_feed_file:
+            continue
+        url_path = "/" + os.path.basename(config.ics_feed_file)
+        if url_path in feeds and feeds[url_path] != config.ics_feed_file:
+            raise ValueError(f"Two accounts have a feed file named {url_path[1:]}")
+        feeds[url_path] = config.ics_feed_file
+    if not port or not feeds:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host or os.getenv('ICS_FEED_HOST', '127.0.0.1'), int(port)), _FeedHandler)
+            _server.feeds = feeds
+            threading.Thread(target=_server.serve_forever, name="ics-feed", daemon=True).start()
+        return _server
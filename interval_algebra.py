@@ -0,0 +1,126 @@
+import numpy as np
+
+
+def to_epoch(values):
+    """
+    Convert datetimes to an int64 array of epoch seconds.
+
+    Args:
+        values (sequence): Timezone aware datetimes. Naive datetimes are interpreted as local time.
+
+    Returns:
+        numpy.ndarray: The epoch seconds, in input order.
+    """
+    return np.fromiter((round(value.timestamp()) for value in values), dtype=np.int64, count=len(values))
+
+
+def factorize(keys):
+    """
+    Number hashable keys in the order they first appear.
+
+    Args:
+        keys (sequence): The keys, for example (subject, class, teacher, room) tuples.
+
+    Returns:
+        numpy.ndarray: An int64 code per key. Equal keys get equal codes.
+    """
+    codes = {}
+    return np.fromiter((codes.setdefault(key, len(codes)) for key in keys), dtype=np.int64, count=len(keys))
+
+
+def merge(starts, ends, codes=None, gap=0):
+    """
+    Merge intervals that overlap, touch or are at most 'gap' apart.
+
+    Intervals are half-open, [start, end). With 'codes', only intervals with the same code
+    are merged, so one call merges every group of a timetable at once. The intervals are
+    sorted by (code, start) once; a running maximum of the ends then tells for every
+    interval whether it starts a new run. To keep the running maximum from carrying over
+    from one group to the next, every group is shifted past the end of the previous one.
+
+    Args:
+        starts (numpy.ndarray): int64 start times.
+        ends (numpy.ndarray): int64 end times, in the same unit.
+        codes (numpy.ndarray, optional): int64 group codes as returned by factorize.
+                                         Defaults to a single group.
+        gap (int, optional): The largest distance between two intervals that are still merged.
+                             Defaults to 0, which merges overlapping and touching intervals.
+
+    Returns:
+        tuple: Two int64 index arrays with one entry per merged interval, ordered by (code, start):
+               the input interval that starts the merged interval and the input interval that
+               ends it.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    if codes is None:
+        order = np.argsort(starts, kind="stable")
+    else:
+        codes = np.asarray(codes, dtype=np.int64)
+        order = np.lexsort((starts, codes))
+
+    origin = starts.min()
+    sorted_starts = starts[order] - origin
+    sorted_ends = np.maximum(ends[order], starts[order]) - origin
+    if codes is not None:
+        span = int(sorted_ends.max()) + gap + 1
+        shift = codes[order] * span
+        sorted_starts = sorted_starts + shift
+        sorted_ends = sorted_ends + shift
+
+    reach = np.maximum.accumulate(sorted_ends)
+    new_run = np.empty(len(order), dtype=bool)
+    new_run[0] = True
+    new_run[1:] = sorted_starts[1:] > reach[:-1] + gap
+    first = np.flatnonzero(new_run)
+
+    # Any interval reaching the end of its run can stand for the end of the merged interval.
+    run_end = np.maximum.reduceat(sorted_ends, first)
+    labels = np.cumsum(new_run) - 1
+    reaching = np.flatnonzero(sorted_ends == run_end[labels])
+    last = np.zeros(len(first), dtype=np.int64)
+    last[labels[reaching]] = reaching
+    return order[first], order[last]
+
+
+def union(starts, ends, gap=0):
+    """
+    Return the union of intervals as disjoint, sorted intervals.
+
+    Args:
+        starts (numpy.ndarray): int64 start times.
+        ends (numpy.ndarray): int64 end times.
+        gap (int, optional): Intervals at most this far apart are joined. Defaults to 0.
+
+    Returns:
+        tuple: The int64 start and end arrays of the union.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    first, last = merge(starts, ends, gap=gap)
+    return starts[first], np.maximum(ends[last], starts[last])
+
+
+def complement(starts, ends, window_start, window_end):
+    """
+    Return the parts of a window that are not covered by any interval.
+
+    Args:
+        starts (numpy.ndarray): int64 start times.
+        ends (numpy.ndarray): int64 end times.
+        window_start (int): Start of the window.
+        window_end (int): End of the window.
+
+    Returns:
+        tuple: The int64 start and end arrays of the uncovered intervals, sorted.
+    """
+    covered_starts, covered_ends = union(starts, ends)
+    covered_starts = np.clip(covered_starts, window_start, window_end)
+    covered_ends = np.clip(covered_ends, window_start, window_end)
+    free_starts = np.concatenate(([window_start], covered_ends))
+    free_ends = np.concatenate((covered_starts, [window_end]))
+    keep = free_starts < free_ends
+    return free_starts[keep], free_ends[keep]
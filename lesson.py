@@ -0,0 +1,146 @@
+from datetime import datetime
+
+
+def parse_time(value):
+    """
+    Parse an All4Schools timestamp such as "2024-01-08T08:00:00+01:00" into an aware datetime.
+
+    Args:
+        value (str): The timestamp.
+
+    Returns:
+        datetime: The parsed timestamp, with the UTC offset sent by the API.
+    """
+    return datetime.fromisoformat(value)
+
+
+def to_datetime(value):
+    """
+    Convert a calendar time to a timezone aware datetime so it can be compared with others.
+
+    Dates (all-day events) become midnight local time, naive (floating) datetimes are
+    interpreted as local time.
+
+    Args:
+        value (date or datetime): The value to convert.
+
+    Returns:
+        datetime: A timezone aware datetime.
+    """
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value
+
+
+def _split_names(names):
+    return tuple(names.split(",")[1:]) if names else ()
+
+
+class Interval:
+    """
+    A half-open time interval [start, end).
+
+    Attributes:
+        start (datetime): Start of the interval.
+        end (datetime): End of the interval.
+    """
+
+    __slots__ = ("start", "end")
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        yield self.start
+        yield self.end
+
+    def __eq__(self, other):
+        if not isinstance(other, Interval):
+            return NotImplemented
+        return self.start == other.start and self.end == other.end
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.start.isoformat()}, {self.end.isoformat()})"
+
+
+class Lesson(Interval):
+    """
+    A single lesson of the schedule.
+
+    Timestamps are parsed once when the lesson is read from the API, so every later step
+    works with datetimes. __slots__ keeps the per-lesson overhead small when a long
+    'DAYS_TO_ADD' range is synced.
+
+    Attributes:
+        start (datetime): Start of the lesson.
+        end (datetime): End of the lesson.
+        subject (str): Name of the subject.
+        class_name (str): Name of the student class.
+        teacher (str): Name of the primary teacher.
+        additional_teachers (tuple): Names of the additional teachers.
+        room (str): Name of the primary room.
+        additional_rooms (tuple): Names of the additional rooms.
+    """
+
+    __slots__ = ("subject", "class_name", "teacher", "additional_teachers", "room", "additional_rooms")
+
+    def __init__(self, start, end, subject, class_name, teacher, additional_teachers=(), room="", additional_rooms=()):
+        super().__init__(start, end)
+        self.subject = subject
+        self.class_name = class_name
+        self.teacher = teacher
+        self.additional_teachers = tuple(additional_teachers)
+        self.room = room
+        self.additional_rooms = tuple(additional_rooms)
+
+    @classmethod
+    def from_api(cls, lesson):
+        """
+        Build a lesson from a lesson dictionary of the All4Schools API.
+
+        Args:
+            lesson (dict): The lesson with 'start', 'end', 'SubjectName', 'StudentClassName',
+                           'TeacherName', 'AdditionalTeacherNamesString', 'RoomName' and
+                           'AdditionalRooms' keys.
+
+        Returns:
+            Lesson: The lesson.
+        """
+        return cls(
+            parse_time(lesson["start"]),
+            parse_time(lesson["end"]),
+            str(lesson["SubjectName"]),
+            str(lesson["StudentClassName"]),
+            str(lesson["TeacherName"]),
+            _split_names(lesson["AdditionalTeacherNamesString"]),
+            str(lesson["RoomName"]),
+            _split_names(lesson["AdditionalRooms"])
+        )
+
+    def continues(self, other):
+        """
+        Check whether this lesson directly follows another lesson of the same subject, class,
+        teacher and room.
+
+        Args:
+            other (Lesson): The previous lesson.
+
+        Returns:
+            bool: True if both lessons can be merged into one event.
+        """
+        return (self.start == other.end and
+                self.subject == other.subject and
+                self.class_name == other.class_name and
+                self.teacher == other.teacher and
+                self.room == other.room)
+
+    def __eq__(self, other):
+        if not isinstance(other, Lesson):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in Interval.__slots__ + Lesson.__slots__)
+
+    def __repr__(self):
+        return f"Lesson({self.subject!r}, {self.start.isoformat()}, {self.end.isoformat()})"
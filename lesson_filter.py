@@ -0,0 +1,71 @@
+import re
+
+
+class LessonFilter:
+    """
+    A compiled set of rules that decides which lessons are left out of the calendar.
+
+    The rules come from the 'ALL4SCHOOLS_LESSONS_TO_REMOVE' list. Every entry is one of:
+
+        "StudioTimes"              - removes lessons whose subject contains the text
+        {"contains": "StudioTimes"} - the same, written out
+        {"exact": "Sport"}         - removes lessons whose subject is exactly the text
+        {"regex": "^AG "}          - removes lessons whose subject matches the regular expression
+
+    A lesson is removed if any rule matches. The rules are compiled once: exact names go
+    into a set, all substrings into a single regular expression, so checking a lesson does
+    not depend on the number of substring rules.
+
+    Args:
+        rules (list, optional): The rules. An empty list removes nothing.
+
+    Raises:
+        ValueError: If a rule has an unknown form or an invalid regular expression.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = list(rules or [])
+        exact = set()
+        substrings = []
+        patterns = []
+        for rule in self.rules:
+            if isinstance(rule, str):
+                substrings.append(rule)
+            elif isinstance(rule, dict) and len(rule) == 1:
+                kind, value = next(iter(rule.items()))
+                if kind == "exact":
+                    exact.add(value)
+                elif kind == "contains":
+                    substrings.append(value)
+                elif kind == "regex":
+                    try:
+                        patterns.append(re.compile(value))
+                    except re.error as e:
+                        raise ValueError(f"Invalid regular expression in lesson filter {value!r}: {e}") from e
+                else:
+                    raise ValueError(f"Unknown lesson filter rule {rule!r}")
+            else:
+                raise ValueError(f"Unknown lesson filter rule {rule!r}")
+
+        self._exact = frozenset(exact)
+        self._substrings = re.compile("|".join(re.escape(substring) for substring in substrings)) if substrings else None
+        self._patterns = tuple(patterns)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def excludes(self, subject):
+        """
+        Check whether a lesson with this subject name is removed.
+
+        Args:
+            subject (str): The subject name of the lesson.
+
+        Returns:
+            bool: True if any rule matches.
+        """
+        if subject in self._exact:
+            return True
+        if self._substrings is not None and self._substrings.search(subject):
+            return True
+        return any(pattern.search(subject) for pattern in self._patterns)
@@ -1,22 +1,34 @@
-from datetime import datetime, timedelta, timezone
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 import threading
 import os
 import time
 
-from get_data import get_data
-from get_cookies import get_cookies
-from handle_data import handle_data
-from compress_events import compress_events
-from add_event import add_event
-from clean_up_events import calculate_free_times
-from set_free_time_in_calander import remove_events_in_time_range
-from get_user_id import get_user_id
-from get_school_id import get_school_id
+from get_data import get_data_with_fingerprint, stream_schedule
+from chunked_fetch import get_data_chunked
+from handle_data import handle_data, normalize_lessons
+from compress_events import compress_events, compress_lessons
+from recurrence import compact_series
+from session_manager import SessionManager
+from calendar_snapshot import calendar_tokens, calendar_version
+from delta_sync import load_snapshot
+from caldav_pool import get_calendar
+from sync_state import SyncState
+from event_store import EventStore
+from ics_feed import render_feed, write_feed, feed_version, serve_feeds
+from reconcile import build_plan, execute_plan
+from config import SyncConfig, SyncTier, load_accounts
+from errors import DeadlineExceeded
+from metrics import stage, count_events, inc, observe, log_record, start_server
+import deadline
 
 load_dotenv(override=True)
 
+_account_states = {}
+_event_stores = {}
+_account_states_lock = threading.Lock()
+
 def print_with_timestamp(message):
     """
     Print a message with a timestamp prefix.
@@ -38,63 +50,126 @@ def print_with_timestamp(message):
     print(f"\033[97m[{timestamp}]\033[0m {message}")
 
 
-def get_current_date_and_days_later():
+def get_account_state(config, tier=None, target=None):
     """
-    Get the current date and a future date based on the 'DAYS_TO_ADD' environment variable.
+    Return the session manager and sync state of an account, creating them on first use.
 
-    This function calculates two dates:
-    1. The current date and time in UTC.
-    2. A future date that is 'DAYS_TO_ADD' days from the current date.
+    Both live for the whole process, so the cached All4Schools session and the state of the
+    last applied cycle survive between cycles. All bands and calendar targets of an account
+    share the session manager and have their own sync state.
 
-    The 'DAYS_TO_ADD' value is read from the environment variables.
+    Args:
+        config (SyncConfig): The account.
+        tier (SyncTier, optional): The band of the sync period. Defaults to the whole period.
+        target (CalendarTarget, optional): The calendar. Defaults to the one set in 'calendar_url'.
 
     Returns:
-        tuple: A tuple containing two strings:
-            - The current date and time in ISO 8601 format (YYYY-MM-DDTHH:MM:SS.sssZ).
-            - The future date and time in ISO 8601 format (YYYY-MM-DDTHH:MM:SS.sssZ).
+        tuple: The SessionManager and the SyncState of the account.
+    """
+    state_key = (tier.name if tier is not None else "", target.name if target is not None else "")
+    with _account_states_lock:
+        if config.name not in _account_states:
+            _account_states[config.name] = (SessionManager(config), {})
+        session_manager, sync_states = _account_states[config.name]
+        if state_key not in sync_states:
+            sync_states[state_key] = SyncState(config, tier=tier, target=target)
+        return session_manager, sync_states[state_key]
 
-    Note:
-        Both dates are returned as UTC timestamps.
+
+def get_event_store(config, tier=None, target=None):
     """
-    today = datetime.now(timezone.utc)
-    days_later = today + timedelta(days=int(os.getenv('DAYS_TO_ADD')))
-    return today.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), days_later.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    Return the event store of an account, opening it on first use.
+
+    Args:
+        config (SyncConfig): The account.
+        tier (SyncTier, optional): The band of the sync period. Defaults to the whole period.
+        target (CalendarTarget, optional): The calendar. Defaults to the one set in 'calendar_url'.
+
+    Returns:
+        EventStore or None: The store, None if the account has no 'event_store_file'.
+    """
+    if not config.event_store_file:
+        return None
+    scope = tier.name if tier is not None else ""
+    url, username = (target.url, target.username) if target is not None else (config.calendar_url, config.calendar_username)
+    key = (config.event_store_file, url, scope)
+    with _account_states_lock:
+        if key not in _event_stores:
+            _event_stores[key] = EventStore(config.event_store_file, f"{username}|{url}", scope)
+        return _event_stores[key]
+
+
+def connect_target(target):
+    """
+    Open the calendar of a target and read its version, without downloading events.
 
+    Args:
+        target (CalendarTarget): The calendar.
 
-def process_event(event):
+    Returns:
+        tuple: The caldav.Calendar, its ctag and its sync token (see calendar_tokens).
     """
-    Process a single event and add it to the calendar.
+    calendar__ = get_calendar(target.url, target.username, target.password)
+    return (calendar__, *calendar_tokens(calendar__))
 
-    This function extracts relevant information from the event dictionary
-    and calls the add_event function to add the event to the calendar.
+
+def for_each_target(targets, function, log):
+    """
+    Call a function for every calendar target, all targets at the same time.
+
+    With a single target the function is called directly and its errors are raised. With
+    several targets, every target runs in its own thread and an error of one target is
+    logged without affecting the others.
 
     Args:
-        event (dict): A dictionary containing event information with the following keys:
-            - 'SubjectName': The name of the subject (str)
-            - 'start': The start time of the event (str in format "%Y-%m-%dT%H:%M:%S%z")
-            - 'end': The end time of the event (str in format "%Y-%m-%dT%H:%M:%S%z")
-            - 'TeacherName': The name of the primary teacher (str)
-            - 'AdditionalTeacherNamesString': Names of additional teachers (str)
-            - 'RoomName': The name of the primary room (str)
-            - 'AdditionalRooms': Names of additional rooms (str)
-            - 'StudentClassName': The name of the student class (str)
+        targets (list): The CalendarTarget objects.
+        function (callable): Called with a target.
+        log (callable): Called with the error messages.
 
     Returns:
-        None
+        dict: The result of every target by its name, None for targets that failed.
+    """
+    if len(targets) == 1:
+        return {targets[0].name: function(targets[0])}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+        futures = {target: executor.submit(deadline.bind(function), target) for target in targets}
+        for target, future in futures.items():
+            try:
+                results[target.name] = future.result()
+            except Exception as e:
+                log(f"\033[91m[{target.label}] Sync failed: {e!r}\033[0m")
+                results[target.name] = None
+    return results
+
+
+def get_current_date_and_days_later(days_to_add=None, days_from=0):
+    """
+    Get the current date and a future date based on the 'DAYS_TO_ADD' environment variable.
+
+    This function calculates two dates:
+    1. The current date and time in UTC.
+    2. A future date that is 'DAYS_TO_ADD' days from the current date.
+
+    The 'DAYS_TO_ADD' value is read from the environment variables.
+
+    Args:
+        days_to_add (int, optional): Number of days to use instead of 'DAYS_TO_ADD'.
+        days_from (int, optional): Number of days to move the current date into the future. Defaults to 0.
+
+    Returns:
+        tuple: A tuple containing two strings:
+            - The current date and time in ISO 8601 format (YYYY-MM-DDTHH:MM:SS.sssZ).
+            - The future date and time in ISO 8601 format (YYYY-MM-DDTHH:MM:SS.sssZ).
 
     Note:
-        This function does not return any value but calls the add_event function
-        to add the processed event to the calendar.
+        Both dates are returned as UTC timestamps.
     """
-    subject = event['SubjectName']
-    start_time = datetime.strptime(event['start'], "%Y-%m-%dT%H:%M:%S%z")
-    end_time = datetime.strptime(event['end'], "%Y-%m-%dT%H:%M:%S%z")
-    teacher = event['TeacherName']
-    additional_teachers = event['AdditionalTeacherNamesString']
-    room = event['RoomName']
-    additional_rooms = event['AdditionalRooms']
-    class_name = event['StudentClassName']
-    add_event(subject, start_time, end_time, teacher, additional_teachers, room, additional_rooms, class_name)
+    if days_to_add is None:
+        days_to_add = int(os.getenv('DAYS_TO_ADD'))
+    today = datetime.now(timezone.utc) + timedelta(days=days_from)
+    days_later = today + timedelta(days=days_to_add - days_from)
+    return today.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), days_later.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
 
 def print_progress_bar(processed, total):
@@ -123,116 +198,289 @@ def print_progress_bar(processed, total):
     print(f"\r\033[92mProcessing events: [{bar}] {processed}/{total} ({progress * 100:.2f}%)\033[0m")
 
 
-def process_event_with_progress(event, lock, processed_events, total_events, last_print_time):
+def main(config=None, tier=None):
     """
-    Processes an event and updates the progress bar.
+    Run one sync cycle for an account.
+
+    With a tier, only the lessons starting in the band of the tier are fetched and written,
+    and only events starting in the band are deleted. With an 'ics_feed_file', the lessons
+    are written to the feed file and the CalDAV calendar is not used.
+
+    The schedule is fetched and processed once, and then written to every calendar target
+    of the account at the same time (see sync_target). A target that fails does not stop
+    the others.
+
+    The cycle has to finish within config.cycle_deadline(tier) seconds. Every request gets
+    at most the remaining time, and no request is sent once it has passed (see deadline).
+    Changes that were written by then are kept and recorded, the rest is written in the
+    next cycle.
 
     Args:
-        event: The event to be processed.
-        lock: A threading lock to ensure thread-safe updates to the processed_events counter.
-        processed_events (list): A list containing a single integer representing the number of processed events.
-        total_events (int): The total number of events to be processed.
-        last_print_time (list): A list containing a single float representing the last time the progress bar was printed.
+        config (SyncConfig, optional): The account to sync. Defaults to the environment variables.
+        tier (SyncTier, optional): The band of the sync period. Defaults to the whole period.
 
     Returns:
         None
+
+    Raises:
+        ValueError: If the account has neither a calendar nor a feed file.
+        DeadlineExceeded: If the deadline of the cycle passed before the schedule was fetched
+                          or the calendar was read.
     """
-    process_event(event)
-    with lock:
-        processed_events[0] += 1
-        current_time = time.time()
-        if processed_events[0] == total_events or (current_time - last_print_time[0] >= int(os.getenv('SLEEP_PRINT_DELAY_SECONDS', 10)) / 2):
-            print_progress_bar(processed_events[0], total_events)
-            last_print_time[0] = current_time
+    config = config or SyncConfig.from_env()
+    tier = tier or SyncTier("", 0, config.days_to_add, config.interval_minutes)
+    with deadline.cycle_deadline(config.cycle_deadline(tier)):
+        run_cycle(config, tier)
 
 
-def process_free_time_range(time_range, lock, processed_free_times, total_free_times, last_print_time_free):
+def run_cycle(config, tier):
     """
-    Processes a given time range by removing events within that range and updating the progress.
+    Run the steps of a sync cycle, see main.
 
     Args:
-        time_range (tuple): The time range to process.
-        lock (threading.Lock): A lock to ensure thread-safe operations.
-        processed_free_times (list): A list containing the count of processed free times.
-        total_free_times (int): The total number of free times to process.
-        last_print_time_free (list): A list containing the last time the progress was printed.
+        config (SyncConfig): The account to sync.
+        tier (SyncTier): The band of the sync period.
 
     Returns:
         None
     """
-    remove_events_in_time_range(time_range)
-    with lock:
-        processed_free_times[0] += 1
-        current_time = time.time()
-        if processed_free_times[0] == total_free_times or (current_time - last_print_time_free[0] >= int(os.getenv('SLEEP_PRINT_DELAY_SECONDS', 10)) / 2):
-            print_progress_bar(processed_free_times[0], total_free_times)
-            last_print_time_free[0] = current_time
-
-def main():
-    print_with_timestamp("\033[94mLogging in...\033[0m")
-    session_id, auth_token = get_cookies()
-    print_with_timestamp("\033[92mLogged in\033[0m")
-
-    print_with_timestamp("\033[94mGetting user ID...\033[0m")
-    user_id = get_user_id(session_id, auth_token)
-    print_with_timestamp("\033[94mGot user ID\033[0m")
-    
-    print_with_timestamp("\033[94mGetting school ID...\033[0m")
-    school_id = get_school_id(session_id, auth_token)
-    print_with_timestamp("\033[94mGot school ID\033[0m")
-
-    print_with_timestamp("\033[94mGetting current date and days later...\033[0m")
-    current_date, days_later = get_current_date_and_days_later()
-    print_with_timestamp(f"\033[96mCurrent date: {current_date}\033[0m")
-    print_with_timestamp(f"\033[96m{os.getenv('DAYS_TO_ADD')} days later: {days_later}\033[0m")
-
-    print_with_timestamp("\033[94mGetting data...\033[0m")
-    data = get_data(current_date, days_later, session_id, auth_token, user_id, school_id)
-    print_with_timestamp("\033[92mGot data\033[0m")
-
-    print_with_timestamp("\033[94mHandling data...\033[0m")
-    parsed_data = handle_data(data)
-    print_with_timestamp("\033[92mHandled data\033[0m")
-
-    print_with_timestamp("\033[94mCompressing events...\033[0m")
-    compressed_data = compress_events(parsed_data)
-    print_with_timestamp("\033[92mCompressed events\033[0m")
-
-    print_with_timestamp("\033[94mAdding events to calendar...\033[0m")
-    total_events = len(compressed_data)
-    processed_events = [0]
-    lock = threading.Lock()
-    last_print_time = [time.time()]
-
-    with ThreadPoolExecutor() as executor:
-        executor.map(lambda event: process_event_with_progress(event, lock, processed_events, total_events, last_print_time), compressed_data)
-    print_progress_bar(total_events, total_events)
-    print_with_timestamp("\033[92mAll events processed.\033[0m")
-    print_with_timestamp("\033[92mAdded events to calendar\033[0m")
-    
-    print_with_timestamp("\033[94mCalculating free times...\033[0m")
-    free_times = calculate_free_times(compressed_data)
-    print_with_timestamp("\033[92mCalculated free times\033[0m")
-    
-    print_with_timestamp("\033[94mRemoving events from calendar...\033[0m")
-    remove_events_in_time_range(free_times)
-    print_with_timestamp("\033[92mRemoved events from calendar\033[0m")
+    session_manager, sync_state = get_account_state(config, tier)
+    last_tier = tier.end_days >= config.days_to_add
+
+    account = config.name
+    cycle_started = time.perf_counter()
+
+    def log(message):
+        prefix = config.log_prefix() + (f"\033[95m[{tier.name}]\033[0m " if tier.name else "")
+        print_with_timestamp(prefix + message)
+
+    def finish(result):
+        seconds = time.perf_counter() - cycle_started
+        inc("timesync_cycles_total", result=result, account=account)
+        observe("timesync_cycle_duration_seconds", seconds, account=account)
+        log_record({"type": "cycle", "account": account, "tier": tier.name, "result": result, "seconds": round(seconds, 6)})
+
+    log("\033[94mGetting All4Schools session...\033[0m")
+    _, logged_in = session_manager.get()
+    if logged_in:
+        log("\033[92mLogged in\033[0m")
+    else:
+        log("\033[92mReusing cached session\033[0m")
+
+    log("\033[94mGetting current date and days later...\033[0m")
+    now = datetime.now().astimezone()
+    current_date, days_later = get_current_date_and_days_later(tier.end_days, tier.start_days)
+    log(f"\033[96mCurrent date: {current_date}\033[0m")
+    log(f"\033[96m{tier.end_days} days later: {days_later}\033[0m")
+
+    if config.ics_feed_file:
+        sync_states = {"": sync_state}
+        versions = {"": feed_version(config.ics_feed_file)}
+    elif not config.targets:
+        raise ValueError("Set a calendar_url, calendar_targets or an ics_feed_file")
+    else:
+        sync_states = {target.name: get_account_state(config, tier, target)[1] for target in config.targets}
+        connections = for_each_target(config.targets, connect_target, log)
+        versions = {name: connection[1] or connection[2] for name, connection in connections.items() if connection is not None}
+    failed_targets = len(sync_states) - len(versions)
+    if not versions:
+        finish("failed")
+        return
+
+    def unchanged():
+        if not all(sync_states[name].is_unchanged(fingerprint, version) for name, version in versions.items()):
+            return False
+        log("\033[92mSchedule and calendar unchanged since the last sync, nothing to do.\033[0m")
+        finish("failed" if failed_targets else "unchanged")
+        return True
+
+    if config.stream_schedule:
+        log("\033[94mStreaming and compressing events...\033[0m")
+        with stage("get_data", account):
+            schedule = session_manager.run(lambda session: stream_schedule(current_date, days_later, session.session_id, session.auth_token, session.user_id, session.school_id, config.all4schools_url))
+            compressed_data = compress_events({"lessons": compress_lessons(normalize_lessons(schedule, config.lesson_filter))})
+            fingerprint = schedule.fingerprint
+        log(f"\033[92mGot {len(compressed_data)} compressed events\033[0m")
+
+        if unchanged():
+            return
+    else:
+        log("\033[94mGetting data...\033[0m")
+        with stage("get_data", account):
+            if config.fetch_chunk_days:
+                data, fingerprint = session_manager.run(lambda session: get_data_chunked(current_date, days_later, session.session_id, session.auth_token, session.user_id, session.school_id, config.all4schools_url, config.fetch_chunk_days))
+            else:
+                data, fingerprint = session_manager.run(lambda session: get_data_with_fingerprint(current_date, days_later, session.session_id, session.auth_token, session.user_id, session.school_id, config.all4schools_url))
+        log("\033[92mGot data\033[0m")
+
+        if unchanged():
+            return
+
+        log("\033[94mHandling data...\033[0m")
+        with stage("handle_data", account):
+            parsed_data = handle_data(data, config.lesson_filter)
+        log("\033[92mHandled data\033[0m")
+
+        log("\033[94mCompressing events...\033[0m")
+        with stage("compress_events", account):
+            compressed_data = compress_events(parsed_data)
+        log("\033[92mCompressed events\033[0m")
+
+    window_start = now + timedelta(days=tier.start_days) if tier.start_days else None
+    window_end = now + timedelta(days=tier.end_days) if not last_tier else None
+    if window_start is not None or window_end is not None:
+        compressed_data = [lesson for lesson in compressed_data if (window_start is None or lesson.start >= window_start) and (window_end is None or lesson.start < window_end)]
+
+    if config.recurring_lessons:
+        log("\033[94mCompacting weekly lessons...\033[0m")
+        with stage("compact_series", account):
+            compressed_data = compact_series(compressed_data, config.recurring_min_occurrences, tier.name)
+        log(f"\033[92mCompacted into {len(compressed_data)} events\033[0m")
+
+    if config.ics_feed_file:
+        log("\033[94mWriting calendar feed...\033[0m")
+        with stage("write_feed", account):
+            written = write_feed(config.ics_feed_file, render_feed(compressed_data, config.name, tier.interval_minutes))
+        if written is None:
+            sync_state.clear()
+            finish("failed")
+            return
+        log(f"\033[92m{'Wrote' if written else 'Unchanged'} {config.ics_feed_file} with {len(compressed_data)} events\033[0m")
+        sync_state.record(fingerprint, feed_version(config.ics_feed_file), len(compressed_data))
+        finish("applied" if written else "up_to_date")
+        return
+
+    def target_log(target):
+        if len(config.targets) < 2:
+            return log
+        return lambda message: log(f"\033[95m[{target.label}]\033[0m " + message)
+
+    def sync(target):
+        try:
+            return sync_target(config, tier, target, compressed_data, fingerprint, now, connections[target.name], sync_states[target.name], target_log(target))
+        except Exception:
+            sync_states[target.name].clear()
+            raise
+
+    changed_targets = [target for target in config.targets
+                       if target.name in versions and not sync_states[target.name].is_unchanged(fingerprint, versions[target.name])]
+    results = list(for_each_target(changed_targets, sync, log).values())
+    if failed_targets or None in results or "failed" in results:
+        finish("failed")
+    elif "deadline" in results:
+        finish("deadline")
+    else:
+        finish("applied" if "applied" in results else "up_to_date")
+
+
+def sync_target(config, tier, target, lessons, fingerprint, now, connection, sync_state, log):
+    """
+    Write the scheduled lessons of a sync cycle to one calendar target.
+
+    Args:
+        config (SyncConfig): The account.
+        tier (SyncTier): The band of the sync period.
+        target (CalendarTarget): The calendar.
+        lessons (list): The Lesson and LessonSeries objects to write.
+        fingerprint (str): The fingerprint of the schedule response.
+        now (datetime): The start of the sync cycle.
+        connection (tuple): The calendar, ctag and sync token as returned by connect_target.
+        sync_state (SyncState): The state of the target.
+        log (callable): Called with the log messages of the target.
+
+    Returns:
+        str: 'applied', 'up_to_date', 'failed' or 'deadline' if the deadline of the cycle
+             passed before all changes were written.
+    """
+    account = config.name
+    calendar__, ctag, sync_token = connection
+    version = ctag or sync_token
+    last_tier = tier.end_days >= config.days_to_add
+    window_start = now + timedelta(days=tier.start_days) if tier.start_days else None
+    window_end = now + timedelta(days=tier.end_days) if not last_tier else None
+
+    snapshot_days = max(config.days_to_add, config.days_to_update) if last_tier else tier.end_days
+    snapshot_start, snapshot_end = window_start or now, now + timedelta(days=snapshot_days)
+    store = get_event_store(config, tier, target)
+    log("\033[94mLoading calendar events...\033[0m")
+    with stage("load_calendar", account):
+        snapshot, source = load_snapshot(calendar__, store, snapshot_start, snapshot_end, ctag, sync_token, config.full_sync_hours * 3600)
+    log(f"\033[92mLoaded {len(snapshot)} calendar events ({source})\033[0m")
+
+    log("\033[94mPlanning changes...\033[0m")
+    delete_until = now + timedelta(days=config.days_to_update)
+    if window_end is not None:
+        delete_until = min(delete_until, window_end)
+    with stage("build_plan", account):
+        plan = build_plan(lessons, snapshot, delete_until, window_start)
+    log(f"\033[96mPlan: {plan.summary()}\033[0m")
+
+    if not plan:
+        log("\033[92mCalendar is up to date.\033[0m")
+        count_events(plan, None, account)
+    else:
+        log("\033[94mApplying changes to calendar...\033[0m")
+        last_print_time = [time.time()]
+
+        def print_progress(processed, total):
+            current_time = time.time()
+            if processed == total or (current_time - last_print_time[0] >= int(os.getenv('SLEEP_PRINT_DELAY_SECONDS', 10)) / 2):
+                print_progress_bar(processed, total)
+                last_print_time[0] = current_time
+
+        with stage("write_events", account):
+            report = execute_plan(plan, snapshot, print_progress, store)
+        count_events(plan, report, account)
+        cut_off = report.cut_off
+        for result in report.failed:
+            if not isinstance(result.error, DeadlineExceeded):
+                reason = result.error if result.error else "not found on the server after writing"
+                log(f"\033[91mFailed to {result.kind} event {result.uid}: {reason}\033[0m")
+        log(f"\033[96mWrites: {report.summary()}\033[0m")
+        if cut_off:
+            log(f"\033[93mDeadline reached, {len(cut_off)} changes are left for the next cycle\033[0m")
+        if report.failed:
+            sync_state.clear()
+            return "failed" if len(report.failed) > len(cut_off) else "deadline"
+        log("\033[92mApplied changes to calendar\033[0m")
+
+    if plan:
+        version = calendar_version(calendar__)
+        if store is not None:
+            store.set_version(version)
+    sync_state.record(fingerprint, version, len(snapshot))
+    return "applied" if plan else "up_to_date"
+
 
 if __name__ == "__main__":
-    interval_minutes = int(os.getenv('INTERVAL_MINUTES', 10))
-    while True:
-        start_time = time.time()
-        main()
-        end_time = time.time()
-        iteration_duration = end_time - start_time
-        print_with_timestamp(f"\033[94mIteration took {iteration_duration:.2f} seconds.\033[0m")
-        sleep_time = interval_minutes * 60
-        interval = int(os.getenv('SLEEP_PRINT_DELAY_SECONDS', 10))
-        bar_length = int(os.getenv("PRINT_BAR_LENGTH", 50))
-        for i in range(0, sleep_time, interval):
-            progress = i / sleep_time
-            block = int(round(bar_length * progress))
-            bar = "#" * block + "-" * (bar_length - block)
-            print(f"\r\033[93mSleeping: [{bar}] {i // interval}/{sleep_time // interval} ({progress * 100:.2f}%) - {sleep_time - i} seconds remaining\033[0m")
-            time.sleep(interval)
-        print_with_timestamp(f"\r\033[93mSleeping: [{'#' * bar_length}] {sleep_time // interval}/{sleep_time // interval} (100.00%) - 0 seconds remaining\033[0m")
+    accounts_file = os.getenv('ACCOUNTS_FILE')
+    start_server()
+    serve_feeds(load_accounts(accounts_file) if accounts_file else [SyncConfig.from_env()])
+    if os.getenv('ASYNC_SYNC', '').lower() in ('1', 'true', 'yes'):
+        import asyncio
+        from async_sync import run_async_daemon
+        asyncio.run(run_async_daemon(load_accounts(accounts_file) if accounts_file else [SyncConfig.from_env()]))
+    elif accounts_file or os.getenv('SYNC_TIERS'):
+        from daemon import run_daemon
+        run_daemon(load_accounts(accounts_file) if accounts_file else [SyncConfig.from_env()])
+    else:
+        interval_minutes = int(os.getenv('INTERVAL_MINUTES', 10))
+        while True:
+            start_time = time.time()
+            try:
+                main()
+            except DeadlineExceeded as e:
+                print_with_timestamp(f"\033[93m{e}, continuing in the next cycle.\033[0m")
+            end_time = time.time()
+            iteration_duration = end_time - start_time
+            print_with_timestamp(f"\033[94mIteration took {iteration_duration:.2f} seconds.\033[0m")
+            sleep_time = interval_minutes * 60
+            interval = int(os.getenv('SLEEP_PRINT_DELAY_SECONDS', 10))
+            bar_length = int(os.getenv("PRINT_BAR_LENGTH", 50))
+            for i in range(0, sleep_time, interval):
+                progress = i / sleep_time
+                block = int(round(bar_length * progress))
+                bar = "#" * block + "-" * (bar_length - block)
+                print(f"\r\033[93mSleeping: [{bar}] {i // interval}/{sleep_time // interval} ({progress * 100:.2f}%) - {sleep_time - i} seconds remaining\033[0m")
+                time.sleep(interval)
+            print_with_timestamp(f"\r\033[93mSleeping: [{'#' * bar_length}] {sleep_time // interval}/{sleep_time // interval} (100.00%) - 0 seconds remaining\033[0m")
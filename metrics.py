@@ -0,0 +1,266 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+import threading
+import json
+import time
+import os
+
+from deadline import request_timeout
+
+load_dotenv(override=True)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_server = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """
+    Add to a counter.
+
+    Args:
+        name (str): The metric name, for example 'timesync_events_total'.
+        value (float, optional): The amount to add. Defaults to 1.
+        **labels: The label values of the counter.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """
+    Record a value, usually a duration in seconds, in a histogram.
+
+    Args:
+        name (str): The metric name, for example 'timesync_stage_duration_seconds'.
+        value (float): The observed value.
+        **labels: The label values of the histogram.
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def counters():
+    """
+    Return the current value of every counter.
+
+    Returns:
+        dict: (name, labels) -> value, where labels is a sorted tuple of (label, value) pairs.
+    """
+    with _lock:
+        return dict(_counters)
+
+
+def log_record(record):
+    """
+    Append a record to the JSON-lines file set in 'METRICS_FILE'. Does nothing if it is not set.
+
+    Args:
+        record (dict): The JSON serializable record. A 'time' field (epoch seconds) is added.
+    """
+    path = os.getenv('METRICS_FILE')
+    if not path:
+        return
+    line = json.dumps({"time": round(time.time(), 3), **record})
+    with _lock:
+        try:
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+        except OSError as e:
+            print(f"Could not write {path}: {e}")
+
+
+@contextmanager
+def stage(name, account=""):
+    """
+    Time a stage of a sync cycle.
+
+    The duration is recorded in the 'timesync_stage_duration_seconds' histogram and written
+    to the JSON-lines file, also if the stage raises.
+
+    Args:
+        name (str): The stage, for example 'get_data'.
+        account (str, optional): The name of the account.
+    """
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        seconds = time.perf_counter() - started
+        observe("timesync_stage_duration_seconds", seconds, stage=name, account=account)
+        log_record({"type": "stage", "stage": name, "account": account, "seconds": round(seconds, 6), "ok": ok})
+
+
+def record_http(url, method, status, seconds):
+    """
+    Count an HTTP request and record its latency, per remote host.
+
+    Args:
+        url (str): The requested URL.
+        method (str): The HTTP method.
+        status (int or str): The response status, or 'error' if no response was received.
+        seconds (float): Seconds until the response headers arrived.
+    """
+    host = urlsplit(str(url)).netloc
+    inc("timesync_http_requests_total", host=host, method=method, status=str(status))
+    observe("timesync_http_request_duration_seconds", seconds, host=host)
+
+
+def count_events(plan, report=None, account=""):
+    """
+    Count the events of an applied sync plan in 'timesync_events_total'.
+
+    Args:
+        plan (SyncPlan): The plan.
+        report (WriteReport, optional): The outcome of the plan, None if nothing was written.
+        account (str, optional): The name of the account.
+    """
+    actions = {"create": "created", "update": "updated", "delete": "deleted"}
+    counts = {"created": 0, "updated": 0, "deleted": 0, "skipped": plan.unchanged, "failed": 0}
+    for result in report.results if report is not None else ():
+        counts[actions[result.kind] if result.ok else "failed"] += 1
+    for action, count in counts.items():
+        inc("timesync_events_total", count, action=action, account=account)
+    log_record({"type": "events", "account": account, **counts})
+
+
+class MeteredAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that records every request with record_http.
+
+    Requests without a timeout get the timeouts of their host, and all requests are limited
+    by the deadline of the current sync cycle (see deadline.request_timeout).
+    """
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        timeout = request_timeout(request.url, timeout)
+        started = time.perf_counter()
+        try:
+            response = super().send(request, stream=stream, timeout=timeout, **kwargs)
+        except Exception:
+            record_http(request.url, request.method, "error", time.perf_counter() - started)
+            raise
+        record_http(request.url, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+
+def aiohttp_trace_config():
+    """
+    Return an aiohttp TraceConfig that records every request with record_http.
+
+    Returns:
+        aiohttp.TraceConfig: Pass it to aiohttp.ClientSession(trace_configs=[...]).
+    """
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        record_http(params.url, params.method, params.response.status, time.perf_counter() - context.started)
+
+    async def on_request_exception(session, context, params):
+        record_http(params.url, params.method, "error", time.perf_counter() - context.started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render():
+    """
+    Return all metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics.
+    """
+    with _lock:
+        counter_items = sorted(_counters.items())
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+    lines = []
+    last_name = None
+    for (name, labels), value in counter_items:
+        if name != last_name:
+            lines.append(f"# TYPE {name} counter")
+            last_name = name
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), values in histograms:
+        if name != last_name:
+            lines.append(f"# TYPE {name} histogram")
+            last_name = name
+        for bound, count in zip(BUCKETS, values):
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {values[-1]}")
+        lines.append(f"{name}_sum{_labels(labels)} {values[-2]}")
+        lines.append(f"{name}_count{_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=None, host=None):
+    """
+    Serve the metrics on http://host:port/metrics from a background thread.
+
+    Args:
+        port (int, optional): Defaults to the 'METRICS_PORT' environment variable. If neither is
+                              set, no server is started.
+        host (str, optional): Defaults to the 'METRICS_HOST' environment variable, or 127.0.0.1.
+
+    Returns:
+        ThreadingHTTPServer or None: The running server, None if no port is set.
+    """
+    global _server
+    port = port or os.getenv('METRICS_PORT')
+    if not port:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host or os.getenv('METRICS_HOST', '127.0.0.1'), int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
@@ -0,0 +1,190 @@
+from datetime import datetime
+
+from add_event import build_lesson_event, build_series_event, build_truncated_series_event, series_uid
+from event_store import content_hash
+from lesson import to_datetime
+from recurrence import LessonSeries, continue_series, series_occurrences
+from write_pipeline import WritePipeline
+
+
+class SyncPlan:
+    """
+    The changes needed to make the calendar match the schedule.
+
+    Attributes:
+        creates (list): (uid, start_time, end_time, ical) tuples of events that are missing.
+        updates (list): (uid, start_time, end_time, ical, replaced) tuples of events whose time slot
+                        is taken by outdated events. 'replaced' maps the outdated UIDs to their events.
+        deletes (list): (uid, event) tuples of events that are no longer in the schedule.
+        unchanged (int): Number of scheduled events that are already in the calendar.
+    """
+
+    def __init__(self):
+        self.creates = []
+        self.updates = []
+        self.deletes = []
+        self.unchanged = 0
+
+    def __len__(self):
+        return len(self.creates) + len(self.updates) + len(self.deletes)
+
+    def summary(self):
+        """
+        Return a short human readable description of the plan.
+        """
+        return f"{len(self.creates)} to create, {len(self.updates)} to update, {len(self.deletes)} to delete, {self.unchanged} unchanged"
+
+
+def build_plan(lessons, snapshot, delete_until=None, delete_from=None):
+    """
+    Compare the scheduled lessons with the calendar and work out which writes are needed.
+
+    Every lesson is identified by the MD5 UID built by add_event, so a lesson is unchanged when its
+    UID is already in the calendar. If the snapshot comes from an EventStore, the content hash of
+    the event written last is compared as well, and the event is only rewritten if the iCalendar
+    data built for the lesson differs. Lessons that already ended are ignored.
+
+    A LessonSeries keeps its UID while the sync window moves on. The occurrences of its event
+    that already started are kept (see recurrence.continue_series), and the event is only
+    rewritten if its occurrences change. A series that is no longer scheduled is cut off at its
+    last occurrence before now instead of being deleted, so the past lessons stay in the
+    calendar. If the snapshot comes from an EventStore, the data of these events is downloaded
+    with a single multiget first.
+
+    A new event replaces the events in the time slots of all of its occurrences, so the single
+    events written before a series took their place are removed with it. Events of other
+    scheduled lessons are never replaced.
+
+    Args:
+        lessons (list): The compressed Lesson objects as returned by compress_events, and
+                        LessonSeries objects as returned by recurrence.compact_series.
+        snapshot (CalendarSnapshot): The current state of the calendar.
+        delete_until (datetime, optional): Only events starting before this time are deleted.
+                                           Defaults to no limit.
+        delete_from (datetime, optional): Only events starting at or after this time are deleted.
+                                          Defaults to no limit.
+
+    Returns:
+        SyncPlan: The creates, updates and deletes needed.
+    """
+    plan = SyncPlan()
+    now = datetime.now().astimezone()
+    desired = set()
+    replaced_uids = set()
+
+    built = [series_uid(lesson) if isinstance(lesson, LessonSeries) else build_lesson_event(lesson) for lesson in lessons]
+    series_uids = {item for item in built if isinstance(item, str)}
+    scheduled = series_uids | {item[0] for item in built if not isinstance(item, str)}
+    snapshot.load([uid for uid, _, _, _ in snapshot.items() if uid in series_uids or uid not in scheduled])
+
+    def has_past(event):
+        occurrences = series_occurrences(event)
+        return bool(occurrences) and occurrences[0] < now
+
+    events = []
+    for lesson, item in zip(lessons, built):
+        if isinstance(lesson, LessonSeries):
+            lesson = continue_series(lesson, snapshot.get(item), now)
+            events.append((build_series_event(lesson), [(occurrence.start, occurrence.end) for occurrence in lesson.lessons], lesson.occurrences))
+        else:
+            events.append((item, [item[1:3]], None))
+
+    for (uid, start_time, end_time, ical), slots, occurrences in events:
+        if end_time < now or uid in desired:
+            continue
+        desired.add(uid)
+
+        existing = snapshot.get(uid)
+        if existing is not None:
+            stored_hash = getattr(existing, "content_hash", None)
+            if (occurrences is None or series_occurrences(existing) == occurrences) and (stored_hash is None or stored_hash == content_hash(ical)):
+                plan.unchanged += 1
+                continue
+            # Updated in place: a series that moved on, or written by an older version of the event builder.
+            replaced = {uid: existing}
+        else:
+            replaced = {existing_uid: event for slot in slots for existing_uid, event in snapshot.at(*slot).items()
+                        if existing_uid not in replaced_uids and existing_uid not in scheduled and not has_past(event)}
+
+        if replaced:
+            replaced_uids.update(replaced)
+            plan.updates.append((uid, start_time, end_time, ical, replaced))
+        else:
+            plan.creates.append((uid, start_time, end_time, ical))
+
+    for uid, start_time, _, event in snapshot.items():
+        if uid in desired or uid in replaced_uids:
+            continue
+        if delete_until is not None and to_datetime(start_time) >= delete_until:
+            continue
+        if delete_from is not None and to_datetime(start_time) < delete_from:
+            continue
+        occurrences = series_occurrences(event)
+        past = [occurrence for occurrence in occurrences or () if occurrence < now]
+        if not past:
+            plan.deletes.append((uid, event))
+        elif past[-1] != occurrences[-1]:
+            plan.updates.append((uid, past[0], past[-1], build_truncated_series_event(event.data, past[-1]), {uid: event}))
+
+    return plan
+
+
+def execute_plan(plan, snapshot, progress=None, store=None):
+    """
+    Apply a sync plan to the calendar through a WritePipeline.
+
+    Args:
+        plan (SyncPlan): The plan to apply.
+        snapshot (CalendarSnapshot): The snapshot the plan was built from. It is kept up to date.
+        progress (callable, optional): Called with (processed, total) after every operation.
+        store (EventStore, optional): The event store to record the written and deleted events in.
+                                      If an operation fails, the store is invalidated, so the next
+                                      cycle downloads the calendar again. Operations cut off at the
+                                      deadline of the cycle do not invalidate it.
+
+    Returns:
+        WriteReport: The outcome of every operation. Failed operations do not stop the others.
+    """
+    pipeline = WritePipeline(snapshot)
+    for operation in plan.creates:
+        pipeline.create(*operation)
+    for operation in plan.updates:
+        pipeline.update(*operation)
+    for operation in plan.deletes:
+        pipeline.delete(*operation)
+    report = pipeline.run(progress)
+    if store is not None:
+        record_report(store, plan, report)
+    return report
+
+
+def record_report(store, plan, report):
+    """
+    Record the outcome of an applied plan in an event store.
+
+    Operations cut off at the deadline of the cycle do not invalidate the store: the events
+    that were written or deleted by then are recorded, and the next cycle picks up any
+    half-finished update with the changes on the server (see delta_sync.update_store) and
+    continues with the rest of the plan.
+
+    Args:
+        store (EventStore): The event store.
+        plan (SyncPlan): The applied plan.
+        report (WriteReport): The outcome of the plan.
+    """
+    if len(report.failed) > len(report.cut_off):
+        store.invalidate()
+        return
+    writes = {operation[0]: operation for operation in plan.creates + plan.updates}
+    for result in report.results:
+        if result.error is not None:
+            continue
+        if result.kind == "delete":
+            store.remove(result.uid)
+            continue
+        operation = writes[result.uid]
+        if result.kind == "update":
+            for replaced_uid in operation[4]:
+                store.remove(replaced_uid)
+        uid, start_time, end_time, ical = operation[:4]
+        store.put(uid, result.url, result.etag, content_hash(ical), start_time, end_time)
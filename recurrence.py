@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+
+from compress_events import lesson_key
+
+WEEK = timedelta(days=7)
+
+
+def series_key(lesson):
+    """
+    Return the attributes two lessons must share to be occurrences of the same weekly series.
+
+    Besides the details of the lesson, the weekday, time of day, UTC offset and duration must
+    match, so every occurrence is a whole number of weeks after the first one. A change of
+    the UTC offset (daylight saving time) starts a new series.
+
+    Args:
+        lesson (Lesson): The lesson.
+
+    Returns:
+        tuple: The key of the series.
+    """
+    return lesson_key(lesson) + (lesson.additional_teachers, lesson.additional_rooms, lesson.start.weekday(),
+                                 lesson.start.time(), lesson.start.utcoffset(), lesson.end - lesson.start)
+
+
+class LessonSeries:
+    """
+    A lesson that repeats every week, written to the calendar as one event with a weekly RRULE.
+
+    Weeks between the first and the last occurrence without the lesson, for example because it
+    was cancelled or replaced by a substitution, are excluded with EXDATE. A substitution is a
+    lesson with other details, so it stays a single event of its own.
+
+    The occurrences are the start times of the lessons, unless the series continues an event
+    that is already in the calendar (see continue_series).
+
+    Attributes:
+        lessons (list): The scheduled lessons, ordered by start.
+        scope (str): The band of a tiered sync the series belongs to, part of its UID.
+        occurrences (list): The start times of all occurrences, ordered.
+        exdates (list): The start times of the weeks without the lesson.
+    """
+
+    __slots__ = ("lessons", "scope", "occurrences", "exdates")
+
+    def __init__(self, lessons, scope="", occurrences=None):
+        self.lessons = sorted(lessons, key=lambda lesson: lesson.start)
+        self.scope = scope
+        self.occurrences = sorted(set(occurrences)) if occurrences is not None else [lesson.start for lesson in self.lessons]
+        first = self.occurrences[0]
+        weeks = {(occurrence - first) // WEEK for occurrence in self.occurrences}
+        self.exdates = [first + week * WEEK for week in range(max(weeks) + 1) if week not in weeks]
+
+    @property
+    def first(self):
+        return self.lessons[0]
+
+    @property
+    def start(self):
+        return self.lessons[0].start
+
+    @property
+    def end(self):
+        return self.lessons[-1].end
+
+    @property
+    def dtstart(self):
+        return self.occurrences[0]
+
+    @property
+    def until(self):
+        return self.occurrences[-1]
+
+    def __repr__(self):
+        return f"LessonSeries({self.first.subject!r}, {self.dtstart.isoformat()}, {len(self.occurrences)} occurrences, {len(self.exdates)} exdates)"
+
+
+def series_occurrences(event):
+    """
+    Return the start times of all occurrences of a recurring event read from the calendar.
+
+    Args:
+        event: A caldav event, or any event with a 'vobject_instance'. May be None.
+
+    Returns:
+        list or None: The start times, ordered. None if the event or its data is missing, or
+                      if it is not a recurring event with a last occurrence.
+    """
+    vobject_instance = getattr(event, "vobject_instance", None)
+    if vobject_instance is None:
+        return None
+    vevent = vobject_instance.vevent_list[0]
+    if "rrule" not in vevent.contents or not any(part in vevent.rrule.value.upper() for part in ("UNTIL=", "COUNT=")):
+        return None
+    start_time = vevent.dtstart.value
+    if not isinstance(start_time, datetime) or start_time.tzinfo is None:
+        return None
+    return list(vevent.getrruleset(addRDate=True))
+
+
+def continue_series(series, event, now):
+    """
+    Return the series to write in place of the event an earlier cycle wrote for it.
+
+    The schedule only reaches back to the current day, so the occurrences that started before
+    'now' are kept as they are in the calendar, with the first of them as DTSTART, and only the
+    later ones follow the schedule. The series keeps its UID, and the event is updated in place.
+
+    Args:
+        series (LessonSeries): The series built from the schedule.
+        event: The event of the series in the calendar, see series_occurrences. May be None.
+        now (datetime): The start of the sync cycle.
+
+    Returns:
+        LessonSeries: The continued series, or 'series' itself if there is nothing to continue.
+    """
+    occurrences = series_occurrences(event)
+    if not occurrences:
+        return series
+    past = [occurrence for occurrence in occurrences if occurrence < now]
+    if not past:
+        return series
+    occurrences = past + [lesson.start for lesson in series.lessons if lesson.start >= now]
+    if any((occurrence - occurrences[0]) % WEEK for occurrence in occurrences):
+        # Not on the weekly grid of the existing event, start over.
+        return series
+    return LessonSeries(series.lessons, series.scope, occurrences)
+
+
+def compact_series(lessons, min_occurrences=3, scope=""):
+    """
+    Collapse lessons that repeat every week into LessonSeries.
+
+    Lessons with the same series_key form a series if there are at least 'min_occurrences' of
+    them. All other lessons are returned unchanged.
+
+    Args:
+        lessons (list): The compressed Lesson objects as returned by compress_events.
+        min_occurrences (int, optional): The smallest number of lessons written as a series.
+                                         Defaults to 3.
+        scope (str, optional): The band of a tiered sync the lessons belong to. Series of
+                               different bands get different UIDs.
+
+    Returns:
+        list: Lesson and LessonSeries objects, ordered by start time.
+    """
+    groups = {}
+    for lesson in lessons:
+        groups.setdefault(series_key(lesson), []).append(lesson)
+
+    compacted = []
+    for group in groups.values():
+        if len(group) >= max(min_occurrences, 2):
+            compacted.append(LessonSeries(group, scope))
+        else:
+            compacted.extend(group)
+    compacted.sort(key=lambda item: item.start)
+    return compacted
@@ -0,0 +1,392 @@
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from urllib3.exceptions import ConnectTimeoutError
+from dotenv import load_dotenv
+import threading
+import requests
+import contextvars
+import asyncio
+import random
+import json
+import time
+import os
+
+from errors import DeadlineExceeded
+from metrics import MeteredAdapter, inc
+import deadline
+
+load_dotenv(override=True)
+
+THROTTLED = (429, 503)
+UNAVAILABLE = (502, 504)
+IDEMPOTENT = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE", "PROPFIND", "REPORT"))
+
+_lock = threading.Lock()
+_governor = None
+_read_only = contextvars.ContextVar("read_only", default=False)
+
+
+def parse_retry_after(value):
+    """
+    Return the seconds to wait from a 'Retry-After' header.
+
+    Args:
+        value (str): The header, either seconds or an HTTP date. None if it is missing.
+
+    Returns:
+        float or None: The seconds to wait, None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@contextmanager
+def read_only():
+    """
+    Mark the requests sent in the current thread or task as safe to send again.
+
+    Use it for requests whose method is not idempotent but which do not change anything on
+    the server, such as the GetSchedule POST, so they are retried like a GET.
+    """
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def not_sent(error):
+    """
+    Return whether a failed request certainly did not reach the server.
+
+    That is the case if the connection could not be opened: it timed out, was refused or the
+    host name could not be resolved. requests reports the latter two as a ConnectionError
+    caused by a urllib3 NewConnectionError.
+
+    Args:
+        error (requests.RequestException): The error of the request.
+
+    Returns:
+        bool: True if no part of the request was sent.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = getattr(error.args[0], "reason", error.args[0])
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class HostGovernor:
+    """
+    The request budget of one remote host.
+
+    A token bucket limits the requests per second, and an AIMD limit (additive increase,
+    multiplicative decrease) limits the requests in flight: every successful request raises
+    the limit by 1/limit, so it grows by one per round of requests, and a throttled or
+    failed request, or a latency far above the fastest one seen, halves it at most once per
+    round trip. A 'Retry-After' pauses the whole host.
+
+    Args:
+        host (str): The host, for log messages and metrics.
+        rate (float, optional): Requests per second, 0 for no limit.
+        burst (float, optional): Requests that can be sent at once after an idle period.
+                                 Defaults to the rate, at least 1.
+        max_concurrency (int, optional): The highest limit of requests in flight.
+    """
+
+    MIN_CONCURRENCY = 1
+    DECREASE = 0.5
+    LATENCY_FACTOR = 4.0
+    LATENCY_FLOOR = 0.25
+
+    def __init__(self, host, rate=0, burst=None, max_concurrency=16):
+        self.host = host
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate, 1))
+        self.max_concurrency = max(int(max_concurrency), self.MIN_CONCURRENCY)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.latency = None
+        self.base_latency = None
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased = 0.0
+        self._condition = threading.Condition()
+
+    def _try_acquire(self, now):
+        """
+        Take a slot if the host allows another request. Call with the condition held.
+
+        Returns 0 if a slot was taken, otherwise the seconds to wait, or None to wait
+        until a running request finishes.
+        """
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def _wait_time(self, wait, poll):
+        current = deadline.current()
+        remaining = current.remaining() if current is not None else None
+        if remaining is not None and remaining <= (wait or 0):
+            raise DeadlineExceeded(f"Deadline of {current.seconds:g}s reached while waiting for {self.host}")
+        wait = poll if wait is None else wait
+        if remaining is None:
+            return wait
+        return remaining if wait is None else min(wait, remaining)
+
+    def acquire(self):
+        """
+        Wait until the host allows another request and take a slot for it.
+
+        Raises:
+            DeadlineExceeded: If the deadline of the sync cycle passes while waiting.
+        """
+        with self._condition:
+            while True:
+                wait = self._try_acquire(time.monotonic())
+                if wait == 0:
+                    return
+                self._condition.wait(self._wait_time(wait, None))
+
+    async def acquire_async(self):
+        """
+        Like acquire, without blocking the event loop.
+        """
+        while True:
+            with self._condition:
+                wait = self._try_acquire(time.monotonic())
+            if wait == 0:
+                return
+            await asyncio.sleep(self._wait_time(wait, 0.01))
+
+    def release(self, status, seconds, retry_after=None):
+        """
+        Give back the slot of a finished request and adjust the limit to its outcome.
+
+        Args:
+            status (int or str): The response status, 'error' if no response was received, or
+                                 None if the request was not sent.
+            seconds (float): Seconds until the response headers arrived.
+            retry_after (float, optional): The seconds from a 'Retry-After' header.
+        """
+        now = time.monotonic()
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+            if status is None:
+                return
+            congested = status == "error" or status in THROTTLED or status in UNAVAILABLE
+            if not congested:
+                self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+                self.base_latency = self.latency if self.base_latency is None else min(self.base_latency, self.latency)
+                congested = self.latency > max(self.LATENCY_FACTOR * self.base_latency, self.LATENCY_FLOOR)
+            if congested:
+                if now - self._decreased > (self.latency or seconds):
+                    self.limit = max(self.MIN_CONCURRENCY, self.limit * self.DECREASE)
+                    self._decreased = now
+                    inc("timesync_http_throttled_total", host=self.host)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+    def __repr__(self):
+        return f"HostGovernor({self.host!r}, limit={self.limit:.1f}, in_flight={self.in_flight})"
+
+
+class RequestGovernor:
+    """
+    Send the HTTP requests of all accounts within the budget of their host.
+
+    Every host has a HostGovernor. Requests that were throttled (429, 503), hit an
+    unavailable gateway (502, 504) or failed in the network are retried with jittered
+    exponential backoff, waiting at least as long as a 'Retry-After' header asks. Gateway
+    and network errors are only retried for idempotent methods, for requests sent within
+    read_only, or if the connection could not be opened, so a write is never sent twice by
+    accident; a write that still fails is reported to the caller. No retry waits past the
+    deadline of the sync cycle.
+
+    The settings are read from the environment variables:
+        HTTP_RATE_LIMIT: Requests per second per host, 0 for no limit (default).
+        HTTP_RATE_LIMITS: A JSON object of host -> requests per second, or [rate, burst].
+        HTTP_MAX_CONCURRENCY: The highest number of requests in flight per host (default 16).
+        HTTP_RETRIES: How often a request is retried (default 4).
+        HTTP_BACKOFF_SECONDS: The first backoff (default 0.5), doubled for every retry.
+        HTTP_BACKOFF_MAX_SECONDS: The longest backoff (default 30).
+    """
+
+    def __init__(self):
+        self.rate = float(os.getenv('HTTP_RATE_LIMIT', 0))
+        self.rates = json.loads(os.getenv('HTTP_RATE_LIMITS') or '{}')
+        self.max_concurrency = int(os.getenv('HTTP_MAX_CONCURRENCY', 16))
+        self.retries = int(os.getenv('HTTP_RETRIES', 4))
+        self.backoff = float(os.getenv('HTTP_BACKOFF_SECONDS', 0.5))
+        self.backoff_max = float(os.getenv('HTTP_BACKOFF_MAX_SECONDS', 30))
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        """
+        Return the HostGovernor of the host of a URL, creating it on first use.
+        """
+        parts = urlsplit(str(url))
+        with self._lock:
+            if parts.netloc not in self._hosts:
+                rate = self.rates.get(parts.netloc, self.rates.get(parts.hostname, self.rate))
+                rate, burst = rate if isinstance(rate, list) else (rate, None)
+                self._hosts[parts.netloc] = HostGovernor(parts.netloc, rate, burst, self.max_concurrency)
+            return self._hosts[parts.netloc]
+
+    def retry_delay(self, method, attempt, status=None, retry_after=None, sent=True):
+        """
+        Return how long to wait before retrying a request, None if it is not retried.
+
+        Args:
+            method (str): The HTTP method.
+            attempt (int): The number of retries so far.
+            status (int, optional): The response status, None if no response was received.
+            retry_after (float, optional): The seconds from a 'Retry-After' header.
+            sent (bool, optional): False if the connection could not be opened, so the
+                                   request certainly did not reach the server.
+
+        Returns:
+            float or None: The seconds to wait.
+        """
+        if attempt >= self.retries:
+            return None
+        idempotent = method.upper() in IDEMPOTENT or _read_only.get()
+        if status is None:
+            retryable = not sent or idempotent
+        else:
+            retryable = status in THROTTLED or (status in UNAVAILABLE and idempotent)
+        if not retryable:
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        current = deadline.current()
+        if current is not None and delay >= current.remaining():
+            return None
+        return delay
+
+    def send(self, request, send):
+        """
+        Send a requests.PreparedRequest with send, retrying it if needed.
+
+        Args:
+            request (requests.PreparedRequest): The request.
+            send (callable): Sends the request once and returns the response.
+
+        Returns:
+            requests.Response: The response of the last attempt.
+        """
+        host = self.host(request.url)
+        attempt = 0
+        while True:
+            host.acquire()
+            started = time.perf_counter()
+            try:
+                response = send()
+            except requests.RequestException as e:
+                host.release("error", time.perf_counter() - started)
+                delay = self.retry_delay(request.method, attempt, sent=not not_sent(e))
+                if delay is None:
+                    raise
+                reason = type(e).__name__
+            except BaseException:
+                host.release(None, time.perf_counter() - started)
+                raise
+            else:
+                retry_after = parse_retry_after(response.headers.get("Retry-After")) if response.status_code in THROTTLED else None
+                host.release(response.status_code, time.perf_counter() - started, retry_after)
+                delay = self.retry_delay(request.method, attempt, response.status_code, retry_after)
+                if delay is None:
+                    return response
+                response.close()
+                reason = str(response.status_code)
+            inc("timesync_http_retries_total", host=host.host, reason=reason)
+            time.sleep(delay)
+            attempt += 1
+
+    async def send_async(self, method, url, send, errors=(), connect_errors=()):
+        """
+        Like send, for a coroutine function.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The requested URL.
+            send (callable): Sends the request once and returns the status, the headers and
+                             the result.
+            errors (tuple, optional): The network errors of the HTTP client.
+            connect_errors (tuple, optional): The errors raised when the connection could not
+                                              be opened.
+
+        Returns:
+            tuple: The status and the result of the last attempt.
+        """
+        host = self.host(url)
+        attempt = 0
+        while True:
+            await host.acquire_async()
+            started = time.perf_counter()
+            try:
+                status, headers, result = await send()
+            except (OSError, asyncio.TimeoutError) + tuple(errors) as e:
+                host.release("error", time.perf_counter() - started)
+                delay = self.retry_delay(method, attempt, sent=not isinstance(e, tuple(connect_errors)))
+                if delay is None:
+                    raise
+                reason = type(e).__name__
+            except BaseException:
+                host.release(None, time.perf_counter() - started)
+                raise
+            else:
+                retry_after = parse_retry_after(headers.get("Retry-After")) if status in THROTTLED else None
+                host.release(status, time.perf_counter() - started, retry_after)
+                delay = self.retry_delay(method, attempt, status, retry_after)
+                if delay is None:
+                    return status, result
+                reason = str(status)
+            inc("timesync_http_retries_total", host=host.host, reason=reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def get_governor():
+    """
+    Return the RequestGovernor shared by all HTTP requests of the process.
+    """
+    global _governor
+    with _lock:
+        if _governor is None:
+            _governor = RequestGovernor()
+        return _governor
+
+
+class GovernedAdapter(MeteredAdapter):
+    """
+    A MeteredAdapter that sends every request through the shared RequestGovernor.
+    """
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        return get_governor().send(request, lambda: super(GovernedAdapter, self).send(request, stream=stream, timeout=timeout, **kwargs))
@@ -0,0 +1,210 @@
+import codecs
+import hashlib
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+_INCOMPLETE = object()
+
+
+class LessonParser:
+    """
+    An incremental parser for the body of a GetSchedule response.
+
+    The body is fed in chunks of bytes as they arrive. Every lesson of the 'lessons' array is
+    returned as soon as it is complete, so only the current lesson and the unparsed rest of
+    the last chunk are held in memory, no matter how long the schedule is. Other keys of the
+    response are parsed and thrown away.
+
+    The parser also computes the SHA-256 fingerprint of the body, which is the same as the
+    fingerprint get_data_with_fingerprint computes from the whole body.
+
+    Args:
+        key (str, optional): The key of the array to stream. Defaults to "lessons".
+    """
+
+    def __init__(self, key="lessons"):
+        self.key = key
+        self._hash = hashlib.sha256()
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""
+        self._state = "start"
+        self._current_key = None
+        self._found = False
+        self._final = False
+
+    @property
+    def fingerprint(self):
+        """
+        The SHA-256 hex digest of all bytes fed so far.
+        """
+        return self._hash.hexdigest()
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk of the body.
+
+        Args:
+            chunk (bytes): The chunk.
+
+        Returns:
+            list: The lessons completed by this chunk, as dictionaries.
+
+        Raises:
+            ValueError: If the body is not a JSON object.
+        """
+        self._hash.update(chunk)
+        self._buffer += self._decoder.decode(chunk)
+        return self._parse()
+
+    def close(self):
+        """
+        Finish parsing after the last chunk.
+
+        Returns:
+            list: The remaining lessons, as dictionaries.
+
+        Raises:
+            ValueError: If the body is incomplete, not a JSON object or has no lessons.
+        """
+        self._buffer += self._decoder.decode(b"", final=True)
+        self._final = True
+        lessons = self._parse()
+        if self._state != "end":
+            raise ValueError("Schedule response is incomplete")
+        if not self._found:
+            raise ValueError(f"Schedule response has no '{self.key}'")
+        return lessons
+
+    def _decode(self, buffer, pos):
+        try:
+            value, end = _DECODER.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if self._final:
+                raise ValueError(f"Response content is not in JSON format: {e}") from e
+            return _INCOMPLETE, pos
+        if isinstance(value, (int, float)) and not self._final and (end == len(buffer) or buffer[end] in ".eE+-"):
+            # A number at the end of the buffer may continue in the next chunk.
+            return _INCOMPLETE, pos
+        return value, end
+
+    def _expect(self, char, expected):
+        if char not in expected:
+            raise ValueError(f"Response content is not in JSON format: unexpected {char!r} in state {self._state}")
+
+    def _parse(self):
+        lessons = []
+        buffer = self._buffer
+        pos = 0
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            state = self._state
+
+            if state == "start":
+                self._expect(char, "{")
+                self._state = "key"
+                pos += 1
+            elif state == "key":
+                if char == "}":
+                    self._state = "end"
+                    pos += 1
+                    continue
+                self._expect(char, '"')
+                value, pos = self._decode(buffer, pos)
+                if value is _INCOMPLETE:
+                    break
+                self._current_key = value
+                self._state = "colon"
+            elif state == "colon":
+                self._expect(char, ":")
+                self._state = "value"
+                pos += 1
+            elif state == "value" and self._current_key == self.key:
+                self._expect(char, "[")
+                self._found = True
+                self._state = "first_element"
+                pos += 1
+            elif state == "value":
+                value, pos = self._decode(buffer, pos)
+                if value is _INCOMPLETE:
+                    break
+                self._state = "next_key"
+            elif state == "next_key":
+                self._expect(char, ",}")
+                self._state = "key" if char == "," else "end"
+                pos += 1
+            elif state in ("first_element", "element"):
+                if state == "first_element" and char == "]":
+                    self._state = "next_key"
+                    pos += 1
+                    continue
+                value, pos = self._decode(buffer, pos)
+                if value is _INCOMPLETE:
+                    break
+                lessons.append(value)
+                self._state = "next_element"
+            elif state == "next_element":
+                self._expect(char, ",]")
+                self._state = "element" if char == "," else "next_key"
+                pos += 1
+            else:
+                raise ValueError("Response content is not in JSON format: data after the end of the response")
+
+        self._buffer = buffer[pos:]
+        return lessons
+
+
+class ScheduleStream:
+    """
+    The lessons of a streamed GetSchedule response.
+
+    Iterating yields the raw lesson dictionaries while the body is downloaded. The stream can
+    only be iterated once; the response is closed when the iteration ends.
+
+    Args:
+        response (requests.Response): A response opened with stream=True.
+        chunk_size (int, optional): Number of bytes read at a time. Defaults to 64 KiB.
+    """
+
+    def __init__(self, response, chunk_size=65536):
+        self.response = response
+        self.chunk_size = chunk_size
+        self._parser = LessonParser()
+        self._done = False
+
+    @property
+    def fingerprint(self):
+        """
+        The SHA-256 hex digest of the response body.
+
+        Raises:
+            RuntimeError: If the body has not been read completely yet.
+        """
+        if not self._done:
+            raise RuntimeError("The fingerprint is only known after the whole schedule was read")
+        return self._parser.fingerprint
+
+    def __iter__(self):
+        try:
+            for chunk in self.response.iter_content(self.chunk_size):
+                yield from self._parser.feed(chunk)
+            yield from self._parser.close()
+            self._done = True
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Close the response.
+        """
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,137 @@
+import threading
+
+from config import SyncConfig
+from errors import SessionExpiredError, LoginError
+from get_cookies import get_cookies
+from get_user_id import get_user_id
+from get_school_id import get_school_id
+from metrics import stage
+from storage import load_json, save_json
+
+
+class All4SchoolsSession:
+    """
+    The cookies and IDs needed for All4Schools API calls.
+
+    Attributes:
+        session_id (str): The 'ASP.NET_SessionId' cookie.
+        auth_token (str): The '.ASPXAUTH' cookie.
+        user_id (str): The CRM entity ID of the student.
+        school_id (str): The ID of the student's school.
+    """
+
+    def __init__(self, session_id, auth_token, user_id, school_id):
+        self.session_id = session_id
+        self.auth_token = auth_token
+        self.user_id = user_id
+        self.school_id = school_id
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "auth_token": self.auth_token,
+            "user_id": self.user_id,
+            "school_id": self.school_id
+        }
+
+
+class SessionManager:
+    """
+    Keep an All4Schools session alive across sync cycles.
+
+    The session cookies and the resolved user and school IDs are kept in memory and in a
+    JSON cache file, so a restart does not need a new login either. A new login only
+    happens when an API call raises SessionExpiredError.
+
+    The cache is keyed by the All4Schools URL and username, so switching accounts never
+    reuses a foreign session.
+
+    Args:
+        config (SyncConfig, optional): The account to log in with. Defaults to the environment variables.
+        cache_file (str, optional): The cache file. Defaults to the one set in the configuration.
+    """
+
+    def __init__(self, config=None, cache_file=None):
+        self.config = config or SyncConfig.from_env()
+        self.cache_file = cache_file or self.config.session_cache_file
+        self._key = f"{self.config.all4schools_url}|{self.config.all4schools_username}"
+        self._lock = threading.Lock()
+        self._session = self._load()
+
+    def _load(self):
+        cached = load_json(self.cache_file)
+        if not isinstance(cached, dict) or cached.get("key") != self._key:
+            return None
+        try:
+            return All4SchoolsSession(**cached["session"])
+        except (KeyError, TypeError):
+            return None
+
+    def _save(self):
+        if self._session is None:
+            data = {"key": self._key, "session": None}
+        else:
+            data = {"key": self._key, "session": self._session.to_dict()}
+        save_json(self.cache_file, data)
+
+    def _login(self):
+        base_url = self.config.all4schools_url
+        account = self.config.name
+        with stage("login", account):
+            session_id, auth_token = get_cookies(base_url, self.config.all4schools_username, self.config.all4schools_password)
+        if not session_id or not auth_token:
+            raise LoginError("All4Schools login did not return session cookies")
+        with stage("get_user_id", account):
+            user_id = get_user_id(session_id, auth_token, base_url)
+        with stage("get_school_id", account):
+            school_id = get_school_id(session_id, auth_token, base_url)
+        self._session = All4SchoolsSession(session_id, auth_token, user_id, school_id)
+        self._save()
+        return self._session
+
+    def get(self):
+        """
+        Return the current session, logging in if there is none.
+
+        Returns:
+            tuple: The All4SchoolsSession and a bool that is True if a new login was needed.
+        """
+        with self._lock:
+            if self._session is not None:
+                return self._session, False
+            return self._login(), True
+
+    def invalidate(self, session=None):
+        """
+        Drop the cached session so that the next call logs in again.
+
+        Args:
+            session (All4SchoolsSession, optional): Only drop the cache if it still holds this
+                                                    session, so concurrent callers do not log
+                                                    in twice.
+        """
+        with self._lock:
+            if session is None or self._session is session:
+                self._session = None
+                self._save()
+
+    def run(self, function):
+        """
+        Call an All4Schools API function with the current session.
+
+        If the call raises SessionExpiredError, the session is renewed and the call is
+        retried once.
+
+        Args:
+            function (callable): Called with the All4SchoolsSession as its only argument.
+
+        Returns:
+            The return value of the function.
+        """
+        session, _ = self.get()
+        try:
+            return function(session)
+        except SessionExpiredError:
+            self.invalidate(session)
+            session, _ = self.get()
+            return function(session)
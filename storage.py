@@ -0,0 +1,61 @@
+import json
+import os
+
+
+def load_json(path):
+    """
+    Load a JSON file.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        The decoded content, or None if the file does not exist or is not valid JSON.
+    """
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json(path, data):
+    """
+    Atomically replace a JSON file with new content.
+
+    The file is written to a temporary file next to it first and then renamed, so readers
+    never see a half-written file. The file is only readable by the current user, as it
+    may hold session cookies.
+
+    Args:
+        path (str): The path of the file.
+        data: The JSON serializable content.
+
+    Returns:
+        bool: True if the file was written, False if writing failed.
+    """
+    return save_bytes(path, json.dumps(data).encode('utf-8'))
+
+
+def save_bytes(path, data, mode=0o600):
+    """
+    Atomically replace a file with new content, see save_json.
+
+    Args:
+        path (str): The path of the file.
+        data (bytes): The content.
+        mode (int, optional): The permissions of a new file. Defaults to only the current user.
+
+    Returns:
+        bool: True if the file was written, False if writing failed.
+    """
+    temp_file = f"{path}.tmp"
+    try:
+        descriptor = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+        os.replace(temp_file, path)
+    except OSError as e:
+        print(f"Could not write {path}: {e}")
+        return False
+    return True
@@ -0,0 +1,89 @@
+from datetime import datetime
+import os
+
+from config import SyncConfig
+from storage import load_json, save_json
+
+
+class SyncState:
+    """
+    Remember what the last successful sync cycle applied.
+
+    The state holds the fingerprint of the schedule response and the version (ctag or
+    sync token) of the calendar right after the changes were written. If the next cycle
+    gets the same fingerprint and the calendar still has the same version, nothing
+    changed on either side and the cycle can stop right after fetching the schedule.
+
+    The state is stored in the JSON file set in 'SYNC_STATE_FILE' and is keyed by the
+    All4Schools account and the calendar URL. Every additional calendar target and every
+    band of a tiered sync has its own state, stored next to it with the name of the target
+    and the band added to the file name.
+
+    Args:
+        config (SyncConfig, optional): The account. Defaults to the environment variables.
+        state_file (str, optional): The state file. Defaults to the one set in the configuration.
+        tier (SyncTier, optional): The band of the sync period. Defaults to the whole period.
+        target (CalendarTarget, optional): The calendar. Defaults to the one set in 'calendar_url'.
+    """
+
+    def __init__(self, config=None, state_file=None, tier=None, target=None):
+        config = config or SyncConfig.from_env()
+        self.state_file = state_file or config.sync_state_file
+        self._key = f"{config.all4schools_username}|{target.url if target is not None else config.calendar_url}"
+        root, extension = os.path.splitext(self.state_file)
+        for name in (target.name if target is not None else "", tier.name if tier is not None else ""):
+            if name:
+                root += f"_{name}"
+                self._key += f"|{name}"
+        self.state_file = f"{root}{extension}"
+        state = load_json(self.state_file)
+        if not isinstance(state, dict) or state.get("key") != self._key:
+            state = {}
+        self.fingerprint = state.get("fingerprint")
+        self.calendar_version = state.get("calendar_version")
+        self.applied_at = state.get("applied_at")
+        self.event_count = state.get("event_count")
+
+    def is_unchanged(self, fingerprint, calendar_version):
+        """
+        Check whether the schedule and the calendar are the same as after the last applied cycle.
+
+        Args:
+            fingerprint (str): The fingerprint of the current schedule response.
+            calendar_version (str): The current version of the calendar.
+
+        Returns:
+            bool: True if both match the last applied cycle. Always False if either value is unknown.
+        """
+        if not fingerprint or not calendar_version:
+            return False
+        return fingerprint == self.fingerprint and calendar_version == self.calendar_version
+
+    def record(self, fingerprint, calendar_version, event_count):
+        """
+        Store the result of a successfully applied cycle.
+
+        Args:
+            fingerprint (str): The fingerprint of the applied schedule response.
+            calendar_version (str): The version of the calendar after the changes were written.
+            event_count (int): Number of events in the calendar after the cycle.
+        """
+        self.fingerprint = fingerprint
+        self.calendar_version = calendar_version
+        self.applied_at = datetime.now().astimezone().isoformat()
+        self.event_count = event_count
+        save_json(self.state_file, {
+            "key": self._key,
+            "fingerprint": self.fingerprint,
+            "calendar_version": self.calendar_version,
+            "applied_at": self.applied_at,
+            "event_count": self.event_count
+        })
+
+    def clear(self):
+        """
+        Forget the last applied cycle, so that the next cycle runs in full.
+        """
+        self.fingerprint = None
+        self.calendar_version = None
+        save_json(self.state_file, {"key": self._key})
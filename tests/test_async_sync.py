@@ -0,0 +1,24 @@
+import asyncio
+import unittest
+
+from async_sync import run_async_daemon, unsupported_settings
+from config import SyncConfig
+
+
+def account(name="alice", **settings):
+    return SyncConfig(name, "http://all4schools.test", "user", "secret", "http://calendar.test/dav/", "user", "secret", **settings)
+
+
+class UnsupportedSettingsTest(unittest.TestCase):
+    def test_plain_account_is_supported(self):
+        self.assertEqual(unsupported_settings(account(stream_schedule=False, fetch_chunk_days=0, event_store_file=None)), [])
+
+    def test_daemon_refuses_to_start_instead_of_skipping_settings(self):
+        accounts = [account(stream_schedule=False, fetch_chunk_days=0, event_store_file=None),
+                    account("bob", stream_schedule=False, fetch_chunk_days=0, event_store_file="events.sqlite3")]
+        with self.assertRaisesRegex(ValueError, "bob: event_store_file"):
+            asyncio.run(run_async_daemon(accounts))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import unittest
+import json
+
+import chunked_fetch
+from chunked_fetch import get_data_chunked, split_range
+from request_governor import get_governor
+
+
+class ScheduleHandler(BaseHTTPRequestHandler):
+    """
+    Answers GetSchedule with the lessons server.schedule returns for the requested period.
+    """
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests.append(request["from"])
+            failing = server.failures.get(request["from"], 0)
+            if failing:
+                server.failures[request["from"]] = failing - 1
+        if failing:
+            self.send_response(502)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"lessons": server.schedule(request["from"], request["to"])}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SplitRangeTest(unittest.TestCase):
+    def test_chunks_after_the_first_are_calendar_weeks(self):
+        self.assertEqual(split_range("2024-01-10T06:30:00.000Z", "2024-01-29T00:00:00.000Z", 7), [
+            ("2024-01-10T06:30:00.000000Z", "2024-01-15T00:00:00.000000Z"),
+            ("2024-01-15T00:00:00.000000Z", "2024-01-22T00:00:00.000000Z"),
+            ("2024-01-22T00:00:00.000000Z", "2024-01-29T00:00:00.000000Z"),
+        ])
+
+    def test_last_chunk_ends_with_the_period(self):
+        self.assertEqual(split_range("2024-01-15T00:00:00.000Z", "2024-01-24T12:00:00.000Z", 7), [
+            ("2024-01-15T00:00:00.000000Z", "2024-01-22T00:00:00.000000Z"),
+            ("2024-01-22T00:00:00.000000Z", "2024-01-24T12:00:00.000000Z"),
+        ])
+
+    def test_short_period_is_a_single_chunk(self):
+        self.assertEqual(split_range("2024-01-10T06:30:00.000Z", "2024-01-12T00:00:00.000Z", 7),
+                         [("2024-01-10T06:30:00.000000Z", "2024-01-12T00:00:00.000000Z")])
+
+    def test_empty_period_has_no_chunks(self):
+        self.assertEqual(split_range("2024-01-10T00:00:00.000Z", "2024-01-10T00:00:00.000Z", 7), [])
+
+
+class ChunkedFetchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ScheduleHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failures = {}
+        self.server.schedule = lambda from_date, to_date: [{"start": from_date, "end": to_date, "SubjectName": "Mathe"}]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        governor = get_governor()
+        self.backoff = governor.backoff
+        governor.backoff = 0.01
+        chunked_fetch._cache.clear()
+
+    def tearDown(self):
+        get_governor().backoff = self.backoff
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self):
+        return get_data_chunked("2024-01-08T00:00:00.000000Z", "2024-01-29T00:00:00.000000Z", "session", "auth", "user", "school",
+                                self.url, chunk_days=7)
+
+    def test_chunk_failing_with_502_once_is_retried_on_its_own(self):
+        self.server.failures["2024-01-15T00:00:00.000000Z"] = 1
+        data, _ = self.fetch()
+        self.assertEqual([lesson["start"] for lesson in data["lessons"]],
+                         ["2024-01-08T00:00:00.000000Z", "2024-01-15T00:00:00.000000Z", "2024-01-22T00:00:00.000000Z"])
+        self.assertEqual(sorted(self.server.requests),
+                         ["2024-01-08T00:00:00.000000Z", "2024-01-15T00:00:00.000000Z", "2024-01-15T00:00:00.000000Z", "2024-01-22T00:00:00.000000Z"])
+
+
+    def test_lesson_on_a_chunk_boundary_is_kept_once(self):
+        boundary = {"start": "2024-01-14T23:30:00Z", "end": "2024-01-15T00:30:00Z", "SubjectName": "Mathe", "StudentClassName": "10a"}
+        self.server.schedule = lambda from_date, to_date: [dict(boundary)] if from_date < "2024-01-22" else []
+        data, _ = self.fetch()
+        self.assertEqual(data["lessons"], [boundary])
+
+    def test_same_lesson_of_two_classes_is_kept_for_both(self):
+        lessons = [{"start": "2024-01-16T08:00:00Z", "end": "2024-01-16T08:45:00Z", "SubjectName": "Mathe", "StudentClassName": name}
+                   for name in ("10a", "10b")]
+        self.server.schedule = lambda from_date, to_date: lessons if from_date.startswith("2024-01-15") else []
+        data, _ = self.fetch()
+        self.assertEqual(data["lessons"], lessons)
+
+    def test_fingerprint_changes_with_a_single_chunk(self):
+        _, before = self.fetch()
+        self.server.schedule = lambda from_date, to_date: ([{"start": from_date, "SubjectName": "Physik"}] if from_date.startswith("2024-01-22")
+                                                         else [{"start": from_date, "end": to_date, "SubjectName": "Mathe"}])
+        _, after = self.fetch()
+        self.assertNotEqual(before, after)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import tempfile
+import unittest
+import os
+
+from caldav.elements import dav
+from caldav.lib.url import URL
+import vobject
+
+import delta_sync
+from delta_sync import update_store
+from event_store import EventStore
+
+CALENDAR_URL = "http://calendar.test/dav/user/school/"
+START = datetime(2024, 1, 8, 8, tzinfo=timezone.utc)
+
+
+def ical(uid, hours):
+    start = START + timedelta(hours=hours)
+    return (f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:test\r\nBEGIN:VEVENT\r\nUID:{uid}\r\n"
+            f"DTSTART:{start:%Y%m%dT%H%M%SZ}\r\nDTEND:{start + timedelta(minutes=45):%Y%m%dT%H%M%SZ}\r\n"
+            f"SUMMARY:{uid}\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n")
+
+
+class FakeEvent:
+    def __init__(self, url, data=None, etag=None):
+        self.url = URL.objectify(url)
+        self.data = data
+        self.props = {dav.GetEtag.tag: etag} if etag else {}
+
+    @property
+    def vobject_instance(self):
+        return vobject.readOne(self.data)
+
+
+class FakeCollection:
+    def __init__(self, objects, sync_token):
+        self.objects = objects
+        self.sync_token = sync_token
+
+
+class FakeCalendar:
+    """
+    A calendar that reports a fixed sync-collection delta and serves the events it knows.
+    """
+
+    def __init__(self, events, changes):
+        self.url = URL.objectify(CALENDAR_URL)
+        self.events = events
+        self.changes = changes
+        self.downloaded = []
+
+    def objects_by_sync_token(self, sync_token, load_objects=False):
+        return FakeCollection(self.changes, "token-2")
+
+    def calendar_multiget(self, urls):
+        self.downloaded.extend(url.path for url in urls)
+        return [FakeEvent(url, self.events[url.path]) for url in urls]
+
+
+class UpdateStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = EventStore(os.path.join(directory.name, "events.sqlite3"), CALENDAR_URL)
+        self.addCleanup(self.store.close)
+        self.store.replace(START, START + timedelta(days=7), [], "version-1", "token-1")
+        for index, uid in enumerate(("written", "removed")):
+            self.store.put(uid, f"{CALENDAR_URL}{uid}.ics", f'"{uid}-1"', None, START + timedelta(hours=index),
+                           START + timedelta(hours=index, minutes=45))
+        self.events = {f"/dav/user/school/{uid}.ics": ical(uid, hours) for uid, hours in (("written", 0), ("changed", 2))}
+
+    def stored(self):
+        return {uid: (href, etag) for uid, _, _, href, etag, _ in self.store.events(START, START + timedelta(days=7))}
+
+    def test_own_writes_are_not_downloaded_again(self):
+        calendar = FakeCalendar(self.events, [FakeEvent(f"{CALENDAR_URL}written.ics", etag='"written-1"'),
+                                              FakeEvent(f"{CALENDAR_URL}changed.ics", etag='"changed-1"'),
+                                              FakeEvent(f"{CALENDAR_URL}removed.ics")])
+        self.assertEqual(update_store(calendar, self.store, "version-2", "token-2"), 2)
+        self.assertEqual(calendar.downloaded, ["/dav/user/school/changed.ics"])
+        self.assertEqual(self.stored(), {"written": (f"{CALENDAR_URL}written.ics", '"written-1"'),
+                                         "changed": (f"{CALENDAR_URL}changed.ics", '"changed-1"')})
+        self.assertEqual((self.store.state()["version"], self.store.state()["sync_token"]), ("version-2", "token-2"))
+
+    def test_etags_are_compared_without_sync_collection(self):
+        self.store.replace(START, START + timedelta(days=7), [], "version-1", None)
+        self.store.put("written", f"{CALENDAR_URL}written.ics", '"written-1"', None, START, START + timedelta(minutes=45))
+        self.store.put("removed", f"{CALENDAR_URL}removed.ics", '"removed-1"', None, START + timedelta(hours=1),
+                       START + timedelta(hours=1, minutes=45))
+        calendar = FakeCalendar(self.events, [])
+        remote = {"/dav/user/school/written.ics": '"written-2"', "/dav/user/school/changed.ics": '"changed-1"'}
+        with mock.patch.object(delta_sync, "fetch_etags", return_value=remote):
+            self.assertEqual(update_store(calendar, self.store, "version-2", None), 3)
+        self.assertEqual(sorted(calendar.downloaded), ["/dav/user/school/changed.ics", "/dav/user/school/written.ics"])
+        self.assertEqual(sorted(self.stored()), ["changed", "written"])
+        self.assertEqual(self.stored()["written"][1], '"written-2"')
+
+    def test_unknown_changes_need_a_download(self):
+        self.store.replace(START, START + timedelta(days=7), [], "version-1", None)
+        with mock.patch.object(delta_sync, "fetch_etags", return_value=None):
+            self.assertIsNone(update_store(FakeCalendar({}, []), self.store, "version-2", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
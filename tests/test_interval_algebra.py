@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from interval_algebra import complement, factorize, merge, union
+
+
+class MergeTest(unittest.TestCase):
+    def test_overlapping_and_touching_intervals_are_merged(self):
+        starts = np.array([30, 0, 10, 50])
+        ends = np.array([40, 15, 20, 60])
+        first, last = merge(starts, ends)
+        self.assertEqual(list(starts[first]), [0, 30, 50])
+        self.assertEqual(list(ends[last]), [20, 40, 60])
+
+    def test_gap_joins_intervals_that_are_close_enough(self):
+        starts, ends = np.array([0, 25, 60]), np.array([20, 40, 70])
+        first, last = merge(starts, ends, gap=5)
+        self.assertEqual(list(zip(starts[first], ends[last])), [(0, 40), (60, 70)])
+
+    def test_groups_are_merged_separately(self):
+        starts, ends = np.array([0, 10, 10]), np.array([10, 20, 20])
+        codes = factorize(["Mathe", "Mathe", "Physik"])
+        first, last = merge(starts, ends, codes)
+        self.assertEqual(list(zip(starts[first], ends[last], codes[first])), [(0, 20, 0), (10, 20, 1)])
+
+
+class UnionTest(unittest.TestCase):
+    def test_union_is_disjoint_and_sorted(self):
+        starts, ends = union([50, 0, 10], [60, 15, 20])
+        self.assertEqual(list(zip(starts, ends)), [(0, 20), (50, 60)])
+
+    def test_union_of_nothing_is_empty(self):
+        starts, ends = union([], [])
+        self.assertEqual((len(starts), len(ends)), (0, 0))
+
+
+class ComplementTest(unittest.TestCase):
+    def test_free_time_between_lessons(self):
+        starts, ends = complement([10, 30, 35], [20, 40, 45], 0, 60)
+        self.assertEqual(list(zip(starts, ends)), [(0, 10), (20, 30), (45, 60)])
+
+    def test_intervals_outside_the_window_are_ignored(self):
+        starts, ends = complement([-20, 5, 90], [-10, 15, 120], 0, 60)
+        self.assertEqual(list(zip(starts, ends)), [(0, 5), (15, 60)])
+
+    def test_covered_window_has_no_free_time(self):
+        starts, ends = complement([-5, 20], [25, 70], 0, 60)
+        self.assertEqual((len(starts), len(ends)), (0, 0))
+
+    def test_empty_schedule_leaves_the_whole_window(self):
+        starts, ends = complement([], [], 0, 60)
+        self.assertEqual(list(zip(starts, ends)), [(0, 60)])
+
+
+if __name__ == "__main__":
+    unittest.main()
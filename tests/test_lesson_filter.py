@@ -0,0 +1,26 @@
+import unittest
+
+from lesson_filter import LessonFilter
+
+
+class LessonFilterTest(unittest.TestCase):
+    def test_rule_forms(self):
+        lesson_filter = LessonFilter(["StudioTimes", {"contains": "(a.b)"}, {"exact": "Sport"}, {"regex": "^AG "}])
+        for subject in ("StudioTimes Kunst", "Chemie (a.b)", "Sport", "AG Robotik"):
+            self.assertTrue(lesson_filter.excludes(subject), subject)
+        for subject in ("Sportgeschichte", "Chemie (axb)", "Mathe AG ", "Studio"):
+            self.assertFalse(lesson_filter.excludes(subject), subject)
+
+    def test_empty_filter_removes_nothing(self):
+        lesson_filter = LessonFilter()
+        self.assertFalse(lesson_filter)
+        self.assertFalse(lesson_filter.excludes("Mathe"))
+
+    def test_invalid_rules_are_rejected(self):
+        for rule in ({"regex": "("}, {"startswith": "AG"}, {"exact": "A", "regex": "B"}, 42):
+            with self.assertRaises(ValueError, msg=rule):
+                LessonFilter([rule])
+
+
+if __name__ == "__main__":
+    unittest.main()
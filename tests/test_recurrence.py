@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import unittest
+
+import vobject
+
+from calendar_snapshot import CalendarSnapshot
+from lesson import Lesson
+from reconcile import build_plan
+from recurrence import WEEK, compact_series, series_occurrences
+
+
+class FakeEvent:
+    """
+    An event in the calendar, as far as build_plan looks at it.
+    """
+
+    def __init__(self, uid, ical):
+        self.url = f"http://calendar.test/{uid}.ics"
+        self.data = ical.decode("utf-8")
+
+    @property
+    def vobject_instance(self):
+        return vobject.readOne(self.data)
+
+
+def weekly_lessons(first, weeks):
+    return [Lesson(first + week * WEEK, first + week * WEEK + timedelta(minutes=45), "Mathe", "10a", "MUE", room="R101")
+            for week in weeks]
+
+
+def write(plan):
+    operations = plan.creates + [update[:4] for update in plan.updates]
+    return CalendarSnapshot.from_entries(None, [(uid, start_time, end_time, FakeEvent(uid, ical))
+                                                for uid, start_time, end_time, ical in operations])
+
+
+class SeriesWindowTest(unittest.TestCase):
+    def setUp(self):
+        # The first occurrence took place yesterday, so the next cycle no longer fetches it.
+        self.first = (datetime.now().astimezone() - timedelta(days=1)).replace(second=0, microsecond=0)
+
+    def test_series_keeps_uid_and_start_when_the_window_moves_past_an_occurrence(self):
+        plan = build_plan(compact_series(weekly_lessons(self.first, range(4))), CalendarSnapshot.from_entries(None, []))
+        self.assertEqual(len(plan.creates), 1)
+        uid = plan.creates[0][0]
+        snapshot = write(plan)
+
+        plan = build_plan(compact_series(weekly_lessons(self.first, range(1, 5))), snapshot)
+        self.assertEqual((len(plan.creates), len(plan.deletes), len(plan.updates)), (0, 0, 1))
+        updated_uid, _, _, ical, replaced = plan.updates[0]
+        self.assertEqual(updated_uid, uid)
+        self.assertEqual(list(replaced), [uid])
+        occurrences = series_occurrences(FakeEvent(uid, ical))
+        self.assertEqual(occurrences, [self.first + week * WEEK for week in range(5)])
+
+        plan = build_plan(compact_series(weekly_lessons(self.first, range(1, 5))), write(plan))
+        self.assertEqual((len(plan), plan.unchanged), (0, 1))
+
+    def test_cancelled_occurrence_after_the_window_moved_is_excluded(self):
+        snapshot = write(build_plan(compact_series(weekly_lessons(self.first, range(4))), CalendarSnapshot.from_entries(None, [])))
+
+        plan = build_plan(compact_series(weekly_lessons(self.first, [1, 3, 4])), snapshot)
+        _, _, _, ical, _ = plan.updates[0]
+        self.assertEqual(series_occurrences(FakeEvent("", ical)), [self.first + week * WEEK for week in (0, 1, 3, 4)])
+
+    def test_unscheduled_series_is_cut_off_instead_of_deleted(self):
+        snapshot = write(build_plan(compact_series(weekly_lessons(self.first, range(4))), CalendarSnapshot.from_entries(None, [])))
+
+        plan = build_plan([], snapshot)
+        self.assertEqual((len(plan.creates), len(plan.deletes), len(plan.updates)), (0, 0, 1))
+        _, _, _, ical, _ = plan.updates[0]
+        self.assertEqual(series_occurrences(FakeEvent("", ical)), [self.first])
+
+    def test_series_without_past_occurrences_is_deleted(self):
+        first = self.first + timedelta(days=2)
+        snapshot = write(build_plan(compact_series(weekly_lessons(first, range(4))), CalendarSnapshot.from_entries(None, [])))
+
+        plan = build_plan([], snapshot)
+        self.assertEqual((len(plan.updates), len(plan.deletes)), (0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from deadline import cycle_deadline
+from request_governor import RequestGovernor, not_sent, parse_retry_after, read_only
+
+
+class RetryDelayTest(unittest.TestCase):
+    def setUp(self):
+        self.governor = RequestGovernor()
+        self.governor.retries = 4
+        self.governor.backoff = 0.5
+        self.governor.backoff_max = 30
+
+    def test_throttled_requests_are_retried_for_every_method(self):
+        for method in ("GET", "PUT", "POST"):
+            for status in (429, 503):
+                self.assertIsNotNone(self.governor.retry_delay(method, 0, status), (method, status))
+
+    def test_gateway_errors_are_only_retried_for_idempotent_methods(self):
+        self.assertIsNotNone(self.governor.retry_delay("GET", 0, 502))
+        self.assertIsNotNone(self.governor.retry_delay("REPORT", 0, 504))
+        self.assertIsNone(self.governor.retry_delay("POST", 0, 502))
+
+    def test_read_only_post_is_retried_like_a_get(self):
+        with read_only():
+            self.assertIsNotNone(self.governor.retry_delay("POST", 0, 502))
+            self.assertIsNotNone(self.governor.retry_delay("POST", 0))
+        self.assertIsNone(self.governor.retry_delay("POST", 0, 502))
+
+    def test_network_errors_retry_a_post_only_if_it_was_not_sent(self):
+        self.assertIsNone(self.governor.retry_delay("POST", 0))
+        self.assertIsNotNone(self.governor.retry_delay("POST", 0, sent=False))
+        self.assertIsNotNone(self.governor.retry_delay("DELETE", 0))
+
+    def test_other_statuses_are_not_retried(self):
+        for status in (200, 304, 400, 404, 412, 500):
+            self.assertIsNone(self.governor.retry_delay("GET", 0, status), status)
+
+    def test_retries_are_bounded(self):
+        self.assertIsNotNone(self.governor.retry_delay("GET", 3, 429))
+        self.assertIsNone(self.governor.retry_delay("GET", 4, 429))
+
+    def test_backoff_grows_and_is_capped(self):
+        self.governor.backoff_max = 3
+        for attempt in range(4):
+            delays = [self.governor.retry_delay("GET", attempt, 429) for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= min(3, 0.5 * 2 ** attempt) for delay in delays), attempt)
+
+    def test_retry_after_is_the_shortest_wait(self):
+        self.assertGreaterEqual(self.governor.retry_delay("GET", 0, 429, retry_after=2.5), 2.5)
+
+    def test_no_retry_waits_past_the_deadline(self):
+        with cycle_deadline(1):
+            self.assertIsNone(self.governor.retry_delay("GET", 0, 429, retry_after=5))
+            self.assertIsNotNone(self.governor.retry_delay("GET", 0, 429, retry_after=0.1))
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds_and_dates(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertEqual(parse_retry_after("-1"), 0.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+class NotSentTest(unittest.TestCase):
+    def test_refused_and_timed_out_connections_were_not_sent(self):
+        refused = requests.exceptions.ConnectionError(NewConnectionError(None, "Connection refused"))
+        self.assertTrue(not_sent(refused))
+        self.assertTrue(not_sent(requests.exceptions.ConnectTimeout()))
+
+    def test_broken_connections_and_read_timeouts_may_have_been_sent(self):
+        self.assertFalse(not_sent(requests.exceptions.ConnectionError("Connection reset by peer")))
+        self.assertFalse(not_sent(requests.exceptions.ReadTimeout()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import hashlib
+import unittest
+import json
+
+from schedule_stream import LessonParser
+
+LESSONS = [
+    {"start": "2024-01-08T08:00:00+01:00", "end": "2024-01-08T08:45:00+01:00", "SubjectName": "Mathe", "Duration": 45},
+    {"start": "2024-01-08T09:00:00+01:00", "end": "2024-01-08T09:45:00+01:00", "SubjectName": "Deutsch über \"Bücher\"",
+     "TeacherName": ",Müller,Schmidt", "Rooms": [1, 2.5, -3e2]},
+]
+
+
+def parse(body, size):
+    parser = LessonParser()
+    lessons = []
+    for offset in range(0, len(body), size):
+        lessons.extend(parser.feed(body[offset:offset + size]))
+    lessons.extend(parser.close())
+    return lessons, parser.fingerprint
+
+
+class LessonParserTest(unittest.TestCase):
+    def test_every_chunk_size_gives_the_same_lessons(self):
+        body = json.dumps({"absences": [{"start": "x"}], "lessons": LESSONS, "count": 12345}, ensure_ascii=False).encode("utf-8")
+        for size in (1, 2, 3, 7, 64, len(body)):
+            lessons, fingerprint = parse(body, size)
+            self.assertEqual(lessons, LESSONS, size)
+            self.assertEqual(fingerprint, hashlib.sha256(body).hexdigest())
+
+    def test_lessons_are_returned_as_soon_as_they_are_complete(self):
+        body = json.dumps({"lessons": LESSONS}).encode()
+        first_end = body.index(b"}") + 1
+        parser = LessonParser()
+        self.assertEqual(parser.feed(body[:first_end - 1]), [])
+        self.assertEqual(parser.feed(body[first_end - 1:first_end]), [LESSONS[0]])
+
+    def test_number_at_the_end_of_a_chunk_waits_for_the_next_one(self):
+        parser = LessonParser()
+        self.assertEqual(parser.feed(b'{"lessons": [1'), [])
+        self.assertEqual(parser.feed(b'23, 4.5'), [123])
+        self.assertEqual(parser.feed(b'e1]}'), [45.0])
+        self.assertEqual(parser.close(), [])
+
+    def test_byte_order_mark_and_whitespace_are_skipped(self):
+        body = b"\xef\xbb\xbf \n{ \"lessons\" :\t[ ] }\r\n"
+        self.assertEqual(parse(body, 1)[0], [])
+
+    def test_incomplete_body_is_an_error(self):
+        parser = LessonParser()
+        parser.feed(json.dumps({"lessons": LESSONS}).encode()[:-5])
+        with self.assertRaises(ValueError):
+            parser.close()
+
+    def test_body_without_lessons_is_an_error(self):
+        with self.assertRaises(ValueError):
+            parse(b'{"absences": []}', 4)
+
+    def test_body_that_is_not_an_object_is_an_error(self):
+        for body in (b'[{"lessons": []}]', b'<html>Login</html>', b'{"lessons": []} {}'):
+            with self.assertRaises(ValueError, msg=body):
+                parse(body, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+from contextlib import redirect_stdout
+from datetime import datetime
+import subprocess
+import tracemalloc
+import itertools
+import argparse
+import platform
+import tempfile
+import requests
+import json
+import time
+import io
+import os
+
+import main
+import metrics
+from config import SyncConfig
+from util.mock_servers import start_servers
+
+PHASES = ("cold", "unchanged", "changed")
+
+
+def git_commit():
+    """
+    Return the short hash of the checked out commit, or None outside of a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def request_counts(before, after, hosts):
+    """
+    Return the number of HTTP requests per server between two metrics.counters() results.
+    """
+    counts = {}
+    for (name, labels), value in after.items():
+        host = dict(labels).get("host")
+        if name == "timesync_http_requests_total" and host in hosts:
+            counts[hosts[host]] = counts.get(hosts[host], 0) + value - before.get((name, labels), 0)
+    return counts
+
+
+def run_scenario(a4s_url, calendar_url, scenario, workdir, memory=True, verbose=False):
+    """
+    Run the sync cycles of one scenario against the mock servers.
+
+    The calendar is reset first. The 'cold' cycle fills the empty calendar, the 'unchanged'
+    cycle runs with the same timetable and the 'changed' cycle after a new revision of it.
+
+    Args:
+        a4s_url (str): The URL of the mock All4Schools API.
+        calendar_url (str): The URL of the mock calendar.
+        scenario (dict): 'days', 'classes', 'lessons_per_day', 'calendar_events', 'days_to_update',
+                         'event_store' and optionally 'recurring_lessons'.
+        workdir (str): Directory for the session cache, sync state and event store.
+        memory (bool, optional): Measure the peak memory of every cycle with tracemalloc.
+                                 Makes the cycles slower.
+        verbose (bool, optional): Show the output of the sync cycles.
+
+    Returns:
+        list: One result dict per phase.
+    """
+    control = calendar_url.split("/dav/")[0]
+    requests.get(f"{control}/_bench/reset", params={"events": scenario["calendar_events"], "days": scenario["days"],
+                                                    "lessons_per_day": scenario["lessons_per_day"], "classes": scenario["classes"]}).raise_for_status()
+    name = "bench-" + "-".join(f"{value}" for value in scenario.values())
+    config = SyncConfig(name, a4s_url, "bench", "bench", calendar_url, "bench", "bench",
+                        days_to_add=scenario["days"], days_to_update=scenario["days_to_update"],
+                        session_cache_file=os.path.join(workdir, f"session_{name}.json"),
+                        sync_state_file=os.path.join(workdir, f"state_{name}.json"),
+                        event_store_file=os.path.join(workdir, f"events_{name}.sqlite3") if scenario["event_store"] else None,
+                        recurring_lessons=scenario.get("recurring_lessons", False))
+    hosts = {a4s_url.split("/")[2]: "all4schools", calendar_url.split("/")[2]: "caldav"}
+
+    results = []
+    for phase in PHASES:
+        if phase == "changed":
+            requests.get(f"{control}/_bench/revise").raise_for_status()
+        before = metrics.counters()
+        if memory:
+            tracemalloc.start()
+        output = io.StringIO()
+        started = time.perf_counter()
+        if verbose:
+            main.main(config)
+        else:
+            with redirect_stdout(output):
+                main.main(config)
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+        stats = requests.get(f"{control}/_bench/stats").json()
+        results.append({
+            "phase": phase,
+            "seconds": round(seconds, 4),
+            "requests": request_counts(before, metrics.counters(), hosts),
+            "peak_memory_mb": round(peak / 2 ** 20, 2) if peak is not None else None,
+            "calendar_events": stats["events"],
+            "throttled": stats["throttled"]
+        })
+    return results
+
+
+def load_results(path):
+    """
+    Load the stored results of earlier runs.
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except OSError:
+        return []
+
+
+def previous_result(history, scenario, phase):
+    """
+    Return the most recent stored result of the same scenario and phase, or None.
+    """
+    for record in reversed(history):
+        if record["scenario"] == scenario and record["phase"] == phase:
+            return record
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark full sync cycles against local mock All4Schools and CalDAV servers.')
+    parser.add_argument('-d', '--days', type=int, nargs='+', default=[7, 14, 28], help='DAYS_TO_ADD values to test')
+    parser.add_argument('-c', '--classes', type=int, nargs='+', default=[1, 4], help='Numbers of classes in the timetable')
+    parser.add_argument('-l', '--lessons-per-day', type=int, default=8, help='Lessons per class and weekday')
+    parser.add_argument('-e', '--calendar-events', type=int, nargs='+', default=[0, 500], help='Numbers of other events already in the calendar')
+    parser.add_argument('-u', '--days-to-update', type=int, default=1, help='DAYS_TO_UPDATE, events after it are never deleted')
+    parser.add_argument('--latency', type=float, default=5.0, help='Milliseconds added to every request of both servers')
+    parser.add_argument('--event-store', action='store_true', help='Sync with an event store (EVENT_STORE_FILE)')
+    parser.add_argument('--recurring-lessons', action='store_true', help='Write weekly lessons as recurring events (RECURRING_LESSONS)')
+    parser.add_argument('--caldav-max-requests', type=int, default=0, help='Let the mock CalDAV server answer 429 above this many concurrent requests')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure peak memory, for more accurate timings')
+    parser.add_argument('-r', '--results', default='benchmark_results.jsonl', help='File the results are appended to and compared with')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the output of the sync cycles')
+
+    args = parser.parse_args()
+    history = load_results(args.results)
+    a4s_url, calendar_url, server = start_servers(args.latency / 1000, args.latency / 1000, args.caldav_max_requests)
+    commit = git_commit()
+
+    print(f"{'days':>5} {'classes':>7} {'events':>7} {'phase':>10} {'seconds':>9} {'a4s req':>8} {'caldav req':>10} {'peak MB':>8} {'previous':>10}")
+    with tempfile.TemporaryDirectory() as workdir, open(args.results, "a", encoding="utf-8") as results_file:
+        for days, classes, calendar_events in itertools.product(args.days, args.classes, args.calendar_events):
+            scenario = {"days": days, "classes": classes, "lessons_per_day": args.lessons_per_day, "calendar_events": calendar_events,
+                        "days_to_update": args.days_to_update, "event_store": args.event_store, "latency_ms": args.latency,
+                        "memory": not args.no_memory}
+            if args.recurring_lessons:
+                scenario["recurring_lessons"] = True
+            if args.caldav_max_requests:
+                scenario["caldav_max_requests"] = args.caldav_max_requests
+            for result in run_scenario(a4s_url, calendar_url, scenario, workdir, not args.no_memory, args.verbose):
+                previous = previous_result(history, scenario, result["phase"])
+                change = f"{(result['seconds'] / previous['seconds'] - 1) * 100:+9.1f}%" if previous and previous["seconds"] else f"{'-':>10}"
+                peak = f"{result['peak_memory_mb']:8.1f}" if result["peak_memory_mb"] is not None else f"{'-':>8}"
+                print(f"{days:>5} {classes:>7} {calendar_events:>7} {result['phase']:>10} {result['seconds']:9.3f} "
+                      f"{result['requests'].get('all4schools', 0):>8} {result['requests'].get('caldav', 0):>10} {peak} {change}")
+                record = {"time": datetime.now().isoformat(timespec="seconds"), "commit": commit, "python": platform.python_version(),
+                          "scenario": scenario, **result}
+                results_file.write(json.dumps(record) + "\n")
+    server.terminate()
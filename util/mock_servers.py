@@ -0,0 +1,368 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+import multiprocessing
+import threading
+import argparse
+import hashlib
+import random
+import json
+import time
+
+from icalendar import Calendar
+
+DAV = "{DAV:}"
+CALDAV = "{urn:ietf:params:xml:ns:caldav}"
+SUBJECTS = ("Mathematik", "Deutsch", "Englisch", "Biologie", "Physik", "Chemie", "Geschichte", "Sport", "Kunst", "Musik")
+TIMEZONE = timezone(timedelta(hours=1))
+
+
+class Timetable:
+    """
+    A synthetic timetable for the fake All4Schools server.
+
+    Every weekday has 'lessons_per_day' 45 minute lessons from 8:00 for each of 'classes'
+    classes. The subject of a lesson is derived from its weekday, slot and class, so the
+    timetable repeats every week and the same period always returns the same lessons.
+    Raising 'revision' changes the subject of about 'change_rate' of the lessons, like a new
+    substitution plan.
+    """
+
+    def __init__(self, lessons_per_day=8, classes=1, change_rate=0.05):
+        self.lessons_per_day = lessons_per_day
+        self.classes = classes
+        self.change_rate = change_rate
+        self.revision = 0
+
+    def _subject(self, day, slot, class_index):
+        subject = random.Random(f"{day.weekday()}|{slot}|{class_index}").choice(SUBJECTS)
+        seed = f"{day.isoformat()}|{slot}|{class_index}"
+        for revision in range(1, self.revision + 1):
+            rng = random.Random(f"{seed}|{revision}")
+            if rng.random() < self.change_rate:
+                subject = rng.choice(SUBJECTS)
+        return subject
+
+    def lessons(self, from_date, to_date):
+        """
+        Return the lessons starting between two datetimes, in the format of GetSchedule.
+        """
+        lessons = []
+        day = from_date.astimezone(TIMEZONE).date()
+        while day <= to_date.astimezone(TIMEZONE).date():
+            if day.weekday() < 5:
+                for slot in range(self.lessons_per_day):
+                    start = datetime.combine(day, datetime.min.time(), TIMEZONE) + timedelta(hours=8, minutes=45 * slot)
+                    if not from_date <= start < to_date:
+                        continue
+                    for class_index in range(self.classes):
+                        lessons.append({
+                            "start": start.isoformat(),
+                            "end": (start + timedelta(minutes=45)).isoformat(),
+                            "SubjectName": self._subject(day, slot, class_index),
+                            "StudentClassName": f"{5 + class_index % 8}{'abcd'[class_index // 8 % 4]}",
+                            "TeacherName": f"Lehrer {slot % 4}",
+                            "AdditionalTeacherNamesString": "",
+                            "RoomName": f"R{100 + class_index}",
+                            "AdditionalRooms": ""
+                        })
+            day += timedelta(days=1)
+        return lessons
+
+
+class CalendarCollection:
+    """
+    The events of the fake CalDAV calendar, with a change log for sync-collection.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = {}
+        self.revision = 0
+        self.changes = []
+
+    def put(self, name, data):
+        component = next(iter(Calendar.from_ical(data).walk("VEVENT")))
+        start, end = (_as_datetime(component.decoded(prop)) for prop in ("dtstart", "dtend"))
+        until = component.get("rrule", {}).get("UNTIL")
+        if until:
+            # Recurring events are found up to their last occurrence.
+            end = _as_datetime(until[0]) + (end - start)
+        with self.lock:
+            self.revision += 1
+            etag = f'"{hashlib.md5(data).hexdigest()}-{self.revision}"'
+            self.events[name] = (data, etag, start.timestamp(), end.timestamp())
+            self.changes.append((self.revision, name))
+            return etag
+
+    def delete(self, name, if_match=None):
+        with self.lock:
+            event = self.events.get(name)
+            if event is None:
+                return 404
+            if if_match and if_match != event[1]:
+                return 412
+            del self.events[name]
+            self.revision += 1
+            self.changes.append((self.revision, name))
+            return 204
+
+    def prefill(self, count, days):
+        """
+        Add 'count' events in the evenings of the next 'days' days, so they never collide with lessons.
+        """
+        now = datetime.now(TIMEZONE).replace(hour=19, minute=0, second=0, microsecond=0)
+        for index in range(count):
+            start = now + timedelta(days=index % max(days, 1), minutes=index // max(days, 1) % 12 * 5)
+            data = (f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//TimeSync benchmark//EN\r\nBEGIN:VEVENT\r\n"
+                    f"UID:prefill-{index}\r\nDTSTAMP:20250101T000000Z\r\n"
+                    f"DTSTART:{start.astimezone(timezone.utc):%Y%m%dT%H%M%SZ}\r\nDTEND:{(start + timedelta(hours=1)).astimezone(timezone.utc):%Y%m%dT%H%M%SZ}\r\n"
+                    f"SUMMARY:Termin {index}\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n").encode()
+            self.put(f"prefill-{index}.ics", data)
+
+
+def _as_datetime(value):
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time(), TIMEZONE)
+    return value if value.tzinfo else value.replace(tzinfo=TIMEZONE)
+
+
+def _parse_time(value):
+    return datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+
+class MockState:
+    """
+    The timetable and calendar shared by both mock servers.
+    """
+
+    def __init__(self):
+        self.calendar = CalendarCollection()
+        self.timetable = Timetable()
+        self.throttled = 0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Serves the fake All4Schools API or the fake CalDAV calendar under '/dav/calendar/',
+    depending on the 'role' of the server.
+
+    The control endpoints under '/_bench' let the benchmark reset the calendar and change the
+    timetable between cycles. A server with 'max_requests' answers '429 Too Many Requests'
+    while more requests than that are in flight, like a throttling CalDAV provider.
+    """
+
+    protocol_version = "HTTP/1.1"
+    calendar_path = "/dav/calendar/"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b"", content_type="application/xml; charset=utf-8", headers=()):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _handle(self):
+        body = self._body()
+        path = urlsplit(self.path).path
+        if path.startswith("/_bench/"):
+            return self._control(path, parse_qs(urlsplit(self.path).query))
+        with self.server.lock:
+            self.server.in_flight += 1
+            throttled = self.server.max_requests and self.server.in_flight > self.server.max_requests
+        try:
+            time.sleep(self.server.latency)
+            if throttled:
+                self.server.state.throttled += 1
+                return self._reply(429, headers=[("Retry-After", "0")])
+            if self.server.role == "all4schools":
+                return self._all4schools(path, body)
+            return self._caldav(unquote(path), body)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PROPFIND = do_REPORT = _handle
+
+    def _control(self, path, query):
+        state = self.server.state
+        if path == "/_bench/reset":
+            state.calendar = CalendarCollection()
+            state.throttled = 0
+            state.calendar.prefill(int(query.get("events", ["0"])[0]), int(query.get("days", ["14"])[0]))
+            state.timetable = Timetable(int(query.get("lessons_per_day", ["8"])[0]), int(query.get("classes", ["1"])[0]),
+                                        float(query.get("change_rate", ["0.05"])[0]))
+        elif path == "/_bench/revise":
+            state.timetable.revision += 1
+        elif path != "/_bench/stats":
+            return self._reply(404)
+        stats = {"events": len(state.calendar.events), "revision": state.timetable.revision, "throttled": state.throttled}
+        self._reply(200, json.dumps(stats), "application/json")
+
+    def _all4schools(self, path, body):
+        if path == "/modules/Login.aspx" and self.command == "GET":
+            return self._reply(200, '<form><input id="__VIEWSTATE" value="state"/><input id="__EVENTVALIDATION" value="valid"/></form>', "text/html")
+        if path == "/modules/Login.aspx":
+            return self._reply(302, headers=[("Location", "/a4s/"), ("Set-Cookie", "ASP.NET_SessionId=bench; path=/; HttpOnly"),
+                                             ("Set-Cookie", ".ASPXAUTH=bench; path=/; HttpOnly")])
+        if path == "/api/Api/AppUser/GetUserInfo":
+            return self._reply(200, json.dumps({"crmEntityId": "student"}), "application/json")
+        if path == "/api/Api/AppUser/GetSchoolsAndSettingsForCurrentUser":
+            return self._reply(200, json.dumps([{"id": "school"}]), "application/json")
+        if path == "/api/api/Schedule/GetSchedule":
+            request = json.loads(body)
+            lessons = self.server.state.timetable.lessons(datetime.fromisoformat(request["from"].replace("Z", "+00:00")),
+                                                    datetime.fromisoformat(request["to"].replace("Z", "+00:00")))
+            return self._reply(200, json.dumps({"lessons": lessons}), "application/json")
+        self._reply(404)
+
+    def _response(self, href, etag=None, data=None, status=None):
+        if status:
+            return f"<D:response><D:href>{escape(href)}</D:href><D:status>HTTP/1.1 {status}</D:status></D:response>"
+        props = f"<D:getetag>{escape(etag)}</D:getetag>" if etag else ""
+        if data is not None:
+            props += f"<C:calendar-data>{escape(data.decode('utf-8'))}</C:calendar-data>"
+        return f"<D:response><D:href>{escape(href)}</D:href><D:propstat><D:prop>{props}</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>"
+
+    def _multistatus(self, responses, extra=""):
+        self._reply(207, '<?xml version="1.0" encoding="utf-8"?><D:multistatus xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav" '
+                         f'xmlns:CS="http://calendarserver.org/ns/">{"".join(responses)}{extra}</D:multistatus>')
+
+    def _caldav(self, path, body):
+        calendar = self.server.state.calendar
+        if not path.startswith(self.calendar_path):
+            return self._reply(404)
+        name = path[len(self.calendar_path):]
+        if self.command == "PUT":
+            return self._reply(201, headers=[("ETag", calendar.put(name, body))])
+        if self.command == "DELETE":
+            return self._reply(calendar.delete(name, self.headers.get("If-Match")))
+        if self.command == "GET":
+            event = calendar.events.get(name)
+            return self._reply(200, event[0], "text/calendar", [("ETag", event[1])]) if event else self._reply(404)
+        if self.command == "PROPFIND":
+            with calendar.lock:
+                token = f"http://bench/sync/{calendar.revision}"
+                collection = (f"<D:response><D:href>{self.calendar_path}</D:href><D:propstat><D:prop><D:resourcetype><D:collection/><C:calendar/></D:resourcetype>"
+                              f"<CS:getctag>{calendar.revision}</CS:getctag><D:sync-token>{token}</D:sync-token></D:prop>"
+                              "<D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>")
+                members = [self._response(self.calendar_path + event_name, event[1]) for event_name, event in calendar.events.items()]
+            return self._multistatus([collection] + (members if self.headers.get("Depth") == "1" else []))
+        if self.command == "REPORT":
+            return self._report(ElementTree.fromstring(body))
+        self._reply(405)
+
+    def _report(self, query):
+        calendar = self.server.state.calendar
+        with_data = query.find(f".//{CALDAV}calendar-data") is not None
+        with calendar.lock:
+            if query.tag == f"{CALDAV}calendar-query":
+                time_range = query.find(f".//{CALDAV}time-range")
+                start = _parse_time(time_range.get("start")) if time_range is not None and time_range.get("start") else float("-inf")
+                end = _parse_time(time_range.get("end")) if time_range is not None and time_range.get("end") else float("inf")
+                responses = [self._response(self.calendar_path + name, etag, data if with_data else None)
+                             for name, (data, etag, event_start, event_end) in calendar.events.items()
+                             if event_start < end and event_end > start]
+                return self._multistatus(responses)
+            if query.tag == f"{CALDAV}calendar-multiget":
+                responses = []
+                for href in query.iter(f"{DAV}href"):
+                    event = calendar.events.get(unquote(urlsplit(href.text).path)[len(self.calendar_path):])
+                    if event is None:
+                        responses.append(self._response(href.text, status="404 Not Found"))
+                    else:
+                        responses.append(self._response(href.text, event[1], event[0] if with_data else None))
+                return self._multistatus(responses)
+            if query.tag == f"{DAV}sync-collection":
+                token = query.findtext(f"{DAV}sync-token") or ""
+                if token and not token.startswith("http://bench/sync/"):
+                    return self._reply(403, '<D:error xmlns:D="DAV:"><D:valid-sync-token/></D:error>')
+                since = int(token.rsplit("/", 1)[1]) if token else 0
+                changed = sorted({name for revision, name in calendar.changes if revision > since})
+                responses = [self._response(self.calendar_path + name, calendar.events[name][1]) if name in calendar.events
+                             else self._response(self.calendar_path + name, status="404 Not Found") for name in changed]
+                return self._multistatus(responses, f"<D:sync-token>http://bench/sync/{calendar.revision}</D:sync-token>")
+        self._reply(403)
+
+
+def _listen(state, role, port, latency, max_requests=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.daemon_threads = True
+    server.state = state
+    server.role = role
+    server.latency = latency
+    server.max_requests = max_requests
+    server.in_flight = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def serve(a4s_port=0, caldav_port=0, a4s_latency=0.0, caldav_latency=0.0, ready=None, caldav_max_requests=0):
+    """
+    Run the mock servers until the process is stopped.
+
+    Both servers share one MockState, but listen on their own port, so requests can be
+    told apart by host.
+
+    Args:
+        a4s_port (int, optional): The port of the All4Schools API, 0 for a free one.
+        caldav_port (int, optional): The port of the CalDAV server, 0 for a free one.
+        a4s_latency (float, optional): Seconds added to every All4Schools request.
+        caldav_latency (float, optional): Seconds added to every CalDAV request.
+        ready (multiprocessing.Queue, optional): Receives both ports once the servers listen.
+        caldav_max_requests (int, optional): Concurrent CalDAV requests above which the server
+                                             answers '429 Too Many Requests', 0 for no limit.
+    """
+    state = MockState()
+    all4schools = _listen(state, "all4schools", a4s_port, a4s_latency)
+    caldav = _listen(state, "caldav", caldav_port, caldav_latency, caldav_max_requests)
+    threading.Thread(target=all4schools.serve_forever, daemon=True).start()
+    if ready is not None:
+        ready.put((all4schools.server_address[1], caldav.server_address[1]))
+    caldav.serve_forever()
+
+
+def start_servers(a4s_latency=0.0, caldav_latency=0.0, caldav_max_requests=0):
+    """
+    Start the mock servers in a child process, so they do not compete with the sync for the GIL.
+
+    Args:
+        a4s_latency (float, optional): Seconds added to every All4Schools request.
+        caldav_latency (float, optional): Seconds added to every CalDAV request.
+        caldav_max_requests (int, optional): Concurrent CalDAV requests above which the server
+                                             answers '429 Too Many Requests', 0 for no limit.
+
+    Returns:
+        tuple: The All4Schools base URL, the CalDAV calendar URL and the multiprocessing.Process
+               running the servers.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(0, 0, a4s_latency, caldav_latency, ready, caldav_max_requests), daemon=True)
+    process.start()
+    a4s_port, caldav_port = ready.get(timeout=30)
+    return f"http://127.0.0.1:{a4s_port}", f"http://127.0.0.1:{caldav_port}{MockHandler.calendar_path}", process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a fake All4Schools API and CalDAV calendar for testing.')
+    parser.add_argument('--a4s-port', type=int, default=8080, help='Port of the All4Schools API')
+    parser.add_argument('--caldav-port', type=int, default=8081, help='Port of the CalDAV server')
+    parser.add_argument('--a4s-latency', type=float, default=0.0, help='Milliseconds added to every All4Schools request')
+    parser.add_argument('--caldav-latency', type=float, default=0.0, help='Milliseconds added to every CalDAV request')
+    parser.add_argument('--caldav-max-requests', type=int, default=0, help='Concurrent CalDAV requests above which 429 is returned')
+
+    args = parser.parse_args()
+    print(f"ALL4SCHOOLS_URL=http://127.0.0.1:{args.a4s_port} CALENDAR_URL=http://127.0.0.1:{args.caldav_port}{MockHandler.calendar_path}")
+    serve(args.a4s_port, args.caldav_port, args.a4s_latency / 1000, args.caldav_latency / 1000, caldav_max_requests=args.caldav_max_requests)
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+from caldav.elements import cdav, dav
+from caldav.lib import error
+from urllib.parse import unquote, urlsplit
+from lxml import etree
+import threading
+import time
+
+from caldav_pool import pool_size
+from errors import DeadlineExceeded
+import deadline
+
+
+def _path(url):
+    return unquote(urlsplit(str(url)).path).rstrip("/")
+
+
+class OperationResult:
+    """
+    The outcome of a single queued calendar write.
+
+    Attributes:
+        kind (str): 'create', 'update' or 'delete'.
+        uid (str): The UID of the event that was written or deleted.
+        error (Exception or None): The error raised by the operation, None if it succeeded.
+        duration (float): Seconds the operation took, including its HTTP round-trips.
+        url: The URL of the written event, None for deletes and failed operations.
+        verified (bool or None): Whether a multiget found the written event on the server.
+                                 None if the write was not verified.
+        etag (str or None): The ETag of the written event as reported by the multiget.
+    """
+
+    def __init__(self, kind, uid):
+        self.kind = kind
+        self.uid = uid
+        self.error = None
+        self.duration = 0.0
+        self.url = None
+        self.verified = None
+        self.etag = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.verified is not False
+
+
+class WriteReport:
+    """
+    The outcomes of all operations of a pipeline run.
+
+    Attributes:
+        results (list): One OperationResult per queued operation.
+        elapsed (float): Wall clock seconds of the whole run, including verification.
+    """
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def cut_off(self):
+        """
+        The operations that were skipped or stopped because the deadline of the cycle had passed.
+        """
+        return [result for result in self.results if isinstance(result.error, DeadlineExceeded)]
+
+    @property
+    def throughput(self):
+        """
+        Operations per second.
+        """
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        """
+        Return a short human readable description of the run.
+        """
+        counts = {}
+        for result in self.results:
+            counts[result.kind] = counts.get(result.kind, 0) + 1
+        done = ", ".join(f"{count} {kind}" for kind, count in counts.items()) or "nothing"
+        return f"{done} in {self.elapsed:.2f}s ({self.throughput:.1f} ops/s), {len(self.failed)} failed"
+
+
+class WritePipeline:
+    """
+    Queue the creates, updates and deletes of a sync cycle and send them together.
+
+    The queued operations are sent concurrently over the pooled CalDAV connection, with as
+    many requests in flight as the pool has connections. Written events are then checked
+    with a single calendar-multiget REPORT where the server supports it, instead of one
+    GET per event. The multiget only asks for the ETags of the events, which are kept in
+    the results.
+
+    The snapshot is kept up to date with every successful operation. Once the deadline of
+    the sync cycle has passed, no further requests are sent and the remaining operations
+    are reported as failed with a DeadlineExceeded error.
+    """
+
+    def __init__(self, snapshot, workers=None, verify=True):
+        self.snapshot = snapshot
+        self.workers = workers or pool_size()
+        self.verify = verify
+        self._operations = []
+
+    def __len__(self):
+        return len(self._operations)
+
+    def create(self, uid, start_time, end_time, ical):
+        """
+        Queue a new event.
+        """
+        self._operations.append(("create", uid, (start_time, end_time, ical)))
+
+    def update(self, uid, start_time, end_time, ical, replaced):
+        """
+        Queue an event that replaces the outdated events in 'replaced' (a dict of UID -> event).
+        """
+        self._operations.append(("update", uid, (start_time, end_time, ical, replaced)))
+
+    def delete(self, uid, event):
+        """
+        Queue the deletion of an event.
+        """
+        self._operations.append(("delete", uid, (event,)))
+
+    def _save(self, uid, start_time, end_time, ical):
+        saved_event = self.snapshot.calendar.save_event(ical)
+        self.snapshot.add(uid, start_time, end_time, saved_event)
+        return saved_event.url
+
+    def _run_create(self, uid, start_time, end_time, ical):
+        return self._save(uid, start_time, end_time, ical)
+
+    def _run_update(self, uid, start_time, end_time, ical, replaced):
+        for replaced_uid, event in replaced.items():
+            if replaced_uid != uid:
+                event.delete()
+                self.snapshot.discard(replaced_uid)
+        # An event with the same UID is overwritten in place, so it is never missing in between.
+        url = self._save(uid, start_time, end_time, ical)
+        previous = replaced.get(uid)
+        if previous is not None and _path(previous.url) != _path(url):
+            previous.delete()
+        return url
+
+    def _run_delete(self, uid, event):
+        event.delete()
+        self.snapshot.discard(uid)
+
+    def _verify(self, results):
+        written = [result for result in results if result.url is not None]
+        if not written:
+            return
+        calendar = self.snapshot.calendar
+        query = cdav.CalendarMultiGet() + (dav.Prop() + dav.GetEtag()) + [dav.Href(value=str(getattr(result.url, "path", result.url))) for result in written]
+        try:
+            response = calendar.client.report(str(calendar.url), etree.tostring(query.xmlelement(), encoding="utf-8", xml_declaration=True), 1)
+            if response.status >= 400:
+                return
+            found = {_path(href): props.get(dav.GetEtag.tag) for href, props in response.expand_simple_props([dav.GetEtag()]).items()}
+        except (error.DAVError, NotImplementedError, DeadlineExceeded):
+            return
+        for result in written:
+            # Missing events are reported with a 404 status and without an ETag.
+            result.etag = found.get(_path(result.url))
+            result.verified = result.etag is not None
+
+    def run(self, progress=None):
+        """
+        Send all queued operations and empty the queue.
+
+        Args:
+            progress (callable, optional): Called with (processed, total) after every operation.
+
+        Returns:
+            WriteReport: The outcome of every operation. Failed operations do not stop the others.
+        """
+        operations, self._operations = self._operations, []
+        total = len(operations)
+        processed = [0]
+        lock = threading.Lock()
+        started = time.perf_counter()
+
+        def execute(operation):
+            kind, uid, args = operation
+            result = OperationResult(kind, uid)
+            operation_started = time.perf_counter()
+            try:
+                deadline.check(f"the {kind} of {uid}")
+                result.url = getattr(self, f"_run_{kind}")(uid, *args)
+            except Exception as e:
+                result.error = e
+            result.duration = time.perf_counter() - operation_started
+            with lock:
+                processed[0] += 1
+                if progress:
+                    progress(processed[0], total)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(deadline.bind(execute), operations))
+
+        if self.verify:
+            self._verify(results)
+
+        return WriteReport(results, time.perf_counter() - started)